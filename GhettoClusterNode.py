@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-import config, logging, pprint, time, signal, os, sys
-from GhettoClusterSource import GhettoClusterSource
+import config, logging, pprint, time, signal, os, sys, inotify, governor
+import shared_scan, scanner, repair
+from statusfier import state_filename
+from GhettoClusterSource import GhettoClusterSource, run_shared
 from GhettoClusterReplica import GhettoClusterReplica
 from utils import str_to_duration, duration_to_str
+from threading import Thread
 
 
 class WakeupException(Exception):
@@ -22,6 +25,8 @@ class GhettoClusterNode:
         self.config.init(configfile, hostname, testing=testing)
         self.testing = testing
         self.verbose = self.config.getOption("verbose", "False") == "True"
+        self.watching = False
+        self.watchers = {}  # context -> inotify.Watcher
 
 
     def cleanup(self):
@@ -86,15 +91,34 @@ class GhettoClusterNode:
             print("I host no sources; nothing to restore")
 
 
+    # mend bitrot in a source file from the replicas; see repair.py
+    def repair(self, filename):
+        filename = os.path.realpath(filename)
+        sources = self.config.get_sources_for_host(self.hostname)
+        for context, source in sources.items():
+            path = os.path.realpath(config.path_for(source))
+            if not filename.startswith(f"{path}/"):
+                continue
+            relative = os.path.relpath(filename, path)
+            fqde = scanner.fqde_for(os.path.dirname(relative) or ".",
+                                    os.path.basename(relative))
+            replicas = self.config.get_replicas_for_context(context)
+            fixer = repair.Repair(context, config.path_for(source),
+                                  state_filename(context, source, source),
+                                  replicas, self.hostname)
+            return fixer.repair(fqde)
+        self.logger.warn(f"{filename} isn't in any of my sources")
+        return False
+
+
     def run(self, scan_only=False, deleting=False):
         self.logger.info(f"Running for {self.hostname}")
         self.config.load()
+        # before any source threads: Singleton.instance() isn't thread-safe
+        governor.Governor.instance()
         sources = self.config.get_sources_for_host(self.hostname)
         if len(sources.items()) > 0:
-            for context, source, in sources.items():
-                gcs = GhettoClusterSource(context, source, self.testing)
-                gcs.run()
-                gcs.get_status()
+            self.run_sources(sources)
         else:
             self.logger.info(f"I host no sources")
         replicas = self.config.get_replicas_for_host(self.hostname)
@@ -110,7 +134,58 @@ class GhettoClusterNode:
             self.logger.info(f"I host no replicas")
 
 
+    # "parallel sources: True" scans all of them at the same time.
+    # Sources in the same directory (or one inside another) share a
+    # walk, unless "shared scans: False"
+    def run_sources(self, sources):
+        gcss = [ GhettoClusterSource(context, source, self.testing,
+                                     self.journal_for(context, source)) \
+                    for context, source in sources.items() ]
+        if self.config.getOption("shared scans", "True") == "True":
+            groups = shared_scan.group(gcss, lambda gcs: gcs.path)
+        else:
+            groups = [ [ gcs ] for gcs in gcss ]
+        if len(groups) > 1 and \
+                self.config.getOption("parallel sources", "False") == "True":
+            threads = [ Thread(target=run_shared, args=(group,), daemon=True,
+                               name=f"source-{group[0].context}") \
+                            for group in groups ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for gcs in gcss:
+                gcs.get_status()
+        else:
+            for group in groups:
+                run_shared(group)
+                for gcs in group:
+                    gcs.get_status()
+
+
+    # with "inotify: True", a long-running node watches its sources
+    # between cycles, so scans only revisit what changed
+    def journal_for(self, context, source):
+        if not self.watching or self.config.getConfig(context, 
+                                        "inotify", "False")[0] != "True":
+            return None
+        watcher = self.watchers.get(context)
+        if watcher is not None and watcher.path != config.path_for(source):
+            watcher.stop()
+            watcher = None
+        if watcher is None:
+            if not inotify.available():
+                self.logger.warn("inotify is not available here")
+                return None
+            self.logger.info(f"Watching {context}:{source}")
+            gcs = GhettoClusterSource(context, source, self.testing)
+            watcher = gcs.watch()
+            self.watchers[context] = watcher
+        return watcher.journal
+
+
     def run_forever(self, deleting=False):
+        self.watching = True
         try:
             signal.signal(signal.SIGHUP, self.wakeup)
             signal.signal(signal.SIGTERM, self.go_peacefully)
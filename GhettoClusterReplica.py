@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
 import config, logging, pprint
-import persistent_dict, rsync, scanner, statusfier
+import persistent_dict, rsync, scanner, statusfier, ignore_rules, scrubber
+import file_state, seed, transfer_hasher, transfer_plan
 import signal, elapsed, time, os
 from threading import Thread
 from utils import str_to_duration, duration_to_str
@@ -24,36 +25,90 @@ class GhettoClusterReplica:
         hostname = config.host_for(replica)
         self.path = config.path_for(replica)
         self.states_filename = f"{self.path}/.gc/{hostname}.{context}.json"
+        self.transfer = None    # a TransferHasher, while run() pulls
 
 
     def pull(self, deleting=False):
         self.logger.debug("Pulling")
         # print(f"running for {self.path} <= {self.source}")
         self.logger.info(f"pulling {self.path} <= {self.source}")
+        options = self.config.getConfig(self.context, "rsync options")
+        self.prepare(deleting and "delete" in options)
         args = [ "-a" ]
         if self.verbose:
             args.append("-v")
-        options = self.config.getConfig(self.context, "rsync options")
         if len(options) > 0:
             if not deleting and "delete" in options:
                 options.remove("delete")
             args += [ f"--{option}" for option in options ]
-        ignorals = self.config.get_ignorals(self.context)
-        if len(ignorals) > 0:
-            args += [ f"--exclude={item}" for item in ignorals ]
+        if self.hard_links() and "--hard-links" not in args:
+            args.append("--hard-links")
+        # the scanner's rules, so rsync and the scanner agree
+        rules = ignore_rules.IgnoreRules(self.config.get_ignorals(self.context))
+        filter_file = scanner.cache_filename(self.states_filename, "filter")
+        os.makedirs(os.path.dirname(filter_file), exist_ok=True)
+        rules.write_rsync_filter(filter_file)
+        args.append(f"--filter=merge {filter_file}")
+        line_callback = None
+        if self.transfer is not None:
+            args.append(self.transfer.out_format())
+            line_callback = self.transfer.line
         self.logger.debug("Starting rsync pull...")
         self.logger.debug(f"rsync {' '.join(args)} {self.source} {self.path}")
-        rsync.rsync(self.source, self.path, args)
+        rsync.rsync(self.source, self.path, args, context=self.context,
+                    line_callback=line_callback)
+        if self.transfer is not None:
+            self.transfer.wait()
         self.pull_states()
 
 
+    # before the pull, by the source's latest state: files which have
+    # only moved at the source are moved here too ("transfer plan";
+    # see transfer_plan.py), then files we don't have yet, but another
+    # folder on this host does, are copied from there ("seed from
+    # replicas"; see seed.py).  rsync only sends what's left.
+    # removing: the pull deletes, so moving files away is all right
+    def prepare(self, removing=False):
+        planning = self.config.getConfig(self.context, "transfer plan",
+                                         "False")[0] == "True"
+        seeder = seed.Seeder(self.context, self.replica)
+        if not planning and seeder.min_size <= 0:
+            return
+        self.pull_states()
+        source_file = state_filename(self.context, self.replica, self.source)
+        if not os.path.exists(source_file):
+            return
+        source_states = persistent_dict.PersistentDict(source_file,
+                                            decode=file_state.decode)
+        if planning and os.path.exists(self.states_filename):
+            replica_states = persistent_dict.PersistentDict(
+                            self.states_filename, decode=file_state.decode)
+            transfer_plan.apply(transfer_plan.plan(source_states,
+                                        replica_states, self.path, removing),
+                                self.path)
+        if seeder.min_size > 0:
+            seeder.seed(source_states)
+
+
+    # does the source have link groups?  Then rsync -H, or we'd pull a
+    # copy per link.  Goes by the source state from the last pull
+    def hard_links(self):
+        source_file = state_filename(self.context, self.replica, self.source)
+        if not os.path.exists(source_file):
+            return False
+        states = persistent_dict.PersistentDict(source_file,
+                                                decode=file_state.decode)
+        return len(file_state.link_groups(states)) > 0
+
+
     def pull_states(self):
         self.logger.info("  Pulling source state")
-        args = [ "--delete", "-a" ]
+        # *.cache is per-host scanner bookkeeping; leave ours alone
+        args = [ "--delete", "-a", "--exclude=*.cache" ]
         if self.verbose:
             args.append("-v")
         rsync.rsync(f"{self.source}.gc", self.path, 
-                    args, stfu=False)
+                    args, stfu=False, context=self.context)
 
 
     def push(self):
@@ -63,7 +118,7 @@ class GhettoClusterReplica:
         else:
             args = []
         rsync.rsync(self.states_filename, f"{self.source}.gc", 
-                    args, stfu=False)
+                    args, stfu=False, context=self.context)
 
 
     def cleanup(self):
@@ -86,30 +141,49 @@ class GhettoClusterReplica:
         self.logger.info(f"Running, {self.context}:{self.path}")
         if deleting:
             self.logger.info(f"Deleting :|")
+        ignorals = self.config.get_ignorals(self.context)
+        scn = scanner.Scanner(self.path, ignorals, self.states_filename,
+                              self.context)
+        # "transfer digests: True": hash what rsync brings in, as it does
+        if self.config.getConfig(self.context, "transfer digests",
+                                 "False")[0] == "True":
+            self.transfer = transfer_hasher.TransferHasher(self.path,
+                                    self.states_filename, self.context)
+            # ahead of the StateWriter: it fills in the checksums
+            scn.consumers.insert(0, self.transfer)
         puller = Thread(target=self.pull, args=(deleting,))
         self.logger.debug("Starting pull thread")
         puller.start()
         timer = elapsed.ElapsedTimer()
-        ignorals = self.config.get_ignorals(self.context)
-        scn = scanner.Scanner(self.path, ignorals, self.states_filename)
+        budget = scanner.scan_budget(self.context)
         while puller.is_alive():
             if timer.once_every(300):
-                scn.scan()
+                scn.scan(budget=budget)
                 self.push()
                 self.get_status(brief=True)
             else:
                 time.sleep(1)
         puller.join()
-        scn.scan()
+        # the pull is done: one whole pass over what it left
+        scn.restart()
+        while not scn.scan(budget=budget):
+            self.push()
+            self.get_status(brief=True)
         self.push()
+        self.transfer = None
+        # "scrub: True": our own copies rot too; see scrubber.py
+        scrubber.scrub(self.context, self.path, self.states_filename)
         self.logger.info(f"Finished: {self.context}:{self.path}")
-        
+
 
     def scan_only(self):
         self.logger.info(f"Only scanning {self.context}:{self.path}")
         ignorals = self.config.get_ignorals(self.context)
-        scn = scanner.Scanner(self.path, ignorals, self.states_filename)
-        scn.scan()
+        scn = scanner.Scanner(self.path, ignorals, self.states_filename,
+                              self.context)
+        while not scn.scan(budget=scanner.scan_budget(self.context)):
+            self.push()
+            self.get_status(brief=True)
         self.push()
         self.get_status(brief=True)
         self.logger.info(f"Finished: {self.context}:{self.path}")
@@ -1,20 +1,22 @@
 #!/usr/bin/env python3
 
 import config, logging, pprint
-import persistent_dict, scanner, statusfier
+import persistent_dict, scanner, statusfier, inotify, shared_scan, scrubber
 import os, os.path
 from statusfier import state_filename
+from utils import str_to_duration
 
 
 # a Node may have 0 or more Sources
 # they may run() in an independent thread
 class GhettoClusterSource:
-    def __init__(self, context, source, testing=False):
+    def __init__(self, context, source, testing=False, journal=None):
         self.logger = logging.getLogger("gc.GhettoClusterSource")
         self.config = config.Config.instance()
         self.context = context
         self.source = source
         self.testing = testing
+        self.journal = journal
         self.verbose = self.config.getOption("verbose", "False") == "True"
         self.path = config.path_for(source)
         hostname = config.host_for(source)
@@ -75,8 +77,68 @@ class GhettoClusterSource:
             print(f"\trsync -av {replica}/ {self.path}")
 
 
+    # the same as a Node does it, with any others: see run_shared()
     def run(self):
-        self.logger.info(f"Running for {self.context}:{self.source}")
+        run_shared([ self ])
+
+
+    def scanner(self):
+        ignorals = self.config.get_ignorals(self.context)
+        return scanner.Scanner(self.path, ignorals, self.states_filename,
+                               self.context)
+
+
+    # what the journal says changed (None: scan everything).  While a
+    # full scan is part-way done, leave the journal be: it still has
+    # whatever changed behind the cursor
+    def dirty(self, scn):
+        if self.journal is None or scn.resuming():
+            return None
+        return self.journal.drain()
+
+
+    # a Node keeps these watching between cycles; see inotify.py
+    def watch(self):
         ignorals = self.config.get_ignorals(self.context)
-        scn = scanner.Scanner(self.path, ignorals, self.states_filename)
-        scn.scan()
+        full_every = str_to_duration(self.config.getConfig(self.context,
+                                            "full scan", "24h")[0])
+        journal = inotify.Journal(
+                    scanner.cache_filename(self.states_filename, "journal"),
+                    full_every)
+        watcher = inotify.Watcher(self.path, ignorals, journal)
+        watcher.start()
+        return watcher
+
+
+
+# sources in the same directory, or one inside another: one walk does
+# for all of their full scans; see shared_scan.py
+def run_shared(gcss):
+    pending = []
+    for gcs in gcss:
+        gcs.logger.info(f"Running for {gcs.context}:{gcs.source}")
+        scn = gcs.scanner()
+        dirty = gcs.dirty(scn)
+        if dirty is not None:
+            scn.scan(dirty)
+        else:
+            pending.append((gcs, scn))
+    while len(pending) > 0:
+        unfinished = []
+        for members in shared_scan.group(pending, lambda item: item[1].path):
+            budgets = [ scanner.scan_budget(gcs.context) \
+                            for gcs, scn in members ]
+            if len(members) == 1:
+                complete = [ members[0][1].scan(None, budgets[0]) ]
+            else:
+                complete = shared_scan.SharedScan(
+                            [ scn for gcs, scn in members ]).scan(budgets)
+            for (gcs, scn), done in zip(members, complete):
+                if not done:
+                    gcs.get_status()
+                    unfinished.append((gcs, scn))
+        pending = unfinished
+    # "scrub: True": then re-read the files verified longest ago, for
+    # bitrot; see scrubber.py
+    for gcs in gcss:
+        scrubber.scrub(gcs.context, gcs.path, gcs.states_filename)
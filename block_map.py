@@ -0,0 +1,168 @@
+#! python3.x
+
+"""
+usage:
+    checksum, bmap = block_map.build(fname, "sha256", 2**20)
+    bmap.root()                             # the Merkle root, as hex
+    block_map.save(bmap, block_map.side_filename(states_filename, checksum))
+    good = block_map.load(...)
+    good.differences(block_map.build(fname, ...)[1])   # [ (first, count) ]
+
+Theory of Operation:
+    For a big file, a digest of each BLOCKSIZE block as well as of the
+    whole thing, so that bitrot can be pinned down to a few blocks --
+    and only those fetched again (see repair.py) -- instead of the
+    whole 50GB.
+
+    The block digests don't go in the JSON state; they go in a side
+    file, one per content, under .gc/<host>.<context>.blocks.cache/:
+
+        { "algorithm" : ..., "blocksize" : ..., "size" : ..., "root" : ... }\\n
+        <digest of block 0><digest of block 1>...    (raw bytes)
+
+    which is 32 bytes a megabyte for sha256.  Side files are named for
+    the file's checksum, so renames and copies share one; the state
+    entry only records the Merkle root ("blocks"), and prune() drops
+    side files no state entry refers to.
+
+    The root is a binary Merkle tree over the block digests (an odd
+    one out goes up a level as it is); two roots being equal means
+    every block is.
+"""
+
+import os, json, logging
+import digests, block_reader
+
+
+class BlockMap:
+    def __init__(self, algorithm, blocksize, hashes = None, size = 0):
+        self.algorithm = algorithm
+        self.blocksize = blocksize
+        self.hashes = hashes if hashes is not None else []
+        self.size = size
+
+
+    def add(self, block):
+        h = digests.new(self.algorithm)
+        h.update(block)
+        self.hashes.append(h.digest())
+        self.size += len(block)
+
+
+    def root(self):
+        level = self.hashes
+        if len(level) == 0:
+            return digests.new(self.algorithm).hexdigest()
+        while len(level) > 1:
+            parents = []
+            for i in range(0, len(level) - 1, 2):
+                h = digests.new(self.algorithm)
+                h.update(level[i] + level[i+1])
+                parents.append(h.digest())
+            if len(level) % 2 == 1:
+                parents.append(level[-1])
+            level = parents
+        return level[0].hex()
+
+
+    # [ (first block, count) ]: the runs of blocks where other (the
+    # same file, as it is now) doesn't match
+    def differences(self, other):
+        runs = []
+        n = max(len(self.hashes), len(other.hashes))
+        for i in range(n):
+            mine = self.hashes[i] if i < len(self.hashes) else None
+            theirs = other.hashes[i] if i < len(other.hashes) else None
+            if mine == theirs:
+                continue
+            if len(runs) > 0 and runs[-1][0] + runs[-1][1] == i:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((i, 1))
+        return runs
+
+
+    # is data block i, as it should be?
+    def check(self, i, data):
+        h = digests.new(self.algorithm)
+        h.update(data)
+        return i < len(self.hashes) and h.digest() == self.hashes[i]
+
+
+
+# one pass over fname: (tagged checksum, BlockMap); None if cancelled
+def build(fname, algorithm, blocksize, throttle = None, cancelled = None):
+    whole = digests.new(algorithm)
+    bmap = BlockMap(algorithm, blocksize)
+    with open(fname, "rb", buffering=0) as f:
+        filestat = os.fstat(f.fileno())
+        for block in block_reader.blocks(f, block_reader.sequential(blocksize),
+                                         blocksize, throttle, filestat.st_dev,
+                                         cancelled, filestat.st_size):
+            whole.update(block)
+            bmap.add(block)
+    if cancelled is not None and cancelled.is_set():
+        return None
+    return digests.tag(algorithm, whole.hexdigest()), bmap
+
+
+
+# host.context.json, checksum -> .../host.context.blocks.cache/<checksum>
+def side_filename(states_filename, checksum):
+    if states_filename.endswith(".json"):
+        states_filename = states_filename[:-len(".json")]
+    return f"{states_filename}.blocks.cache/{checksum.replace(':', '.')}"
+
+
+def save(bmap, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    header = { "algorithm" : bmap.algorithm,
+               "blocksize" : bmap.blocksize,
+               "size" : bmap.size,
+               "root" : bmap.root() }
+    tmpfile = f"{filename}.tmp"
+    with open(tmpfile, "wb") as f:
+        f.write(json.dumps(header, sort_keys=True).encode() + b"\n")
+        f.write(b"".join(bmap.hashes))
+    os.rename(tmpfile, filename)
+
+
+def header(filename):
+    try:
+        with open(filename, "rb") as f:
+            return json.loads(f.readline())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+# a BlockMap, or None if there isn't one (or it's damaged)
+def load(filename):
+    logger = logging.getLogger("gc.block_map")
+    try:
+        with open(filename, "rb") as f:
+            info = json.loads(f.readline())
+            raw = f.read()
+    except FileNotFoundError:
+        return None
+    except ValueError as err:
+        logger.warn(f"{filename}: {err}")
+        return None
+    width = digests.new(info["algorithm"]).digest_size
+    hashes = [ raw[i:i+width] for i in range(0, len(raw), width) ]
+    bmap = BlockMap(info["algorithm"], info["blocksize"], hashes, info["size"])
+    if bmap.root() != info["root"]:
+        logger.warn(f"{filename} doesn't match its own root; ignoring it")
+        return None
+    return bmap
+
+
+# drop the side files for checksums not in wanted (a set)
+def prune(states_filename, wanted):
+    dir = os.path.dirname(side_filename(states_filename, "x"))
+    if not os.path.isdir(dir):
+        return
+    keep = set([ os.path.basename(side_filename(states_filename, checksum)) \
+                    for checksum in wanted ])
+    for name in os.listdir(dir):
+        if name not in keep:
+            os.unlink(f"{dir}/{name}")
@@ -0,0 +1,92 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil, hashlib
+import block_map, repair, persistent_dict
+
+BLOCK = 1000
+
+class TestBlockMapMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for copy in ("source", "replica1", "replica2"):
+            os.makedirs(f"{tempdir}/{copy}")
+        data = os.urandom(10 * BLOCK + 10)
+        for copy in ("source", "replica1", "replica2"):
+            with open(f"{tempdir}/{copy}/film", "wb") as f:
+                f.write(data)
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def rot(self, copy, offset):
+        fname = f"{tempdir}/{copy}/film"
+        stat = os.stat(fname)
+        with open(fname, "r+b") as f:
+            f.seek(offset)
+            byte = f.read(1)
+            f.seek(offset)
+            f.write(bytes([ byte[0] ^ 0xff ]))
+        os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def record(self):
+        fname = f"{tempdir}/source/film"
+        checksum, bmap = block_map.build(fname, "sha256", BLOCK)
+        statefile = f"{tempdir}/source/.gc/host.1.json"
+        block_map.save(bmap, block_map.side_filename(statefile, checksum))
+        states = persistent_dict.PersistentDict(statefile)
+        stat = os.stat(fname)
+        states.set("./film", { "checksum" : checksum, "blocks" : bmap.root(),
+                               "size" : stat.st_size,
+                               "mtime" : stat.st_mtime })
+        states.write()
+        return checksum, bmap, statefile
+
+    def test_build(self):
+        checksum, bmap, statefile = self.record()
+        with open(f"{tempdir}/source/film", "rb") as f:
+            self.assertEqual(checksum, hashlib.sha256(f.read()).hexdigest())
+        self.assertEqual(len(bmap.hashes), 11)
+        loaded = block_map.load(block_map.side_filename(statefile, checksum))
+        self.assertEqual(loaded.root(), bmap.root())
+        self.assertEqual(loaded.hashes, bmap.hashes)
+        self.rot("source", 3 * BLOCK + 5)
+        self.rot("source", 4 * BLOCK)
+        self.rot("source", 9 * BLOCK + 999)
+        checksum, now = block_map.build(f"{tempdir}/source/film", "sha256",
+                                        BLOCK)
+        self.assertNotEqual(now.root(), bmap.root())
+        self.assertEqual(bmap.differences(now), [ (3, 2), (9, 1) ])
+        block_map.prune(statefile, set())
+        self.assertIsNone(block_map.load(block_map.side_filename(statefile,
+                                                                 checksum)))
+
+    def test_repair(self):
+        checksum, bmap, statefile = self.record()
+        self.rot("source", 2 * BLOCK + 1)
+        self.rot("source", 7 * BLOCK + 1)
+        self.rot("replica1", 2 * BLOCK + 2)     # no good for block 2
+        stat = os.stat(f"{tempdir}/source/film")
+        fixer = repair.Repair(0, f"{tempdir}/source", statefile,
+                              [ f"here:{tempdir}/replica1",
+                                f"here:{tempdir}/replica2" ], "here")
+        self.assertTrue(fixer.repair("./film"))
+        with open(f"{tempdir}/source/film", "rb") as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), checksum)
+        self.assertEqual(os.stat(f"{tempdir}/source/film").st_mtime_ns,
+                         stat.st_mtime_ns)
+
+    def test_unrepairable(self):
+        checksum, bmap, statefile = self.record()
+        for copy in ("source", "replica1", "replica2"):
+            self.rot(copy, 5 * BLOCK)
+        fixer = repair.Repair(0, f"{tempdir}/source", statefile,
+                              [ f"here:{tempdir}/replica1",
+                                f"here:{tempdir}/replica2" ], "here")
+        self.assertFalse(fixer.repair("./film"))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBlockMapMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,145 @@
+#! python3.x
+
+"""
+usage:
+    with open(fname, "rb") as f:
+        for block in block_reader.blocks(f, block_reader.sequential(bs), bs):
+            hash.update(block)          # a memoryview: don't keep it
+
+Theory of Operation:
+    f.read() makes a new bytes object for every block, and hashing a
+    40GB film that way also pushes everything useful out of the source
+    box's page cache.  Instead:
+
+      - two bytearrays, reused: readinto() one while the caller hashes
+        the other.  The reading happens in a helper thread -- both
+        readinto() and hashlib let go of the GIL, so the disk and the
+        CPU are busy at the same time.  Files of a block or two are
+        read inline; a thread isn't worth it.
+      - posix_fadvise(SEQUENTIAL) when reading straight through, so the
+        kernel reads ahead harder, and DONTNEED on each block once it's
+        been hashed, so we don't evict what other people are using.
+
+    offsets says where each block starts (readahead: it's straight
+    through, e.g. sequential()); blocks() stops at the first
+    empty read (end of file).  The reads are paced by the throttle,
+    and stop as soon as cancelled (a threading.Event) is set.
+"""
+
+import os, threading, collections
+
+
+# 0, bs, 2*bs, ...
+def sequential(blocksize):
+    offset = 0
+    while True:
+        yield offset
+        offset += blocksize
+
+
+def advise(fd, offset, length, advice):
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
+
+# a block read into buffer, at offset; returns its length (0: EOF)
+def read_into(f, offset, buffer):
+    if f.tell() != offset:
+        f.seek(offset)
+    return f.readinto(buffer)
+
+
+def blocks(f, offsets, blocksize, throttle = None, st_dev = None,
+           cancelled = None, size = None, readahead = True, dontneed = True):
+    fd = f.fileno()
+    if size is None:
+        size = os.fstat(fd).st_size
+    offsets = iter(offsets)
+    if readahead and hasattr(os, "POSIX_FADV_SEQUENTIAL"):
+        advise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    if size <= 2 * blocksize:
+        reader = inline(f, offsets, blocksize, throttle, st_dev, cancelled)
+    else:
+        reader = prefetched(f, offsets, blocksize, throttle, st_dev,
+                            cancelled)
+    try:
+        for offset, block in reader:
+            yield block
+            if dontneed and hasattr(os, "POSIX_FADV_DONTNEED"):
+                advise(fd, offset, len(block), os.POSIX_FADV_DONTNEED)
+    finally:
+        reader.close()
+
+
+# one buffer, one thread: (offset, memoryview)s
+def inline(f, offsets, blocksize, throttle, st_dev, cancelled):
+    buffer = bytearray(blocksize)
+    view = memoryview(buffer)
+    for offset in offsets:
+        if cancelled is not None and cancelled.is_set():
+            return
+        if throttle is not None:
+            throttle.read(blocksize, st_dev)
+        n = read_into(f, offset, buffer)
+        if n == 0:
+            return
+        yield offset, view[:n]
+
+
+# two buffers: a helper thread fills one while the caller has the other
+def prefetched(f, offsets, blocksize, throttle, st_dev, cancelled):
+    buffers = [ bytearray(blocksize), bytearray(blocksize) ]
+    views = [ memoryview(buffer) for buffer in buffers ]
+    ready = collections.deque()     # (offset, buffer index, n); n 0: EOF
+    cv = threading.Condition()
+    state = { "taken" : 0, "stop" : False, "error" : None }
+
+    def read():
+        try:
+            for i, offset in enumerate(offsets):
+                with cv:
+                    # buffer i % 2 is free once the caller is past block i-2
+                    while i - state["taken"] >= 2 and not state["stop"]:
+                        cv.wait()
+                    if state["stop"]:
+                        return
+                if cancelled is not None and cancelled.is_set():
+                    break
+                if throttle is not None:
+                    throttle.read(blocksize, st_dev)
+                n = read_into(f, offset, buffers[i % 2])
+                with cv:
+                    ready.append((offset, i % 2, n))
+                    cv.notify_all()
+                if n == 0:
+                    return
+        except BaseException as err:
+            state["error"] = err
+        with cv:
+            ready.append((None, 0, 0))
+            cv.notify_all()
+
+    thread = threading.Thread(target=read, daemon=True, name="prefetch")
+    thread.start()
+    try:
+        while True:
+            with cv:
+                while len(ready) == 0:
+                    cv.wait()
+                offset, i, n = ready.popleft()
+            if n == 0:
+                if state["error"] is not None:
+                    raise state["error"]
+                return
+            yield offset, views[i][:n]
+            with cv:
+                state["taken"] += 1
+                cv.notify_all()
+    finally:
+        with cv:
+            state["stop"] = True
+            cv.notify_all()
+        thread.join()
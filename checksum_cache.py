@@ -0,0 +1,101 @@
+#! python3.x
+
+"""
+usage:
+    cache = checksum_cache.ChecksumCache(".gc/host.1.checksums.cache")
+    checksum = cache.lookup(filestat, "sha256")     # None: not known
+    cache.remember(filestat, checksum)
+    cache.finish()                          # evict & write
+
+Theory of Operation:
+    The state is keyed by path, and any ctime change makes it suspect
+    -- so a chmod / chown sweep, or moving a directory of films
+    somewhere else, would have every file hashed all over again.  This
+    cache is keyed by what the content actually hangs off instead:
+
+        "st_dev:st_ino:size:mtime_ns" -> [ checksum, last used ]
+
+    A rename keeps the inode and the mtime; chmod keeps the mtime.
+    Writing the file changes the mtime (or the size), so the key
+    misses and it gets hashed.
+
+    Checksums are tagged with their algorithm (digests.py); lookup()
+    only returns one in the algorithm asked for.
+
+    Every hash goes in, and so does every UNCHANGED file which already
+    has a checksum, so a tree hashed before the cache existed is
+    covered after one scan.  Past "checksum cache size" entries, the
+    least recently used go first: files which haven't been seen for a
+    while have probably been deleted.
+"""
+
+import time, logging
+import persistent_dict, digests
+
+
+DEFAULT_SIZE = 1000000
+
+
+# a real digest, not a placeholder
+def known(checksum):
+    return checksum not in (None, 'deferred', 'n/a')
+
+
+def key_for(filestat):
+    return f"{filestat.st_dev}:{filestat.st_ino}:" \
+           f"{filestat.st_size}:{filestat.st_mtime_ns}"
+
+
+class ChecksumCache:
+    def __init__(self, filename, size = DEFAULT_SIZE, lazy_timer = 0):
+        self.logger = logging.getLogger("gc.checksum_cache")
+        self.entries = persistent_dict.PersistentDict(filename, lazy_timer)
+        self.size = size
+        self.hits = self.misses = 0
+        self.now = time.time()
+
+
+    def lookup(self, filestat, algorithm = None):
+        entry = self.entries.data.get(key_for(filestat))
+        if entry is None or (algorithm is not None \
+                    and digests.algorithm_of(entry[0]) != algorithm):
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry[1] = self.now
+        self.entries.dirty = True
+        return entry[0]
+
+
+    def remember(self, filestat, checksum):
+        if not known(checksum):
+            return
+        key = key_for(filestat)
+        entry = self.entries.data.get(key)
+        if entry is not None and entry[0] == checksum:
+            entry[1] = self.now
+        else:
+            self.entries.data[key] = [ checksum, self.now ]
+        self.entries.dirty = True
+
+
+    # least recently used first, down to size
+    def evict(self):
+        excess = len(self.entries.data) - self.size
+        if excess <= 0:
+            return
+        oldest = sorted(self.entries.data.items(), key=lambda item: item[1][1])
+        for key, entry in oldest[:excess]:
+            del self.entries.data[key]
+        self.logger.debug(f"evicted {excess} checksums")
+
+
+    def finish(self):
+        self.evict()
+        if self.entries.dirty:
+            self.entries.write()
+        if self.hits > 0:
+            self.logger.info(f"  reused {self.hits} checksums " \
+                             f"({self.misses} to hash)")
+        self.hits = self.misses = 0
+        self.now = time.time()
@@ -0,0 +1,150 @@
+#! python3.x
+
+"""
+usage:
+    churn = churn.Churn(".gc/host.1.churn.cache")
+    churn.begin()                   # each scan
+    skip = churn.plan(cold_after, max_interval, last_scan)
+    scanner walks everything but skip; for each directory it lists
+        churn.scanned(path)
+    and churn.consume(events) notes which ones changed
+    churn.finish()
+
+Theory of Operation:
+    For each directory we keep
+        changed:  the last time anything in or under it changed
+        changes:  how many scans have seen something change there
+        scanned:  the last time a full scan listed it
+    A change marks the directory and all of its ancestors, so
+    "changed" covers the whole subtree.
+
+    A subtree which hasn't changed in cold_after is cold; plan()
+    picks the biggest cold subtrees (a cold directory with a hot
+    parent, or at the top) and skips most of them.  Each scan takes the
+    least-recently-scanned share of them -- enough that, at the rate
+    scans are happening, every one comes round within max_interval --
+    plus any which are overdue.  Hot directories are scanned every
+    time.
+
+    Something which changes in a skipped subtree is noticed when its
+    turn comes (or straight away with inotify: dirty directories are
+    always scanned).  On a directory's first sighting, its files'
+    ctimes stand in for "changed", so a tree which was already old
+    goes cold straight away.
+"""
+
+import logging, math, time
+import persistent_dict
+
+
+class Churn:
+    def __init__(self, filename, lazy_timer = 0):
+        self.logger = logging.getLogger("gc.churn")
+        self.dirs = persistent_dict.PersistentDict(filename, lazy_timer)
+        self.begin()
+
+
+    def begin(self):
+        self.now = time.time()
+        self.known = set(self.dirs.data.keys())
+        self.marked = set()     # dirs whose change is already counted
+
+
+    def scanned(self, path):
+        entry = self.dirs.data.get(path)
+        if entry is None:
+            entry = { "changed" : 0, "changes" : 0 }
+        entry["scanned"] = self.now
+        self.dirs.data[path] = entry
+        self.dirs.touch(path)
+
+
+    # when: None => now; else a file's ctime (a first sighting)
+    def changed(self, path, when = None):
+        counting = when is None
+        when = self.now if when is None else when
+        while True:
+            entry = self.dirs.data.setdefault(path,
+                        { "changed" : 0, "changes" : 0, "scanned" : 0 })
+            entry["changed"] = max(entry["changed"], when)
+            if counting and path not in self.marked:
+                entry["changes"] += 1
+                self.marked.add(path)
+            self.dirs.touch(path)
+            if path == ".":
+                return
+            path = parent(path)
+
+
+    def consume(self, events):
+        for event in events:
+            if event.kind == "unchanged":
+                continue
+            path = event.fqde.rsplit("/", 1)[0]
+            if event.kind == "new" and path not in self.known:
+                self.changed(path, event.stat.st_ctime)
+            else:
+                self.changed(path)
+
+
+    def finish(self):
+        self.dirs.write()
+
+
+    # the biggest cold subtrees: cold, with a hot parent.  "." has no
+    # parent, and is never skipped, so it counts as hot here: a tree
+    # that's cold from the top down still has its top-level dirs
+    def cold(self, cold_after):
+        cutoff = self.now - cold_after
+        return sorted([ path for path, entry in self.dirs.data.items() \
+                        if path != "." and entry["changed"] < cutoff \
+                            and (parent(path) == "." \
+                                or self.dirs.data.get(parent(path), {}) \
+                                        .get("changed", self.now) >= cutoff) ])
+
+
+    # returns the set of cold subtrees to leave out of this scan;
+    # last_scan: when the previous one was (0: never)
+    def plan(self, cold_after, max_interval, last_scan = 0):
+        cold = self.cold(cold_after)
+        cold.sort(key=lambda path: self.dirs.data[path]["scanned"])
+        since = self.now - last_scan
+        quota = math.ceil(len(cold) * since / max_interval)
+        overdue = len([ path for path in cold \
+                        if self.dirs.data[path]["scanned"] + max_interval \
+                            <= self.now ])
+        skip = set(cold[max(quota, overdue):])
+        self.logger.debug(f"{len(cold)} cold subtrees; skipping {len(skip)}")
+        return skip
+
+
+    # keeps (from the next prune()) the entries which pass test
+    def keep(self, test):
+        for path in self.dirs.data:
+            if test(path):
+                self.dirs.touch(path)
+
+
+    # forget directories which weren't seen (a complete scan)
+    def prune(self):
+        for path in self.dirs.clean_keys():
+            self.dirs.delete(path)
+        self.dirs.clear_dirtybits()
+
+
+
+def parent(path):
+    if "/" not in path:
+        return "."
+    return path.rsplit("/", 1)[0]
+
+
+# is path (a dir) at or under any of subtrees?
+def under(path, subtrees):
+    if len(subtrees) == 0:
+        return False
+    while path != ".":
+        if path in subtrees:
+            return True
+        path = parent(path)
+    return False
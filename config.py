@@ -232,7 +232,7 @@ class Config:
         if context in self.config:
             if key in self.config[context]:
                 return self.config[context][key]
-            if follow and key in self.config[0]:
+            if follow and 0 in self.config and key in self.config[0]:
                 return self.config[0][key]
         # print(f"Failed to find {context}=>{key}")
         return [default]
@@ -0,0 +1,135 @@
+#! python3.x
+
+"""
+usage:
+    h = digests.new("blake2b")
+    h.update(...)
+    checksum = digests.tag("blake2b", h.hexdigest())   # "blake2b:9f2c..."
+    digests.algorithm_of(checksum)                      # "blake2b"
+    digests.compare(checksum, other)    # True, False, or None: can't tell
+    digests.fastest()                   # e.g. "blake2b", on this box
+
+Theory of Operation:
+    A checksum says which algorithm made it: "blake2b:<hex>".  One
+    without a tag is sha256 -- that's every checksum from before there
+    was a choice, and what sha256 still writes, so old states and old
+    replicas stay readable.
+
+    "hash algorithm" is per context: sha256 is hardware-accelerated on
+    most x86 boxes, blake2b is often twice as fast on the ARM replicas.
+    Two checksums from different algorithms say nothing about each
+    other: compare() returns None, and the side which isn't in the
+    context's algorithm is hashed again (lazily: by the Hasher, as
+    scans come across it).
+
+    A sampled fingerprint (NBLOCKS blocks of a big file; see
+    file_state.sum_sampled) is its own kind: "sampled-blake2b:<hex>".
+    Different fingerprints mean the file changed; the same fingerprint
+    only means the sampled blocks (and the size) didn't.  That's cheap
+    enough to take again every scan ("resample: True"), which catches
+    what an mtime check misses.
+
+    "hash algorithm: fastest" times each of CANDIDATES over a buffer
+    (once per process) and uses the winner.  Hosts which pick
+    differently can't compare checksums without hashing again, so pin
+    it once you know.
+"""
+
+import hashlib, time, logging
+
+
+DEFAULT = "sha256"
+CANDIDATES = [ "sha256", "blake2b", "blake2s", "sha512" ]  # no broken ones
+UNTAGGED = "sha256"
+SAMPLED = "sampled-"
+
+_fastest = None
+
+
+# usable: in this hashlib, and a fixed-length digest (not shake_*)
+def available(algorithm):
+    if algorithm not in hashlib.algorithms_available:
+        return False
+    try:
+        return hashlib.new(algorithm).digest_size > 0
+    except ValueError:
+        return False
+
+
+def new(algorithm = DEFAULT):
+    return hashlib.new(algorithm)
+
+
+def tag(algorithm, hexdigest):
+    if algorithm == UNTAGGED:
+        return hexdigest
+    return f"{algorithm}:{hexdigest}"
+
+
+def algorithm_of(checksum):
+    if ":" in checksum:
+        return checksum.split(":", 1)[0]
+    return UNTAGGED
+
+
+def sampled_name(algorithm):
+    return f"{SAMPLED}{algorithm}"
+
+
+def sampled(checksum):
+    return algorithm_of(checksum).startswith(SAMPLED)
+
+
+# True / False if they're (not) the same content; None if they're from
+# different algorithms, so one of them needs hashing again.  Sampled
+# fingerprints: True is "probably"
+def compare(checksum, other):
+    if algorithm_of(checksum) != algorithm_of(other):
+        return None
+    return checksum == other
+
+
+# name from config: "sha256", "blake2b", ..., or "fastest"
+def resolve(name):
+    logger = logging.getLogger("gc.digests")
+    if name == "fastest":
+        return fastest()
+    if not available(name):
+        logger.warn(f"hash algorithm {name} is not available; " \
+                    f"using {DEFAULT}")
+        return DEFAULT
+    return name
+
+
+# { algorithm : MB/sec } hashing nbytes, best of repeat
+def benchmark(candidates = CANDIDATES, nbytes = 2**24, repeat = 3):
+    buffer = bytes(range(256)) * (nbytes // 256)
+    rates = {}
+    for algorithm in candidates:
+        if not available(algorithm):
+            continue
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            new(algorithm).update(buffer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        rates[algorithm] = nbytes / 2**20 / max(best, 0.000001)
+    return rates
+
+
+def fastest():
+    global _fastest
+    if _fastest is None:
+        rates = benchmark()
+        _fastest = max(rates, key=rates.get)
+        logging.getLogger("gc.digests").info(f"fastest hash algorithm: " \
+                    f"{_fastest}, {rates[_fastest]:,.0f} MB/sec")
+    return _fastest
+
+
+if __name__ == "__main__":
+    for algorithm, rate in sorted(benchmark().items(),
+                                  key=lambda item: -item[1]):
+        print(f"{algorithm:>8}: {rate:,.0f} MB/sec")
+    print(f"fastest: {fastest()}")
@@ -0,0 +1,33 @@
+#!/usr/local/bin/python3.6
+
+import unittest, hashlib
+import digests
+
+class TestDigestsMethods(unittest.TestCase):
+
+    def test_tag(self):
+        sha = hashlib.sha256(b"x").hexdigest()
+        blake = hashlib.blake2b(b"x").hexdigest()
+        self.assertEqual(digests.tag("sha256", sha), sha)
+        self.assertEqual(digests.algorithm_of(sha), "sha256")
+        self.assertEqual(digests.algorithm_of(digests.tag("blake2b", blake)),
+                         "blake2b")
+
+    def test_compare(self):
+        sha = digests.tag("sha256", hashlib.sha256(b"x").hexdigest())
+        blake = digests.tag("blake2b", hashlib.blake2b(b"x").hexdigest())
+        other = digests.tag("blake2b", hashlib.blake2b(b"y").hexdigest())
+        self.assertTrue(digests.compare(blake, blake))
+        self.assertFalse(digests.compare(blake, other))
+        self.assertIsNone(digests.compare(sha, blake))
+
+    def test_resolve(self):
+        self.assertEqual(digests.resolve("blake2s"), "blake2s")
+        self.assertEqual(digests.resolve("rot13"), digests.DEFAULT)
+        self.assertEqual(digests.resolve("shake_128"), digests.DEFAULT)
+        self.assertIn(digests.resolve("fastest"), digests.CANDIDATES)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDigestsMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,119 @@
+#! python3.x
+
+"""
+usage:
+    cache = dircache.DirCache(".gc/host.1.dirs.cache")
+    direntries = cache.lookup(path, os.stat(path))
+    if direntries is None:
+        # stale or unknown: list it for real
+        direntries = sorted(os.scandir(path), key=lambda de: de.name)
+        cache.store(path, os.stat(path), direntries)
+    ...
+    cache.prune()   # forget directories which weren't seen
+    cache.write()
+
+A DirCache remembers each directory's mtime_ns and its (sorted)
+entries.  Adding, removing or renaming an entry bumps the directory's
+mtime, so while the mtime_ns is unchanged the old listing is still
+good and the scanner only needs to re-stat the entries it knows of.
+
+*.cache files are local to a host; they are not sync'd with .gc
+"""
+
+import os, time, logging
+import persistent_dict
+
+
+# mtimes on HFS+ / FAT are only good to 1-2s: a directory which was
+# modified this recently may be modified again without its mtime
+# changing, so its listing isn't cached yet
+RACY_SECONDS = 2
+
+
+# quacks like an os.DirEntry, rebuilt from the cache; like a DirEntry
+# it only stat()s once
+class CachedEntry:
+    def __init__(self, dirpath, name, is_dir):
+        self.name = name
+        self.path = f"{dirpath}/{name}"
+        self._is_dir = is_dir
+        self._stats = {}
+
+
+    def is_dir(self):
+        return self._is_dir
+
+
+    def stat(self, follow_symlinks = True):
+        if follow_symlinks not in self._stats:
+            self._stats[follow_symlinks] = os.stat(self.path,
+                                        follow_symlinks=follow_symlinks)
+        return self._stats[follow_symlinks]
+
+
+
+class DirCache:
+    # root: where the paths we're given are relative to
+    def __init__(self, filename, lazy_timer = 0, root = "."):
+        self.logger = logging.getLogger("gc.dircache")
+        self.root = root
+        self.listings = persistent_dict.PersistentDict(filename, lazy_timer)
+        self.hits = self.misses = 0
+
+
+    # returns [ CachedEntry ] in sorted order, or None if we don't
+    # have a current listing for path
+    def lookup(self, path, dirstat):
+        if not self.listings.contains_p(path):
+            self.misses += 1
+            return None
+        listing = self.listings.get(path)
+        if listing["mtime_ns"] != dirstat.st_mtime_ns:
+            self.misses += 1
+            return None
+        self.listings.touch(path)
+        self.hits += 1
+        dirpath = self.root if path == "." else f"{self.root}/{path}"
+        return [ CachedEntry(dirpath, name, is_dir) \
+                    for name, is_dir in listing["entries"] ]
+
+
+    # direntries: [ os.DirEntry ], sorted by name
+    def store(self, path, dirstat, direntries):
+        if time.time() - dirstat.st_mtime < RACY_SECONDS:
+            self.forget(path)
+            return
+        entries = []
+        for dirent in direntries:
+            # a symlink's target can change from file to directory
+            # without touching this directory; don't trust it
+            if dirent.is_symlink() and dirent.is_dir():
+                self.forget(path)
+                return
+            entries.append([dirent.name, dirent.is_dir()])
+        self.listings.set(path, { "mtime_ns" : dirstat.st_mtime_ns,
+                                  "entries" : entries })
+
+
+    def forget(self, path):
+        self.listings.delete(path)
+
+
+    # keeps (from the next prune()) the listings whose path passes test
+    def keep(self, test):
+        for path in self.listings.data:
+            if test(path):
+                self.listings.touch(path)
+
+
+    def prune(self):
+        for path in self.listings.clean_keys():
+            self.listings.delete(path)
+        self.listings.clear_dirtybits()
+        self.logger.debug(f"dir cache: {self.hits} hits, " \
+                          f"{self.misses} misses")
+        self.hits = self.misses = 0
+
+
+    def write(self):
+        self.listings.write()
@@ -1,7 +1,7 @@
 #! python3.6
 
-import logging, os, json, time, hashlib, random, subprocess, re
-import config
+import logging, os, json, time, hashlib, subprocess, re, stat, math
+import config, governor, block_reader, digests
 
 
 # { 'name' : filename, 
@@ -9,54 +9,55 @@ import config
 #   'checksum' : sha256, 
 #   'checksum_time' : time_t,
 #   'ctime' : time_t,
-#   'mtime' : time_t }
+#   'mtime' : time_t,
+#   'inode' : "st_dev:st_ino" }   # only if it has other hard links
+#
+# in memory, a FileRecord (below) with that dict's face
 class FileState:
     def __init__(self, filename, genChecksums = False):
-        self.data = {'filename' : filename}
+        self.data = FileRecord(filename)
         self.update(genChecksums)
 
 
-    def update(self, genChecksums = False):
-        cfg = config.Config.instance()
-        BLOCKSIZE = int(cfg.getOption("BLOCKSIZE", 2**20))
-        NBLOCKS = int(cfg.getOption("NBLOCKS", 0))
-        
+    def update(self, genChecksums = False, filestat = None):
+        filename = self.data['filename']
         if genChecksums:
-            self.data['checksum'] = \
-                sum_sha256(self.data['filename'], BLOCKSIZE, NBLOCKS)
+            cfg = config.Config.instance()
+            BLOCKSIZE = int(cfg.getOption("BLOCKSIZE", 2**20))
+            NBLOCKS = int(cfg.getOption("NBLOCKS", 0))
+            checksum = sum_sha256(filename, BLOCKSIZE, NBLOCKS)
         else:
-            self.data['checksum'] = 'deferred'
-        self.data['checksum_time'] = time.time()
+            checksum = 'deferred'
         try:
-            filestat = os.lstat(self.data['filename'])
-            self.data['size'] = filestat.st_size
-            self.data['ctime'] = filestat.st_ctime
-            self.data['mtime'] = filestat.st_mtime
+            if filestat is None:
+                filestat = os.lstat(filename)
+            self.data = from_stat(filename, filestat, checksum)
         except FileNotFoundError:
             self.data['checksum'] = 'n/a'
+            self.data['checksum_time'] = time.time()
             self.data['size'] = 0
             self.data['ctime'] = 0
             self.data['mtime'] = 0
 
 
     def from_dict(self, data):
-        self.data = data
+        self.data = decode(dict(data))
 
 
     def to_dict(self):
-        return self.data
+        return self.data.to_dict()
 
 
     def maybechanged(self, filestate_data):
-        return self.data['ctime'] != filestate_data['ctime'] \
-            or self.data['mtime'] != filestate_data['mtime'] \
-            or self.data['size'] != filestate_data['size']
+        return maybechanged(self.data, filestate_data)
             
 
+    # digests from different algorithms can't say: assume changed, so
+    #  it gets hashed again
     def changed(self, filestate_data):
-        if self.data['checksum'] == filestate_data['checksum']:
-            return False
-        return True
+        same = digests.compare(self.data['checksum'],
+                               filestate_data['checksum'])
+        return same is not True
 
 
     def __str__(self):
@@ -67,49 +68,270 @@ class FileState:
 
 
 
+# One file's state, as compact as Python makes it: a dict per file
+#  (and its name again, as 'filename') is ~1KB of heap, >2GB for our
+#  biggest trees -- too much for a Pi.  The filename is the state's
+#  key, shared rather than copied; timestamps are integer ns.
+#
+# It wears the dict's face -- state['mtime'], .get(), 'blocks' in
+#  state, .pop(), .copy() -- so the rest of the code needn't care.
+#  'ctime' and 'mtime' come out as the very float os.stat() gives
+#  (st_mtime), so comparisons with either, or with states written
+#  before there were records, still hold.  In JSON it's the dict, plus
+#  'ctime_ns' and 'mtime_ns' (see to_dict(), decode())
+class FileRecord:
+    __slots__ = ( "filename", "size", "checksum", "checksum_time",
+                  "ctime_ns", "mtime_ns", "inode", "blocks" )
+    KEYS = ( "filename", "checksum", "checksum_time", "size", "ctime",
+             "mtime", "inode", "blocks" )
+    OPTIONAL = ( "inode", "blocks" )
+
+    def __init__(self, filename, size = 0, checksum = 'deferred',
+                 checksum_time = 0, ctime_ns = 0, mtime_ns = 0,
+                 inode = None, blocks = None):
+        self.filename = filename
+        self.size = size
+        self.checksum = checksum
+        self.checksum_time = checksum_time
+        self.ctime_ns = ctime_ns
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+        self.blocks = blocks
+
+
+    def __getitem__(self, key):
+        if key == 'mtime':
+            return seconds(self.mtime_ns)
+        if key == 'ctime':
+            return seconds(self.ctime_ns)
+        if key not in FileRecord.KEYS and key not in ('ctime_ns', 'mtime_ns'):
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None and key in FileRecord.OPTIONAL:
+            raise KeyError(key)
+        return value
+
+
+    def __setitem__(self, key, value):
+        if key == 'mtime':
+            self.mtime_ns = nanoseconds(value)
+        elif key == 'ctime':
+            self.ctime_ns = nanoseconds(value)
+        elif key in FileRecord.KEYS or key in ('ctime_ns', 'mtime_ns'):
+            setattr(self, key, value)
+        else:
+            raise KeyError(key)
+
+
+    def __contains__(self, key):
+        return key in FileRecord.KEYS and (key not in FileRecord.OPTIONAL \
+                                           or getattr(self, key) is not None)
+
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def pop(self, key, *default):
+        if key not in FileRecord.OPTIONAL:
+            raise KeyError(key)
+        value = getattr(self, key)
+        setattr(self, key, None)
+        if value is None:
+            if len(default) > 0:
+                return default[0]
+            raise KeyError(key)
+        return value
+
+
+    def keys(self):
+        return [ key for key in FileRecord.KEYS if key in self ]
+
+
+    def copy(self):
+        return FileRecord(self.filename, self.size, self.checksum,
+                          self.checksum_time, self.ctime_ns, self.mtime_ns,
+                          self.inode, self.blocks)
+
+
+    def to_dict(self):
+        data = { key : self[key] for key in self.keys() }
+        data['ctime_ns'] = self.ctime_ns
+        data['mtime_ns'] = self.mtime_ns
+        return data
+
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            other = decode(dict(other))
+        if not isinstance(other, FileRecord):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+
+# ns -> the float os.stat() makes of it: st_mtime from st_mtime_ns
+def seconds(ns):
+    return ns // 10**9 + (ns % 10**9) * 1e-9
+
+
+# and back: seconds(nanoseconds(t)) == t, for any st_mtime t
+def nanoseconds(t):
+    if isinstance(t, int):
+        return t * 10**9
+    whole = math.floor(t)
+    return whole * 10**9 + round((t - whole) * 10**9)
+
+
+# json object_hook (PersistentDict(..., decode=file_state.decode)): the
+#  dicts which are file states become FileRecords; anything else, as is
+def decode(data):
+    if 'checksum_time' not in data or 'size' not in data \
+            or 'mtime' not in data:
+        return data
+    record = FileRecord(data.get('filename'), data['size'],
+                        data.get('checksum', 'deferred'),
+                        data['checksum_time'], inode = data.get('inode'),
+                        blocks = data.get('blocks'))
+    # the ns if they're there, and still agree with the seconds (which
+    # older versions will have written without them)
+    for key in ('ctime', 'mtime'):
+        ns = data.get(f"{key}_ns")
+        if ns is None or seconds(ns) != data[key]:
+            ns = nanoseconds(data[key])
+        setattr(record, f"{key}_ns", ns)
+    return record
+
+
+
+# builds the state straight from a stat result (e.g. the one cached in
+#  an os.DirEntry) -- no extra syscalls, no config lookups.  A file
+#  with other hard links gets its 'inode' ("st_dev:st_ino"): the
+#  entries with the same one are a link group, one file's worth of
+#  bytes (see link_groups())
+def from_stat(filename, filestat, checksum = 'deferred', checksum_time = None):
+    if checksum_time is None:
+        checksum_time = time.time()
+    inode = None
+    if filestat.st_nlink > 1 and stat.S_ISREG(filestat.st_mode):
+        inode = inode_of(filestat)
+    return FileRecord(filename, filestat.st_size, checksum, checksum_time,
+                      filestat.st_ctime_ns, filestat.st_mtime_ns, inode)
+
+
+def inode_of(filestat):
+    return f"{filestat.st_dev}:{filestat.st_ino}"
+
+
+
+# linking or unlinking changes the ctime; the 'inode' is checked too,
+#  for states from before it was recorded
+def maybechanged(data, filestate_data):
+    return data['ctime'] != filestate_data['ctime'] \
+        or data['mtime'] != filestate_data['mtime'] \
+        or data['size'] != filestate_data['size'] \
+        or data.get('inode') != filestate_data.get('inode')
+
+
+# { inode : [ fqde ] } for states' hard-linked entries
+def link_groups(states):
+    groups = {}
+    for fqde, state in states.items():
+        if 'inode' in state:
+            groups.setdefault(state['inode'], []).append(fqde)
+    return groups
+
+
+
 # https://stackoverflow.com/questions/3431825/generating-an-md5-checksum-of-a-file
 # https://gist.github.com/aunyks/042c2798383f016939c40aa1be4f4aaf
 #
-# NBLOCKS & BLOCKSIZE > 0: sampling
-#  randomly (seeded on filesize, so consistent) sample
-#  NBLOCKS of BLOCKSIZE in the file.  This should make
-#  for ~ constant time hashing of very large files
-#  sent NBLOCKS or BLOCKSIZE to 0 to disable
+# NBLOCKS & BLOCKSIZE > 0: files of NBLOCKS*BLOCKSIZE or more get a
+#  sampled fingerprint instead (see sum_sampled()): constant time
+#  hashing of very large files.  Set NBLOCKS or BLOCKSIZE to 0 to
+#  disable
 #
 # For tuning to an FS, set NBLOCKS to 0 (no sampling) and
 #  BLOCKSIZE to an integer multiple of the FS chunk size
-def sum_sha256(fname, BLOCKSIZE = 2**20, NBLOCKS = 0):
+#
+# reads are paced by throttle (a governor.Throttle; default: the
+#  node-wide limits).  If cancelled (a threading.Event) gets set, gives
+#  up and returns None.  The I/O itself is block_reader's: reused,
+#  double-buffered, and out of the page cache once hashed
+def sum_sha256(fname, BLOCKSIZE = 2**20, NBLOCKS = 0, throttle = None,
+               cancelled = None):
+    return sum_file(fname, "sha256", BLOCKSIZE, NBLOCKS, throttle, cancelled)
+
+
+# sum_sha256() with any hashlib algorithm; returns a tagged checksum
+#  (see digests.py)
+def sum_file(fname, algorithm = digests.DEFAULT, BLOCKSIZE = 2**20,
+             NBLOCKS = 0, throttle = None, cancelled = None):
     if not os.path.isfile(fname):
         return None
-    hash_sha256 = hashlib.sha256()
-    filestat = os.lstat(fname)
-    with open(fname, "rb") as f:
-        # for chunk in iter(lambda: f.read(BLOCKSIZE), b""):
-        #    hash_sha256.update(chunk)
-        if NBLOCKS*BLOCKSIZE == 0 or filestat.st_size < NBLOCKS*BLOCKSIZE:
-            # "small" files, 10MB or less
-            if BLOCKSIZE == 0:
-                BLOCKSIZE = 2**20 # 1MB
-            file_buffer = f.read(BLOCKSIZE)
-            while len(file_buffer) > 0:
-                hash_sha256.update(file_buffer)
-                file_buffer = f.read(BLOCKSIZE)
-        else:
-            # "large" files > 10MB; randomly sample (up to) 10 blocks
-            file_buffer = f.read(BLOCKSIZE)
-            random.seed(filestat.st_size)
-            count = 0
-            step = int(filestat.st_size/NBLOCKS)
-            jump = random.randrange(step)
-            f.seek(jump)
-            # print(f"size: {filestat.st_size} step: {step} jump: {jump}")
-            while len(file_buffer) > 0: # and count < NBLOCKS:
-                # print(f"So far @ {count}:{f.tell()}: {hash_sha256.hexdigest()}")
-                hash_sha256.update(file_buffer)
-                file_buffer = f.read(BLOCKSIZE)
-                f.seek(step, 1)
-                count += 1
-    return hash_sha256.hexdigest()
+    if throttle is None:
+        throttle = governor.Governor.instance().for_context(0)
+    hash_sha256 = digests.new(algorithm)
+    with open(fname, "rb", buffering=0) as f:
+        filestat = os.fstat(f.fileno())
+        if sampling(filestat.st_size, BLOCKSIZE, NBLOCKS):
+            return sum_sampled(f, filestat, algorithm, BLOCKSIZE, NBLOCKS,
+                               throttle, cancelled)
+        if BLOCKSIZE == 0:
+            BLOCKSIZE = 2**20 # 1MB
+        for block in block_reader.blocks(f, block_reader.sequential(BLOCKSIZE),
+                                BLOCKSIZE, throttle, filestat.st_dev,
+                                cancelled, filestat.st_size):
+            hash_sha256.update(block)
+    if cancelled is not None and cancelled.is_set():
+        return None
+    return digests.tag(algorithm, hash_sha256.hexdigest())
+
+
+# does a file of size get a sampled fingerprint?
+def sampling(size, BLOCKSIZE, NBLOCKS):
+    return NBLOCKS*BLOCKSIZE > 0 and size >= NBLOCKS*BLOCKSIZE
+
+
+# the sampled fingerprint: the size, then exactly NBLOCKS blocks,
+#  pread() at offsets which depend on nothing but the size -- the same
+#  file always samples the same blocks, at the same cost whatever its
+#  size.  Tagged "sampled-<algorithm>": it only ever compares with
+#  another sampled fingerprint (see digests.py)
+def sum_sampled(f, filestat, algorithm, BLOCKSIZE, NBLOCKS, throttle = None,
+                cancelled = None):
+    fd = f.fileno()
+    fingerprint = digests.new(algorithm)
+    fingerprint.update(filestat.st_size.to_bytes(8, "little"))
+    if hasattr(os, "POSIX_FADV_RANDOM"):
+        block_reader.advise(fd, 0, 0, os.POSIX_FADV_RANDOM)
+    for offset in sampled_offsets(filestat.st_size, BLOCKSIZE, NBLOCKS):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        if throttle is not None:
+            throttle.read(BLOCKSIZE, filestat.st_dev)
+        block = os.pread(fd, BLOCKSIZE, offset)
+        fingerprint.update(block)
+        if hasattr(os, "POSIX_FADV_DONTNEED"):
+            block_reader.advise(fd, offset, len(block),
+                                os.POSIX_FADV_DONTNEED)
+    return digests.tag(digests.sampled_name(algorithm),
+                       fingerprint.hexdigest())
+
+
+# NBLOCKS offsets, evenly spread from the first block to the last
+def sampled_offsets(size, BLOCKSIZE, NBLOCKS):
+    if NBLOCKS == 1:
+        return [ 0 ]
+    last = max(size - BLOCKSIZE, 0)
+    return [ last * i // (NBLOCKS - 1) for i in range(NBLOCKS) ]
 
 
 
@@ -1,6 +1,7 @@
 #!/usr/local/bin/python3.6
 
 import unittest, file_state, os, subprocess, shutil, pprint
+import hashlib, threading, persistent_dict
 
 class TestCacheMethods(unittest.TestCase):
 
@@ -23,6 +24,65 @@ class TestCacheMethods(unittest.TestCase):
     def test_1_empty_scandir(self):
         state = file_state.FileState("tmp/file.1k")
 
+    def test_sum_sha256(self):
+        data = os.urandom(10000)
+        with open("tmp/file.10k", "wb") as f:
+            f.write(data)
+        expected = hashlib.sha256(data).hexdigest()
+        # inline (2 blocks or fewer) and double-buffered
+        self.assertEqual(file_state.sum_sha256("tmp/file.10k", 8192), expected)
+        self.assertEqual(file_state.sum_sha256("tmp/file.10k", 1000), expected)
+        self.assertEqual(file_state.sum_sha256("tmp/file.10k", 999), expected)
+        cancelled = threading.Event()
+        cancelled.set()
+        self.assertIsNone(file_state.sum_sha256("tmp/file.10k", 999, 0,
+                                                None, cancelled))
+
+    def test_sampled(self):
+        data = os.urandom(10000)
+        with open("tmp/file.10k", "wb") as f:
+            f.write(data)
+        offsets = file_state.sampled_offsets(len(data), 100, 4)
+        self.assertEqual(offsets, [ 0, 3300, 6600, 9900 ])
+        sampled = len(data).to_bytes(8, "little") + \
+                    b"".join([ data[offset:offset+100] for offset in offsets ])
+        self.assertEqual(file_state.sum_sha256("tmp/file.10k", 100, 4),
+                "sampled-sha256:" + hashlib.sha256(sampled).hexdigest())
+        # too small to sample
+        self.assertEqual(file_state.sum_sha256("tmp/file.10k", 100, 101),
+                         hashlib.sha256(data).hexdigest())
+
+    def test_record(self):
+        filestat = os.stat("tmp/file.1k")
+        record = file_state.from_stat("tmp/file.1k", filestat)
+        # the dict's face
+        self.assertEqual(record["size"], 1024)
+        self.assertEqual(record["mtime"], filestat.st_mtime)
+        self.assertEqual(record["ctime"], filestat.st_ctime)
+        self.assertEqual(record.get("blocks", "none"), "none")
+        self.assertNotIn("inode", record)
+        self.assertRaises(KeyError, lambda: record["nonesuch"])
+        copy = record.copy()
+        copy["blocks"] = "root"
+        self.assertIn("blocks", copy)
+        self.assertNotIn("blocks", record)
+        self.assertEqual(copy.pop("blocks", None), "root")
+        self.assertEqual(copy, record)
+        # JSON and back, ns and all
+        states = persistent_dict.PersistentDict("tmp/states.json")
+        states.data["./file.1k"] = record
+        states.write()
+        back = persistent_dict.PersistentDict("tmp/states.json",
+                                              decode=file_state.decode)
+        self.assertIsInstance(back.data["./file.1k"], file_state.FileRecord)
+        self.assertEqual(back.data["./file.1k"].mtime_ns, filestat.st_mtime_ns)
+        # as written before there were records: seconds only
+        legacy = dict(record.to_dict())
+        del legacy["mtime_ns"], legacy["ctime_ns"]
+        older = file_state.decode(legacy)
+        self.assertEqual(older["mtime"], filestat.st_mtime)
+        self.assertFalse(file_state.maybechanged(older, record))
+
 tempdir = "tmp"
 
 if __name__ == "__main__":
@@ -46,7 +46,7 @@ def kill_and_exit():
 def main(argv):
     try:
         opts, args = getopt.getopt(sys.argv[1:], "1c:dh:knrstvz", 
-                                    ["delete", "cleanup", "once"])
+                                    ["delete", "cleanup", "once", "repair="])
     except getopt.GetoptError as err:
         print(err)
         sys.exit(1)
@@ -62,6 +62,7 @@ def main(argv):
     verbose = False
     scan_only = False
     restore = False
+    repairing = None
     logger = logging.getLogger(__name__)
     for opt, arg in opts:
         if opt in ("-1", "--once"):
@@ -83,6 +84,8 @@ def main(argv):
             logger.info("DRYRUN mode: no files will be copied")
         elif opt == "-r":
             restore = True
+        elif opt == "--repair":
+            repairing = arg
         elif opt == "-s":
             status = True
         elif opt == "-t": # TODO: remove
@@ -116,7 +119,9 @@ def main(argv):
     else:
         logging.basicConfig(format='%(message)s', level=logLevel)
 
-    if restore:
+    if repairing is not None:
+        sys.exit(0 if gcn.repair(repairing) else 1)
+    elif restore:
         gcn.restore()
     elif status:
         if once:
@@ -31,15 +31,16 @@ $0 -c <config file> [ -h hostname ] [ -t ]
 
 for this host,
   "source" folders are scanned & a list of checksums is maintained
-    "source" folders are not yet scanned for bitrot
+    "source" folders are scrubbed for bitrot, a little each cycle,
+    with "scrub: True" (see scrubber.py)
   "replica" folders are synced (pull only) from source, the contents
     of source-folder matches the contents of replica-folder, like
     rsync source-folder/ replica-folder
-  "replica" folders are not yet (but could future be) scanned for bitrot
+  "replica" folders are scrubbed the same way
 """
 
 import sys, getopt, time, os, signal, subprocess, platform, logging, daemonize
-import config, file_state, elapsed, persistent_dict
+import config, file_state, elapsed, persistent_dict, ignore_rules
 from utils import logger_str, str_to_duration, duration_to_str
 from threading import Thread
 
@@ -75,11 +76,11 @@ class GhettoClusterNode:
 
 
     def ignoring(self, ignorals, dirent):
-        for suffix in ignorals:
-            # we only ignore suffixes "magically"
-            if dirent.endswith(suffix):
-                return True
-        return False
+        if getattr(self, "rules", None) is None \
+                or self.rules_for != ignorals:
+            self.rules = ignore_rules.IgnoreRules(ignorals)
+            self.rules_for = list(ignorals)
+        return self.rules.ignoring(dirent)
 
 
     def scan(self, gen_checksums = False):
@@ -220,8 +221,8 @@ class GhettoClusterReplica(GhettoClusterNode):
         # elif self.verbose:
         #     self.logger.info("Probably not deleting")
         ignorals = self.build_ignorals()
-        if len(ignorals) > 0:
-            args += [ f"--exclude={item}" for item in ignorals ]
+        rules = ignore_rules.IgnoreRules(ignorals)
+        args += [ f"--filter={rule}" for rule in rules.rsync_filter() ]
 
         if self.testing:
             # test mode: strip out hostnames for the rsync
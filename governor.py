@@ -0,0 +1,271 @@
+#! python3.x
+
+"""
+usage:
+    throttle = governor.Governor.instance().for_context(context)
+    throttle.stat(n, st_dev)        # before n stat()s on device st_dev
+    throttle.read(nbytes, st_dev)   # before reading nbytes
+    with throttle.priority():       # this thread (& threads it starts)
+        scan, hash, ...             #   at the configured I/O priority
+    Popen(..., preexec_fn=throttle.child_setup())   # e.g. rsync
+
+Theory of Operation:
+    One Governor per node: scanning, hashing and rsync all go through
+    it, so a replica's 300s rescan and its running rsync share a budget
+    instead of fighting over the same USB disk.
+
+    Limits are token buckets: "stat rate" (stats/sec) and "read rate"
+    (bytes/sec, e.g. 20m).  The node-wide buckets come from the global
+    section; a context's own settings add a second, per-context bucket,
+    so the tighter of the two wins.  Unset or 0 means no limit.
+
+    "io priority: idle" puts the scanning / hashing thread in the idle
+    I/O class (ioprio_set(2), through ctypes) -- it only gets the disk
+    when nobody else wants it.  Child rsyncs get the same class, plus
+    "rsync nice".
+
+    "busy disk: 90" backs off (up to MAX_BACKOFF seconds at a time)
+    whenever /proc/diskstats shows the device we're about to touch was
+    busy >= 90% of the last sample; a disk's own io_ticks are the
+    cheapest honest measure of "saturated".
+
+Linux only, for priorities and diskstats; elsewhere those are no-ops.
+"""
+
+import ctypes, ctypes.util, os, sys, platform, threading, time, logging
+import contextlib
+import config
+from singleton import Singleton
+from utils import str_to_bytes
+
+
+# linux/ioprio.h
+IOPRIO_WHO_PROCESS = 1      # with who=0: the calling thread
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = { "realtime" : 1, "best-effort" : 2, "idle" : 3 }
+# (ioprio_set, ioprio_get); glibc has no wrappers
+IOPRIO_SYSCALLS = { "x86_64" : (251, 252),
+                    "i386" : (289, 290),
+                    "i686" : (289, 290),
+                    "aarch64" : (30, 31),
+                    "riscv64" : (30, 31),
+                    "armv7l" : (314, 315),
+                    "ppc64le" : (273, 274) }
+
+SAMPLE_SECONDS = 1      # how often to re-read /proc/diskstats
+MAX_BACKOFF = 60        # the longest we'll hold off in one go
+DISKSTATS = "/proc/diskstats"
+
+
+_libc = None
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                            use_errno=True)
+    return _libc
+
+
+def get_ioprio():
+    syscalls = IOPRIO_SYSCALLS.get(platform.machine())
+    if not sys.platform.startswith("linux") or syscalls is None:
+        return None
+    ioprio = libc().syscall(syscalls[1], IOPRIO_WHO_PROCESS, 0)
+    if ioprio < 0:
+        return None
+    return ioprio
+
+
+# "idle", "best-effort" (level 0-7) ... or a raw ioprio value;
+# returns True if it worked
+def set_ioprio(ioprio, level = 7):
+    syscalls = IOPRIO_SYSCALLS.get(platform.machine())
+    if not sys.platform.startswith("linux") or syscalls is None:
+        return False
+    if ioprio in IOPRIO_CLASSES:
+        ioprio = IOPRIO_CLASSES[ioprio] << IOPRIO_CLASS_SHIFT | level
+    return libc().syscall(syscalls[0], IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+
+
+
+# rate: tokens/sec (<= 0: unlimited); burst: how many can be saved up
+#
+# take() goes into debt rather than refusing, then sleeps it off
+# (outside the lock), so a big take() isn't starved by small ones
+class TokenBucket:
+    def __init__(self, rate = 0, burst = None):
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.last = time.monotonic()
+        self.set_rate(rate, burst)
+
+
+    def set_rate(self, rate, burst = None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst if burst is not None else rate
+            self.tokens = min(self.tokens, self.burst)
+
+
+    def take(self, n = 1):
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+
+# how busy is each block device?  (major, minor) -> fraction of the
+# last sample the device spent doing I/O
+class DiskStats:
+    def __init__(self, filename = DISKSTATS):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.samples = {}   # (major, minor) -> (when, io_ticks)
+        self.busy = {}      # (major, minor) -> 0.0 .. 1.0
+
+
+    # ms spent doing I/O (field 13), or None for devices which aren't
+    # in diskstats (ZFS, NFS, tmpfs, ...)
+    def io_ticks(self, device):
+        try:
+            with open(self.filename) as diskstats:
+                for line in diskstats:
+                    fields = line.split()
+                    if len(fields) > 12 and \
+                            (int(fields[0]), int(fields[1])) == device:
+                        return int(fields[12])
+        except (FileNotFoundError, PermissionError, ValueError):
+            pass
+        return None
+
+
+    def utilization(self, st_dev):
+        device = (os.major(st_dev), os.minor(st_dev))
+        with self.lock:
+            now = time.monotonic()
+            last = self.samples.get(device)
+            if last is not None and now - last[0] < SAMPLE_SECONDS:
+                return self.busy.get(device, 0)
+            ticks = self.io_ticks(device)
+            if ticks is None:
+                self.samples[device] = (now, 0)
+                return 0
+            if last is not None:
+                self.busy[device] = (ticks - last[1]) / 1000 / (now - last[0])
+            self.samples[device] = (now, ticks)
+            return self.busy.get(device, 0)
+
+
+
+# one context's view of the Governor: its own limits on top of the
+# node-wide ones
+class Throttle:
+    def __init__(self, governor):
+        self.governor = governor
+        self.stats = TokenBucket()
+        self.reads = TokenBucket()
+        self.busy = 0
+        self.ioprio = None
+        self.nice = 0
+
+
+    def stat(self, n = 1, st_dev = None):
+        self.governor.stats.take(n)
+        self.stats.take(n)
+        self.backoff(st_dev)
+
+
+    def read(self, nbytes, st_dev = None):
+        self.governor.reads.take(nbytes)
+        self.reads.take(nbytes)
+        self.backoff(st_dev)
+
+
+    # hold off while st_dev's disk is saturated
+    def backoff(self, st_dev):
+        if self.busy <= 0 or st_dev is None:
+            return
+        waited = 0
+        while waited < MAX_BACKOFF and \
+                self.governor.disks.utilization(st_dev) >= self.busy:
+            time.sleep(SAMPLE_SECONDS)
+            waited += SAMPLE_SECONDS
+        if waited > 0:
+            self.governor.logger.debug(f"backed off {waited}s: device " \
+                            f"{os.major(st_dev)}:{os.minor(st_dev)} is busy")
+
+
+    # the calling thread runs at "io priority" for the duration; threads
+    # it starts meanwhile inherit it
+    @contextlib.contextmanager
+    def priority(self):
+        previous = None
+        if self.ioprio is not None:
+            previous = get_ioprio()
+            if not set_ioprio(self.ioprio):
+                self.governor.logger.debug(f"could not set io priority " \
+                                           f"{self.ioprio}")
+                previous = None
+        try:
+            yield
+        finally:
+            if previous is not None:
+                set_ioprio(previous)
+
+
+    # for Popen(preexec_fn=...); runs in the child, before exec
+    def child_setup(self):
+        if self.ioprio is None and self.nice == 0:
+            return None
+        ioprio, nice = self.ioprio, self.nice
+        def setup():
+            if nice != 0:
+                os.nice(nice)
+            if ioprio is not None:
+                set_ioprio(ioprio)
+        return setup
+
+
+
+@Singleton
+class Governor:
+    def __init__(self):
+        self.logger = logging.getLogger("gc.governor")
+        self.lock = threading.Lock()
+        self.stats = TokenBucket()
+        self.reads = TokenBucket()
+        self.disks = DiskStats()
+        self.throttles = {}     # context -> Throttle
+
+
+    # (re)reads the limits each time, so a reloaded config applies
+    # from the next scan / hash / rsync on
+    def for_context(self, context = 0):
+        cfg = config.Config.instance()
+        with self.lock:
+            self.stats.set_rate(float(cfg.getOption("stat rate", 0)))
+            self.reads.set_rate(str_to_bytes(cfg.getOption("read rate", 0)))
+            if context not in self.throttles:
+                self.throttles[context] = Throttle(self)
+            throttle = self.throttles[context]
+        if context != 0:
+            # the global bucket already covers the global setting
+            stat_rate = cfg.getConfig(context, "stat rate", 0, follow=False)
+            read_rate = cfg.getConfig(context, "read rate", 0, follow=False)
+            throttle.stats.set_rate(float(stat_rate[0]))
+            throttle.reads.set_rate(str_to_bytes(read_rate[0]))
+        throttle.busy = float(cfg.getConfig(context, "busy disk", 0)[0]) / 100
+        ioprio = cfg.getConfig(context, "io priority", "normal")[0]
+        throttle.ioprio = ioprio if ioprio in IOPRIO_CLASSES else None
+        throttle.nice = int(cfg.getConfig(context, "rsync nice", 0)[0])
+        return throttle
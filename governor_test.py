@@ -0,0 +1,67 @@
+#! python3.x
+
+import unittest, os, time, copy, tempfile, shutil
+import config, governor
+
+
+class TestGovernorMethods(unittest.TestCase):
+    def setUp(self):
+        self.config = config.Config.instance()
+        self.saved = copy.deepcopy(self.config.config)
+        self.tempdir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        self.config.config = self.saved
+        shutil.rmtree(self.tempdir)
+
+
+    def test_bucket(self):
+        bucket = governor.TokenBucket(100)
+        start = time.monotonic()
+        waited = 0
+        for i in range(3):
+            waited += bucket.take(100)
+        elapsed = time.monotonic() - start
+        # starts empty: 300 tokens at 100/sec
+        self.assertGreaterEqual(elapsed, 2.5)
+        self.assertGreater(waited, 0)
+
+
+    def test_unlimited(self):
+        bucket = governor.TokenBucket()
+        self.assertEqual(bucket.take(10**9), 0)
+
+
+    def test_context_limits(self):
+        self.config.setConfig(0, "stat rate", "1000")
+        self.config.setConfig(99, "read rate", "10m")
+        self.config.setConfig(99, "io priority", "idle")
+        gov = governor.Governor.instance()
+        throttle = gov.for_context(99)
+        self.assertEqual(gov.stats.rate, 1000)
+        self.assertEqual(gov.reads.rate, 0)
+        self.assertEqual(throttle.stats.rate, 0)
+        self.assertEqual(throttle.reads.rate, 10*2**20)
+        self.assertEqual(throttle.ioprio, "idle")
+        self.assertIsNone(gov.for_context(0).ioprio)
+        self.assertIsNotNone(throttle.child_setup())
+        self.assertIsNone(gov.for_context(0).child_setup())
+
+
+    def test_diskstats(self):
+        fake = f"{self.tempdir}/diskstats"
+        with open(fake, "w") as f:
+            f.write("   8       0 sda 1 2 3 4 5 6 7 8 0 500 9\n")
+        disks = governor.DiskStats(fake)
+        st_dev = os.makedev(8, 0)
+        self.assertEqual(disks.utilization(st_dev), 0)
+        disks.samples[(8, 0)] = (time.monotonic() - 2, 0)
+        # 500ms busy in ~2s
+        self.assertAlmostEqual(disks.utilization(st_dev), 0.25, places=1)
+        self.assertEqual(disks.utilization(os.makedev(0, 42)), 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestGovernorMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+    python3 hash_bench.py [ megabytes [ blocksize ] ]
+
+Writes a file of random data in a temp dir and hashes it with the old
+f.read() loop and with file_state.sum_sha256 (block_reader: reused,
+double-buffered buffers, fadvise), straight through and sampled;
+reports MB/sec for each, and checks that they agree.
+
+Run it twice -- the file is in the page cache the second time round
+(unless DONTNEED has dropped it: that's the point) -- or drop the
+caches in between for cold numbers.
+"""
+
+import os, sys, time, tempfile, shutil, hashlib, random
+import file_state
+
+
+# the pre-block_reader loop, kept here for comparison
+def legacy_sum(fname, BLOCKSIZE, NBLOCKS = 0):
+    hash_sha256 = hashlib.sha256()
+    size = os.stat(fname).st_size
+    with open(fname, "rb") as f:
+        file_buffer = f.read(BLOCKSIZE)
+        if NBLOCKS*BLOCKSIZE == 0 or size < NBLOCKS*BLOCKSIZE:
+            while len(file_buffer) > 0:
+                hash_sha256.update(file_buffer)
+                file_buffer = f.read(BLOCKSIZE)
+        else:
+            step = int(size/NBLOCKS)
+            f.seek(random.Random(size).randrange(step))
+            while len(file_buffer) > 0:
+                hash_sha256.update(file_buffer)
+                file_buffer = f.read(BLOCKSIZE)
+                f.seek(step, 1)
+    return hash_sha256.hexdigest()
+
+
+def build_file(fname, megabytes):
+    with open(fname, "wb") as f:
+        for i in range(megabytes):
+            f.write(os.urandom(2**20))
+
+
+# returns (checksum, MB/sec)
+def time_sum(summer, fname, megabytes):
+    start = time.time()
+    checksum = summer()
+    elapsed = max(time.time() - start, 0.000001)
+    return checksum, megabytes / elapsed
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    blocksize = int(sys.argv[2]) if len(sys.argv) > 2 else 2**20
+    tmpdir = tempfile.mkdtemp(prefix="gc-bench-")
+    try:
+        fname = f"{tmpdir}/data"
+        print(f"writing {megabytes} MB to {fname}")
+        build_file(fname, megabytes)
+        for pass_ in ("first", "second"):
+            results = {}
+            for name, summer in (
+                    ("read", lambda: legacy_sum(fname, blocksize)),
+                    ("readinto", lambda: file_state.sum_sha256(fname,
+                                                               blocksize)),
+                    ("read/10", lambda: legacy_sum(fname, blocksize, 10)),
+                    ("readinto/10", lambda: file_state.sum_sha256(fname,
+                                                        blocksize, 10))):
+                checksum, rate = time_sum(summer, fname, megabytes)
+                results[name] = checksum
+                print(f"{pass_:>6} {name:>11}: {rate:,.0f} MB/sec")
+            assert results["read"] == results["readinto"]
+            assert results["read/10"] == results["readinto/10"]
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,300 @@
+#! python3.x
+
+"""
+usage:
+    scn = scanner.Scanner(path, ignorals, ".gc/host.1.json", context)
+    scn.add_consumer(hasher.Hasher(scn))    # "checksums: True" does this
+    scn.scan()
+
+Theory of Operation:
+    A scanner consumer: each NEW or CHANGED regular file (and any
+    UNCHANGED one still 'deferred') is handed to a pool of "hash
+    workers" threads running file_state.sum_file, in the context's
+    "hash algorithm" (see digests.py).  hashlib lets go of the GIL
+    while it digests, so threads keep several disks (or cores) busy;
+    multiprocessing is out anyway -- it imports the stdlib queue
+    module, which our queue.py shadows.
+
+    No more than a few jobs per worker are in flight: when they're
+    all busy, consume() waits, which slows the walk down to the speed
+    of hashing rather than queueing up the whole tree.  Digests are
+    committed to the state as they come in, provided the file still
+    looks the way it did when it was queued; a scan which is
+    interrupted leaves the rest 'deferred', for next time.
+
+    Before hashing anything, we look in the ChecksumCache (by inode,
+    size and mtime; see checksum_cache.py): a file which was only
+    renamed, moved or chmod'd gets its old digest back for free.
+
+    Hard links to the same file (same inode, size and mtime) are
+    hashed once: the other links share the first one's job, or find
+    its digest in the cache.
+
+    Big files get a sampled fingerprint instead, if NBLOCKS says so;
+    with "resample: True" they get it again every scan, whether or
+    not they look changed.
+
+    With "block digests: 64m", files that big are hashed block by
+    block too, into side files (see block_map.py) which repair.py can
+    use to mend them.
+
+    abort() (e.g. on SIGTERM) drops the queued jobs and stops the
+    ones in progress at their next block.
+"""
+
+import stat, time, threading, logging
+import file_state, workers, scanner, checksum_cache, digests, block_map
+from utils import str_to_bytes
+
+
+class Hasher:
+    def __init__(self, scn, nworkers = None):
+        self.logger = logging.getLogger("gc.hasher")
+        self.path = scn.path
+        self.states = scn.states
+        self.throttle = scn.throttle
+        if nworkers is None:
+            nworkers = int(scn.option("hash workers", 1))
+        self.nworkers = nworkers
+        self.algorithm = digests.resolve(scn.option("hash algorithm",
+                                                    digests.DEFAULT))
+        self.blocksize = int(scn.option("BLOCKSIZE", 2**20))
+        self.nblocks = int(scn.option("NBLOCKS", 0))
+        self.resample = scn.option("resample", "False") == "True"
+        self.block_digests = str_to_bytes(scn.option("block digests", "0"))
+        self.states_filename = scn.state_filename
+        size = int(scn.option("checksum cache size",
+                              checksum_cache.DEFAULT_SIZE))
+        if size > 0:
+            self.cache = checksum_cache.ChecksumCache(
+                    scanner.cache_filename(scn.state_filename, "checksums"),
+                    size)
+        else:
+            self.cache = None
+        self.pool = None
+        self.jobs = []          # [ (ScanEvent, Job) ], oldest first
+        self.linked = {}        # hard-linked files' key_for() -> Job
+        self.cancelled = threading.Event()
+        self.reset()
+
+
+    # the clock starts with the scan's first batch, not now: a
+    # Scanner (and its Hasher) may sit idle for a while between scans
+    def reset(self):
+        self.files = self.bytes = 0
+        self.start = None
+
+
+    def wanted(self, event):
+        if event.kind == scanner.DELETED or event.stat is None:
+            return False
+        if event.kind == scanner.UNCHANGED \
+                and not self.stale(event.state.get("checksum"),
+                                   event.stat.st_size) \
+                and not self.resampling(event) \
+                and not self.unblocked(event):
+            return False
+        return stat.S_ISREG(event.stat.st_mode)
+
+
+    # the kind of checksum a file of size should have
+    def kind(self, size):
+        if file_state.sampling(size, self.blocksize, self.nblocks):
+            return digests.sampled_name(self.algorithm)
+        return self.algorithm
+
+
+    # needs (re)hashing: never was, or in another algorithm
+    def stale(self, checksum, size):
+        if not checksum_cache.known(checksum):
+            return checksum == "deferred"
+        return digests.algorithm_of(checksum) != self.kind(size)
+
+
+    # does a file of size get block digests?
+    def blocking(self, size):
+        return self.block_digests > 0 and size >= self.block_digests \
+                and not file_state.sampling(size, self.blocksize, self.nblocks)
+
+
+    # a file which should have block digests, but doesn't (yet)
+    def unblocked(self, event):
+        return self.blocking(event.stat.st_size) \
+                and "blocks" not in event.state
+
+
+    # an unchanged-looking file whose fingerprint we take again anyway
+    def resampling(self, event):
+        return self.resample and event.kind == scanner.UNCHANGED \
+                and checksum_cache.known(event.state.get("checksum")) \
+                and digests.sampled(event.state["checksum"])
+
+
+    def consume(self, events):
+        if self.start is None:
+            self.start = time.time()
+        updates = []
+        for event in events:
+            if self.resampling(event):
+                self.submit(event)
+            elif self.wanted(event):
+                checksum = self.reuse(event)
+                if checksum is None:
+                    self.submit(event)
+                else:
+                    self.commit(updates, event, checksum)
+            elif self.cache is not None and event.kind == scanner.UNCHANGED \
+                    and stat.S_ISREG(event.stat.st_mode) \
+                    and not self.stale(event.state.get("checksum"),
+                                       event.stat.st_size):
+                self.cache.remember(event.stat, event.state.get("checksum"))
+        self.states.update(updates)
+        self.collect()
+
+
+    # a digest we already have for this content, or None
+    def reuse(self, event):
+        kind = self.kind(event.stat.st_size)
+        if self.cache is None or (self.resample and kind != self.algorithm):
+            return None
+        checksum = self.cache.lookup(event.stat, kind)
+        if checksum is None and event.kind == scanner.CHANGED \
+                and checksum_cache.known(event.old.get("checksum")) \
+                and not self.stale(event.old["checksum"], event.old["size"]) \
+                and event.old["size"] == event.state["size"] \
+                and event.old["mtime"] == event.state["mtime"]:
+            # only the ctime moved: chmod, chown, ...
+            checksum = event.old["checksum"]
+        if checksum is not None and self.blocking(event.stat.st_size) \
+                and self.side_file(checksum) is None:
+            return None     # hash it again, for the block digests
+        return checksum
+
+
+    # the Merkle root of checksum's block digests, if we have them
+    def side_file(self, checksum):
+        info = block_map.header(block_map.side_filename(self.states_filename,
+                                                        checksum))
+        return info["root"] if info is not None else None
+
+
+    def submit(self, event):
+        if self.pool is None:
+            self.cancelled.clear()
+            self.pool = workers.WorkerPool(self.nworkers, "hash")
+        while len(self.jobs) >= 4 * self.nworkers:
+            self.collect(wait=True)
+        # another link to a file already being hashed: share its job
+        linked = self.linked.get(checksum_cache.key_for(event.stat)) \
+                    if event.stat.st_nlink > 1 else None
+        if linked is not None:
+            self.jobs.append((event, linked))
+            return
+        fqpn = f"{self.path}/{event.fqde}"
+        if self.blocking(event.stat.st_size):
+            job = self.pool.submit(block_map.build, fqpn, self.algorithm,
+                                   self.blocksize, self.throttle,
+                                   self.cancelled)
+        else:
+            job = self.pool.submit(file_state.sum_file, fqpn, self.algorithm,
+                                   self.blocksize, self.nblocks, self.throttle,
+                                   self.cancelled)
+        self.jobs.append((event, job))
+        if event.stat.st_nlink > 1:
+            self.linked[checksum_cache.key_for(event.stat)] = job
+
+
+    # commits whatever has finished; if wait, at least the oldest job
+    def collect(self, wait = False):
+        if wait and len(self.jobs) > 0:
+            self.jobs[0][1].finished.wait()
+        finished = [ (event, job) for event, job in self.jobs if job.done() ]
+        if len(finished) == 0:
+            return
+        self.jobs = [ (event, job) for event, job in self.jobs \
+                        if not job.done() ]
+        updates = []
+        hashed = set()          # of the jobs, as links share them
+        for event, job in finished:
+            try:
+                checksum, bmap = job.result(), None
+            except OSError as err:
+                self.logger.warn(f"cannot hash {event.fqde}: {err}")
+                continue
+            if isinstance(checksum, tuple):
+                checksum, bmap = checksum
+            if checksum is not None \
+                    and self.commit(updates, event, checksum, bmap) \
+                    and id(job) not in hashed:
+                hashed.add(id(job))
+                self.files += 1
+                self.bytes += event.stat.st_size
+        self.states.update(updates)
+
+
+    # adds event's file, with checksum (and bmap, its block digests),
+    # to updates -- unless it's gone or changed again since we looked
+    def commit(self, updates, event, checksum, bmap = None):
+        current = self.states.data.get(event.fqde)
+        if current is None or file_state.maybechanged(current, event.state):
+            return False
+        if self.resampling(event) and checksum != event.state["checksum"]:
+            self.logger.warn(f"{event.fqde} changed, but its size and " \
+                             f"mtime didn't")
+        state = current.copy()
+        state["checksum"] = checksum
+        state["checksum_time"] = time.time()
+        state.pop("blocks", None)
+        if bmap is not None:
+            block_map.save(bmap, block_map.side_filename(self.states_filename,
+                                                         checksum))
+            state["blocks"] = bmap.root()
+        elif self.blocking(event.stat.st_size):
+            root = self.side_file(checksum)
+            if root is not None:
+                state["blocks"] = root
+        updates.append((event.fqde, state))
+        if self.cache is not None:
+            self.cache.remember(event.stat, checksum)
+        return True
+
+
+    def checkpoint(self):
+        self.collect()
+
+
+    def finish(self):
+        while len(self.jobs) > 0:
+            self.collect(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.linked = {}
+        self.states.write()
+        if self.cache is not None:
+            self.cache.finish()
+        if self.block_digests > 0:
+            block_map.prune(self.states_filename,
+                    set([ state["checksum"] for fqde, state in \
+                            self.states.items() if "blocks" in state ]))
+        self.report()
+
+
+    def abort(self):
+        self.cancelled.set()
+        if self.pool is not None:
+            self.pool.shutdown(cancelling=True)
+            self.pool = None
+        self.jobs = []
+        self.linked = {}
+        self.reset()
+
+
+    def report(self):
+        if self.files > 0 and self.start is not None:
+            elapsed = max(time.time() - self.start, 0.001)
+            self.logger.info(f"  hashed {self.files} files, " \
+                             f"{self.bytes/2**20:,.0f} MB in {elapsed:.0f}s:" \
+                             f" {self.files/elapsed:,.1f} files/sec, " \
+                             f"{self.bytes/2**20/elapsed:,.1f} MB/sec")
+        self.reset()
@@ -0,0 +1,195 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil, hashlib, time
+from unittest import mock
+import scanner, hasher, config, persistent_dict, file_state, checksum_cache
+import block_map, statusfier
+
+class TestHasherMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        os.makedirs(f"{tempdir}/tree/a")
+        for i in range(20):
+            with open(f"{tempdir}/tree/a/{i}", "w") as f:
+                f.write(f"file {i}" * i)
+        os.symlink("a/1", f"{tempdir}/tree/link")
+        config.Config.instance().setConfig(95, "checksums", "True")
+        config.Config.instance().setConfig(95, "hash workers", "3")
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def scan(self):
+        scn = scanner.Scanner(f"{tempdir}/tree", [], f"{tempdir}/state.json",
+                              95)
+        scn.scan()
+        return persistent_dict.PersistentDict(f"{tempdir}/state.json")
+
+    def test_hash(self):
+        states = self.scan()
+        for i in range(20):
+            expected = hashlib.sha256((f"file {i}" * i).encode()).hexdigest()
+            self.assertEqual(states.get(f"a/{i}")["checksum"], expected)
+        self.assertEqual(states.get("./link")["checksum"], "deferred")
+
+    def test_rehash(self):
+        before = self.scan()
+        with open(f"{tempdir}/tree/a/3", "a") as f:
+            f.write("more")
+        os.utime(f"{tempdir}/tree/a/3", (1, 1))
+        after = self.scan()
+        self.assertNotEqual(after.get("a/3")["checksum"],
+                            before.get("a/3")["checksum"])
+        self.assertEqual(after.get("a/4")["checksum"],
+                         before.get("a/4")["checksum"])
+
+    def test_reuse(self):
+        before = self.scan()
+        os.rename(f"{tempdir}/tree/a", f"{tempdir}/tree/b")
+        os.chmod(f"{tempdir}/tree/b/7", 0o600)
+        with open(f"{tempdir}/tree/b/3", "a") as f:
+            f.write("more")
+        with mock.patch("file_state.sum_file",
+                        wraps=file_state.sum_file) as summer:
+            after = self.scan()
+        self.assertEqual(summer.call_count, 1)   # just b/3
+        for i in range(4, 20):
+            self.assertEqual(after.get(f"b/{i}")["checksum"],
+                             before.get(f"a/{i}")["checksum"])
+
+    def test_algorithm(self):
+        config.Config.instance().setConfig(95, "hash algorithm", "blake2b")
+        try:
+            blake = self.scan()
+        finally:
+            config.Config.instance().setConfig(95, "hash algorithm", "sha256")
+        data = (f"file 9" * 9).encode()
+        self.assertEqual(blake.get("a/9")["checksum"],
+                         f"blake2b:{hashlib.blake2b(data).hexdigest()}")
+        # the other algorithm's digests don't count: hash them again
+        sha = self.scan()
+        self.assertEqual(sha.get("a/9")["checksum"],
+                         hashlib.sha256(data).hexdigest())
+
+    def test_resample(self):
+        cfg = config.Config.instance()
+        for key, value in (("NBLOCKS", "2"), ("BLOCKSIZE", "16"),
+                           ("resample", "True")):
+            cfg.setConfig(95, key, value)
+        try:
+            before = self.scan()
+            self.assertTrue(before.get("a/19")["checksum"] \
+                                .startswith("sampled-sha256:"))
+            self.assertEqual(before.get("a/1")["checksum"],
+                             hashlib.sha256(b"file 1").hexdigest())
+            # same size, same mtime; different last block
+            fname = f"{tempdir}/tree/a/19"
+            mtime = os.stat(fname).st_mtime_ns
+            with open(fname, "rb+") as f:
+                f.seek(-2, 2)
+                f.write(b"!!")
+            os.utime(fname, ns=(mtime, mtime))
+            after = self.scan()
+            self.assertNotEqual(after.get("a/19")["checksum"],
+                                before.get("a/19")["checksum"])
+            self.assertEqual(after.get("a/18")["checksum"],
+                             before.get("a/18")["checksum"])
+        finally:
+            for key, value in (("NBLOCKS", "0"), ("BLOCKSIZE", "1048576"),
+                               ("resample", "False")):
+                cfg.setConfig(95, key, value)
+
+    def test_block_digests(self):
+        cfg = config.Config.instance()
+        cfg.setConfig(95, "block digests", "100")
+        cfg.setConfig(95, "BLOCKSIZE", "16")
+        try:
+            states = self.scan()
+            big = states.get("a/19")     # 133 bytes
+            self.assertNotIn("blocks", states.get("a/9"))
+            bmap = block_map.load(block_map.side_filename(
+                            f"{tempdir}/state.json", big["checksum"]))
+            self.assertEqual(len(bmap.hashes), 9)
+            self.assertEqual(big["blocks"], bmap.root())
+            # a rename keeps them; a deletion drops them
+            os.rename(f"{tempdir}/tree/a/19", f"{tempdir}/tree/a/x")
+            os.unlink(f"{tempdir}/tree/a/18")
+            before = states.get("a/18")
+            states = self.scan()
+            self.assertEqual(states.get("a/x")["blocks"], big["blocks"])
+            self.assertIsNone(block_map.load(block_map.side_filename(
+                            f"{tempdir}/state.json", before["checksum"])))
+        finally:
+            cfg.setConfig(95, "block digests", "0")
+            cfg.setConfig(95, "BLOCKSIZE", "1048576")
+
+    def test_hard_links(self):
+        os.makedirs(f"{tempdir}/tree/c")
+        os.link(f"{tempdir}/tree/a/19", f"{tempdir}/tree/c/one")
+        os.link(f"{tempdir}/tree/a/19", f"{tempdir}/tree/c/two")
+        with mock.patch("file_state.sum_file",
+                        wraps=file_state.sum_file) as summer:
+            states = self.scan()
+        self.assertEqual(summer.call_count, 20)     # a/0 .. a/19
+        group = file_state.link_groups(states)
+        self.assertEqual(list(group.values()), [ [ "a/19", "c/one", "c/two" ] ])
+        self.assertEqual(states.get("c/two")["checksum"],
+                         states.get("a/19")["checksum"])
+        self.assertNotIn("inode", states.get("a/18"))
+        files, nbytes = statusfier.sizeof(states)
+        self.assertEqual(files, 23)
+        self.assertEqual(nbytes, sum([ len(f"file {i}" * i) \
+                                        for i in range(20) ]) + len("a/1"))
+        # unlinked again: the group goes
+        os.unlink(f"{tempdir}/tree/c/one")
+        os.unlink(f"{tempdir}/tree/c/two")
+        self.assertEqual(file_state.link_groups(self.scan()), {})
+
+    def test_evict(self):
+        cache = checksum_cache.ChecksumCache(f"{tempdir}/checksums.cache", 2)
+        stats = [ os.stat(f"{tempdir}/tree/a/{i}") for i in range(3) ]
+        for i, filestat in enumerate(stats):
+            cache.now = i
+            cache.remember(filestat, f"{i}")
+        cache.remember(stats[0], "deferred")
+        cache.finish()
+        cache = checksum_cache.ChecksumCache(f"{tempdir}/checksums.cache", 2)
+        self.assertEqual(cache.lookup(stats[0]), None)
+        self.assertEqual(cache.lookup(stats[2]), "2")
+
+    def test_abort(self):
+        scn = scanner.Scanner(f"{tempdir}/tree", [], f"{tempdir}/state.json",
+                              95)
+        hashing = scn.consumers[-1]
+        self.assertIsInstance(hashing, hasher.Hasher)
+        hashing.abort()
+        self.assertTrue(hashing.cancelled.is_set())
+        # the next scan starts afresh
+        scn.scan()
+        self.assertNotEqual(scn.states.get("a/5")["checksum"], "deferred")
+
+    def test_report(self):
+        scn = scanner.Scanner(f"{tempdir}/tree", [], f"{tempdir}/state.json",
+                              95)
+        hashing = scn.consumers[-1]
+        scn.scan()
+        # idle between scans: that isn't hashing time
+        idle = time.time()
+        with open(f"{tempdir}/tree/a/3", "a") as f:
+            f.write("more")
+        started = []
+        report = hashing.report
+        def reporting():
+            started.append(hashing.start)
+            report()
+        hashing.report = reporting
+        scn.scan()
+        self.assertEqual(hashing.files, 0)
+        self.assertGreaterEqual(started[0], idle)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestHasherMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
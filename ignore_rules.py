@@ -0,0 +1,139 @@
+#! python3.x
+
+"""
+usage:
+    rules = ignore_rules.IgnoreRules(cfg.get_ignorals(context))
+    rules.ignoring("foo.DS_Store")          # => True
+    rules.ignoring("streams", "Movies")     # name, and the dir it's in
+    rules.write_rsync_filter(".gc/host.1.filter.cache")
+    rsync ... --filter="merge .gc/host.1.filter.cache"
+
+Each "ignore suffix:" item is one of
+    /some/path      anchored: that path (relative to the top), only
+    some/path       a path, or the tail of one, anywhere
+    *.glob          a glob (*, ?, [...]) on the name
+    suffix          anything whose name ends in suffix (the original
+                      "magic" ignore suffix)
+Globs work in paths too; * and ? don't match "/", ** does.  These are
+rsync's semantics, so the scanner and the filter file we hand rsync
+agree about what's ignored.  /.gc is always ignored.
+
+Suffixes are checked against a trie of the reversed suffixes, so the
+cost is O(length of name) whatever the number of suffixes; all the
+globs (and all the paths) are compiled into one regular expression.
+"""
+
+import re
+
+
+ALWAYS = [ "/.gc" ]
+GLOB_CHARS = re.compile(r"[*?\[]")
+END = ""    # marks a complete suffix in the trie
+
+
+# glob -> regex, the rsync way
+def translate(glob):
+    regex = ""
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith("**", i):
+            regex += ".*"
+            i += 2
+            continue
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            close = glob.find("]", i + 2)
+            if close < 0:
+                regex += re.escape(c)
+            else:
+                chars = glob[i+1:close].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                regex += "[" + chars + "]"
+                i = close
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+
+
+class IgnoreRules:
+    def __init__(self, ignorals):
+        self.ignorals = []
+        self.suffixes = {}
+        globs = []
+        paths = []
+        for item in ALWAYS + list(ignorals):
+            item = item.strip()
+            if item == "" or item in self.ignorals:
+                continue
+            self.ignorals.append(item)
+            if item.startswith("/"):
+                paths.append("^" + translate(item.strip("/")) + "$")
+            elif "/" in item.rstrip("/"):
+                paths.append("(^|/)" + translate(item.strip("/")) + "$")
+            elif GLOB_CHARS.search(item):
+                globs.append(translate(item.rstrip("/")))
+            else:
+                self.add_suffix(item.rstrip("/"))
+        self.globs = None
+        if len(globs) > 0:
+            self.globs = re.compile("^(?:" + "|".join(globs) + ")$")
+        self.paths = None
+        if len(paths) > 0:
+            self.paths = re.compile("|".join(paths))
+
+
+    def add_suffix(self, suffix):
+        node = self.suffixes
+        for c in reversed(suffix):
+            node = node.setdefault(c, {})
+        node[END] = True
+
+
+    def has_suffix(self, name):
+        node = self.suffixes
+        for c in reversed(name):
+            if END in node:
+                return True
+            node = node.get(c)
+            if node is None:
+                return False
+        return END in node
+
+
+    # name: a directory entry; dir: where it is, relative to the top
+    # ("." for the top itself)
+    def ignoring(self, name, dir = "."):
+        if self.has_suffix(name):
+            return True
+        if self.globs is not None and self.globs.match(name):
+            return True
+        if self.paths is not None:
+            path = name if dir == "." else f"{dir}/{name}"
+            if self.paths.search(path):
+                return True
+        return False
+
+
+    # the same rules, as rsync filter rules
+    def rsync_filter(self):
+        rules = []
+        for item in self.ignorals:
+            if item.startswith("/") or "/" in item.rstrip("/") \
+                    or GLOB_CHARS.search(item):
+                rules.append(f"- {item}")
+            else:
+                rules.append(f"- *{item}")
+        return rules
+
+
+    def write_rsync_filter(self, filename):
+        with open(filename, "w") as filterfile:
+            for rule in self.rsync_filter():
+                filterfile.write(rule + "\n")
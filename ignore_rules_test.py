@@ -0,0 +1,47 @@
+#!/usr/local/bin/python3.6
+
+import unittest, ignore_rules
+
+class TestIgnoreRulesMethods(unittest.TestCase):
+
+    def setUp(self):
+        global rules
+        rules = ignore_rules.IgnoreRules([".DS_Store", "mobile", "*.tmp",
+                                          "/Movies/streams", "cache/*.idx",
+                                          "band[0-9]"])
+
+    def tearDown(self):
+        pass
+
+    def test_suffixes(self):
+        self.assertTrue(rules.ignoring(".DS_Store"))
+        self.assertTrue(rules.ignoring("foo.DS_Store"))
+        self.assertTrue(rules.ignoring("mobile", "Movies"))
+        self.assertFalse(rules.ignoring("mobiles"))
+        self.assertFalse(rules.ignoring("DS_Store"))
+
+    def test_globs(self):
+        self.assertTrue(rules.ignoring("x.tmp", "a/b"))
+        self.assertFalse(rules.ignoring("x.tmpl"))
+        self.assertTrue(rules.ignoring("band7"))
+        self.assertFalse(rules.ignoring("bandx"))
+
+    def test_paths(self):
+        self.assertTrue(rules.ignoring(".gc"))
+        self.assertFalse(rules.ignoring(".gc", "a"))
+        self.assertTrue(rules.ignoring("streams", "Movies"))
+        self.assertFalse(rules.ignoring("streams", "TV/Movies"))
+        self.assertTrue(rules.ignoring("a.idx", "x/cache"))
+        self.assertTrue(rules.ignoring("a.idx", "cache"))
+        self.assertFalse(rules.ignoring("a.idx", "cache/x"))
+
+    def test_rsync_filter(self):
+        self.assertEqual(rules.rsync_filter(),
+                         ["- /.gc", "- *.DS_Store", "- *mobile", "- *.tmp",
+                          "- /Movies/streams", "- cache/*.idx", 
+                          "- band[0-9]"])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestIgnoreRulesMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
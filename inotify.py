@@ -0,0 +1,268 @@
+#! python3.x
+
+"""
+usage:
+    journal = inotify.Journal(".gc/host.1.journal.cache", 24*3600)
+    watcher = inotify.Watcher("/path/to/source", ignorals, journal)
+    watcher.start()         # a daemon thread; watches until stop()
+    ...
+    every cycle:
+        dirty = journal.drain()     # None => do a full scan
+        scanner.scan(dirty)         # else { "a/b" : deep, ... }
+
+Theory of Operation:
+    Watcher puts an inotify watch on every (non-ignored) directory
+    under path and marks directories dirty in the Journal as events
+    arrive.  A directory whose files changed is "shallow" dirty; a
+    directory which was created, deleted or moved is "deep" dirty,
+    meaning its whole subtree needs (re)scanning.
+
+    Journal.drain() hands over (and clears) the dirty set, or None if
+    a full sweep is due: on startup (whatever happened while we
+    weren't watching is unknown), after IN_Q_OVERFLOW, if we ran out
+    of watches, or every full_every seconds to catch anything else
+    that slipped by.
+
+Linux only, through ctypes; inotify.available() says if we can.
+"""
+
+import ctypes, ctypes.util, os, sys, errno, struct, select, threading
+import time, logging
+import persistent_dict, ignore_rules
+
+
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+IN_DONT_FOLLOW  = 0x02000000
+IN_ISDIR        = 0x40000000
+IN_NONBLOCK     = os.O_NONBLOCK
+IN_CLOEXEC      = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM \
+           | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF \
+           | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW
+
+# struct inotify_event { int wd; uint32 mask, cookie, len; char name[]; }
+EVENT = struct.Struct("iIII")
+
+
+_libc = None
+
+def libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                            use_errno=True)
+    return _libc
+
+
+def available():
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        return hasattr(libc(), "inotify_init1")
+    except OSError:
+        return False
+
+
+def join(dir, name):
+    if dir == ".":
+        return name
+    return f"{dir}/{name}"
+
+
+
+class Journal:
+    def __init__(self, filename, full_every):
+        self.logger = logging.getLogger("gc.Journal")
+        self.lock = threading.Lock()
+        self.full_every = full_every
+        self.watching = False
+        self.state = persistent_dict.PersistentDict(filename, 60)
+        for key, default in (("dirty", {}), ("overflow", True),
+                             ("last_full", 0)):
+            if not self.state.contains_p(key):
+                self.state.data[key] = default
+
+
+    # a new Watcher: anything before now went unseen
+    def restart(self):
+        with self.lock:
+            self.watching = True
+            self.state.set("overflow", True)
+            self.state.write()
+
+
+    def stopped(self):
+        with self.lock:
+            self.watching = False
+
+
+    def overflowed(self):
+        self.logger.warn("inotify queue overflowed; will do a full scan")
+        with self.lock:
+            self.state.set("overflow", True)
+
+
+    def mark(self, path, deep = False):
+        with self.lock:
+            dirty = self.state.get("dirty")
+            dirty[path] = deep or dirty.get(path, False)
+            self.state.set("dirty", dirty)
+
+
+    # returns { path : deep } to rescan, or None for a full scan;
+    # either way, the journal starts over from here
+    def drain(self):
+        with self.lock:
+            now = time.time()
+            if not self.watching or self.state.get("overflow") \
+                    or self.state.get("last_full") + self.full_every < now:
+                dirty = None
+                self.state.set("overflow", False)
+                self.state.set("last_full", now)
+            else:
+                dirty = self.state.get("dirty")
+            self.state.set("dirty", {})
+            self.state.write()
+        return dirty
+
+
+
+class Watcher:
+    def __init__(self, path, ignorals, journal):
+        self.logger = logging.getLogger("gc.Watcher")
+        self.path = path
+        self.rules = ignore_rules.IgnoreRules(ignorals)
+        self.journal = journal
+        self.wds = {}       # wd -> directory, relative to path
+        self.fd = None
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        fd = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+        self.fd = fd
+        self.running = True
+        self.journal.restart()
+        self.thread = threading.Thread(target=self.watch, daemon=True,
+                                       name=f"inotify-{self.path}")
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+
+    def watch(self):
+        try:
+            self.add_tree(".")
+            while self.running:
+                readable, _, _ = select.select([self.fd], [], [], 1)
+                if readable:
+                    self.read_events()
+        except OSError:
+            self.logger.exception(f"giving up watching {self.path}")
+        finally:
+            self.journal.stopped()
+            os.close(self.fd)
+
+
+    # returns False if we're out of watches (fs.inotify.max_user_watches)
+    def add_watch(self, dir):
+        fqpn = os.fsencode(f"{self.path}/{dir}")
+        wd = libc().inotify_add_watch(self.fd, fqpn, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.logger.warn(f"out of inotify watches at {dir};" \
+                                 f" raise fs.inotify.max_user_watches")
+                return False
+            # vanished, or not a directory (anymore): let it go
+            return True
+        self.wds[wd] = dir
+        return True
+
+
+    def add_tree(self, dir):
+        if not self.add_watch(dir):
+            self.running = False
+            return
+        try:
+            with os.scandir(f"{self.path}/{dir}") as direntries:
+                subdirs = [ dirent.name for dirent in direntries \
+                            if dirent.is_dir(follow_symlinks=False) ]
+        except (FileNotFoundError, PermissionError, NotADirectoryError):
+            return
+        for name in subdirs:
+            if self.rules.ignoring(name, dir):
+                continue
+            self.add_tree(join(dir, name))
+            if not self.running:
+                return
+
+
+    # forget the watches at & under dir: it moved away
+    def remove_tree(self, dir):
+        for wd, path in list(self.wds.items()):
+            if path == dir or path.startswith(f"{dir}/"):
+                libc().inotify_rm_watch(self.fd, wd)
+                del self.wds[wd]
+
+
+    def read_events(self):
+        try:
+            buffer = os.read(self.fd, 64*1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = EVENT.unpack_from(buffer, offset)
+            offset += EVENT.size
+            name = os.fsdecode(buffer[offset:offset+length].rstrip(b"\0"))
+            offset += length
+            self.handle(wd, mask, name)
+
+
+    def handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.journal.overflowed()
+            return
+        if wd not in self.wds:
+            return
+        dir = self.wds[wd]
+        if mask & IN_IGNORED:
+            # the watch is gone (directory deleted, or unmounted)
+            del self.wds[wd]
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # the parent hears about it too
+            return
+        if name == "" or self.rules.ignoring(name, dir):
+            return
+        path = join(dir, name)
+        if mask & IN_ISDIR:
+            if mask & IN_MOVED_FROM:
+                self.remove_tree(path)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            if mask & (IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM):
+                self.journal.mark(path, deep=True)
+        self.journal.mark(dir)
+
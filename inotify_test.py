@@ -0,0 +1,53 @@
+#!/usr/local/bin/python3.6
+
+import unittest, inotify, os, tempfile, shutil, time
+
+class TestInotifyMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        os.makedirs(f"{tempdir}/tree/a/b")
+        os.makedirs(f"{tempdir}/tree/.gc")
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def settle(self, journal):
+        time.sleep(1.5)
+        return journal.drain()
+
+    @unittest.skipUnless(inotify.available(), "needs Linux inotify")
+    def test_watcher(self):
+        journal = inotify.Journal(f"{tempdir}/journal.cache", 3600)
+        watcher = inotify.Watcher(f"{tempdir}/tree", [".DS_Store"], journal)
+        watcher.start()
+        try:
+            # nothing is known from before the watcher started
+            self.assertEqual(self.settle(journal), None)
+            with open(f"{tempdir}/tree/a/b/file", "w") as f:
+                f.write("file")
+            with open(f"{tempdir}/tree/a/.DS_Store", "w") as f:
+                f.write("ignored")
+            with open(f"{tempdir}/tree/.gc/state.json", "w") as f:
+                f.write("ignored")
+            self.assertEqual(self.settle(journal), {"a/b": False})
+            os.makedirs(f"{tempdir}/tree/c/d")
+            time.sleep(0.5)
+            with open(f"{tempdir}/tree/c/d/file", "w") as f:
+                f.write("file")
+            os.rename(f"{tempdir}/tree/a/b", f"{tempdir}/tree/c/b")
+            dirty = self.settle(journal)
+            self.assertTrue(dirty["c"])
+            self.assertTrue(dirty["a/b"])
+            self.assertEqual(dirty["a"], False)
+            self.assertEqual(self.settle(journal), {})
+            journal.overflowed()
+            self.assertEqual(journal.drain(), None)
+        finally:
+            watcher.stop()
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestInotifyMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
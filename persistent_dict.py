@@ -14,6 +14,14 @@ import os, json, logging
 from utils import logger_str
 import elapsed, config
 
+
+# json.dump()'s default: records (see decode) go out as their dicts
+def encode(value):
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
 class PersistentDict:
     def __init__(self, filename, lazy_timer=0, **kwargs):
         self.masterFilename = filename
@@ -22,6 +30,9 @@ class PersistentDict:
         self.logger = logging.getLogger(logger_str(__class__))
         self.lazy_timer = lazy_timer
         self.dirty = False
+        # decode: a json object_hook, e.g. file_state.decode; what it
+        # makes needs a to_dict() to be written out again
+        self.decode = kwargs.get("decode")
         self.read()
         self.clear_dirtybits()
         self.timer = elapsed.ElapsedTimer()
@@ -50,10 +61,16 @@ class PersistentDict:
             return None
         try:
             with open(filename, "r") as statefile:
-                self.data = json.load(statefile, strict=False)
+                self.data = json.load(statefile, strict=False,
+                                      object_hook=self.decode)
                 if self.data is None:
                     self.logger.debug("json.load() -> self.data is None")
                     self.data = {}
+            if self.decode is not None:
+                # records named for their key share its string
+                for key, value in self.data.items():
+                    if getattr(value, "filename", None) == key:
+                        value.filename = key
         except json.decoder.JSONDecodeError as err:
             self.logger.warn(err)
             os.rename(filename, f"{filename}.busted")
@@ -79,7 +96,8 @@ class PersistentDict:
             time.sleep(5)
             ntries += 1
         with open(tmpfile, "w") as statefile:
-            json.dump(self.data, statefile, sort_keys=True, indent=4)
+            json.dump(self.data, statefile, sort_keys=True, indent=4,
+                      default=encode)
         try:
             os.rename(tmpfile, filename)
         except:
@@ -120,6 +138,15 @@ class PersistentDict:
         self.lazy_write()
 
 
+    # set() for many (key, value)s, with just one lazy_write()
+    def update(self, items):
+        for key, value in items:
+            self.data[key] = value
+            self.touch(key)
+        self.dirty = True
+        self.lazy_write()
+
+
     def get(self, key):
         return self.data[key]
 
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+    python3 record_bench.py [ entries ]
+
+Builds a state of synthetic entries (default 1M), as the old dicts and
+as file_state.FileRecords, and reports the heap each takes
+(tracemalloc), per entry and in all -- the keys included, since
+they're the same either way.  Then writes the records out as JSON and
+reads them back (PersistentDict, decode=file_state.decode), to check
+the round trip and time it.
+"""
+
+import os, sys, time, tempfile, shutil, tracemalloc, gc
+import file_state, persistent_dict
+
+
+def entry(i):
+    fqde = f"Movies/d{i // 1000:04d}/film {i:07d}.mkv"
+    mtime_ns = 1500000000 * 10**9 + i * 1234567
+    return fqde, i * 4096, f"{i:064x}", 1600000000.0 + i, mtime_ns
+
+
+def as_dicts(n):
+    states = {}
+    for i in range(n):
+        fqde, size, checksum, checksum_time, mtime_ns = entry(i)
+        # as json.load() makes it: the filename a string of its own
+        states[fqde] = { 'filename' : (" " + fqde)[1:],
+                         'checksum' : checksum,
+                         'checksum_time' : checksum_time,
+                         'size' : size,
+                         'ctime' : file_state.seconds(mtime_ns),
+                         'mtime' : file_state.seconds(mtime_ns) }
+    return states
+
+
+def as_records(n):
+    states = {}
+    for i in range(n):
+        fqde, size, checksum, checksum_time, mtime_ns = entry(i)
+        states[fqde] = file_state.FileRecord(fqde, size, checksum,
+                                             checksum_time, mtime_ns, mtime_ns)
+    return states
+
+
+# (states, bytes of heap they took)
+def measure(build, n):
+    gc.collect()
+    tracemalloc.start()
+    states = build(n)
+    heap = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return states, heap
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    results = {}
+    for name, build in (("dict", as_dicts), ("FileRecord", as_records)):
+        states, heap = measure(build, n)
+        results[name] = heap
+        print(f"{name:>10}: {heap/2**20:,.0f} MB, {heap/n:,.0f} bytes/entry")
+        if name == "FileRecord":
+            records = states
+        del states
+    print(f"{'saved':>10}: {1 - results['FileRecord']/results['dict']:.0%}")
+    tmpdir = tempfile.mkdtemp(prefix="gc-bench-")
+    try:
+        statefile = f"{tmpdir}/state.json"
+        pd = persistent_dict.PersistentDict(statefile)
+        pd.data = records
+        start = time.time()
+        pd.write()
+        written = time.time() - start
+        start = time.time()
+        back = persistent_dict.PersistentDict(statefile,
+                                              decode=file_state.decode)
+        read = time.time() - start
+        assert len(back.data) == n
+        assert all([ back.data[fqde] == record \
+                        for fqde, record in records.items() ])
+        print(f"{'JSON':>10}: {os.path.getsize(statefile)/2**20:,.0f} MB, " \
+              f"written in {written:.1f}s, read in {read:.1f}s")
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,132 @@
+#! python3.x
+
+"""
+usage:
+    gc.py -c config.txt --repair /Volumes/Media/Movies/big.mkv
+
+    fixer = repair.Repair(context, path, states_filename, replicas,
+                          hostname)
+    fixer.repair(fqde)          # True: it's whole again
+
+Theory of Operation:
+    For a file with block digests (see block_map.py; "block digests:
+    64m" gives them to files of 64MB and up):
+
+      1. hash it again, block by block, and compare with the side file
+         recorded when it was known to be good: the blocks which
+         differ are the damage
+      2. for each damaged run, try the replicas in turn: fetch just
+         those blocks (pread for a replica on this host, else ssh +
+         dd), and check every one against the recorded digest.  The
+         first replica whose blocks all match wins; one with its own
+         damage there is skipped
+      3. write them back in place (pwrite), put the mtime back -- the
+         content is what it was, so nobody should re-sync it -- and
+         check the whole file again
+
+    Nothing is written unless it matches what the source recorded, so
+    a replica can't make things worse.
+"""
+
+import os, shlex, subprocess, logging
+import config, persistent_dict, block_map, governor
+
+
+class Repair:
+    def __init__(self, context, path, states_filename, replicas, hostname):
+        self.logger = logging.getLogger("gc.repair")
+        self.context = context
+        self.path = path
+        self.states_filename = states_filename
+        self.replicas = replicas
+        self.hostname = hostname
+        self.throttle = governor.Governor.instance().for_context(context)
+
+
+    def repair(self, fqde):
+        fname = f"{self.path}/{fqde}"
+        states = persistent_dict.PersistentDict(self.states_filename)
+        state = states.data.get(fqde)
+        if state is None or "blocks" not in state:
+            self.logger.warn(f"{fqde}: no block digests; nothing to " \
+                             f"repair from (see \"block digests\")")
+            return False
+        good = block_map.load(block_map.side_filename(self.states_filename,
+                                                      state["checksum"]))
+        if good is None or good.root() != state["blocks"]:
+            self.logger.warn(f"{fqde}: its block digests are missing")
+            return False
+        stat = os.stat(fname)
+        if stat.st_size != state["size"] or stat.st_mtime != state["mtime"]:
+            self.logger.warn(f"{fqde} has changed since it was hashed: " \
+                             f"that's not bitrot")
+            return False
+        damage = self.damage(fname, good)
+        if len(damage) == 0:
+            self.logger.info(f"{fqde}: all {len(good.hashes)} blocks are good")
+            return True
+        nblocks = sum([ count for first, count in damage ])
+        self.logger.warn(f"{fqde}: {nblocks} bad blocks in {len(damage)} " \
+                         f"runs")
+        fixed = True
+        with open(fname, "r+b", buffering=0) as f:
+            for first, count in damage:
+                blocks = self.fetch_good(fqde, good, first, count)
+                if blocks is None:
+                    self.logger.warn(f"{fqde}: no replica has blocks " \
+                                     f"{first}-{first+count-1} intact")
+                    fixed = False
+                    continue
+                os.pwrite(f.fileno(), b"".join(blocks), first * good.blocksize)
+        os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        if fixed and len(self.damage(fname, good)) > 0:
+            self.logger.warn(f"{fqde}: still damaged after repair")
+            fixed = False
+        if fixed:
+            self.logger.info(f"{fqde}: repaired {nblocks} blocks")
+        return fixed
+
+
+    def damage(self, fname, good):
+        checksum, now = block_map.build(fname, good.algorithm, good.blocksize,
+                                        self.throttle)
+        return good.differences(now)
+
+
+    # [ block ] for first .. first+count-1, every one checked; or None
+    def fetch_good(self, fqde, good, first, count):
+        for replica in self.replicas:
+            try:
+                data = self.fetch(replica, fqde, good.blocksize, first, count)
+            except (OSError, subprocess.SubprocessError) as err:
+                self.logger.info(f"  {replica}: {err}")
+                continue
+            blocks = [ data[i*good.blocksize:(i+1)*good.blocksize] \
+                        for i in range(count) ]
+            if all([ good.check(first + i, block) \
+                        for i, block in enumerate(blocks) ]):
+                self.logger.info(f"  blocks {first}-{first+count-1} " \
+                                 f"from {replica}")
+                return blocks
+            self.logger.info(f"  {replica} doesn't match there either")
+        return None
+
+
+    # blocks first .. first+count-1 of replica's copy of fqde, as bytes
+    def fetch(self, replica, fqde, blocksize, first, count):
+        host = config.host_for(replica)
+        fname = f"{config.path_for(replica)}/{fqde}"
+        if host == self.hostname:
+            self.throttle.read(count * blocksize)
+            with open(fname, "rb") as f:
+                return os.pread(f.fileno(), count * blocksize,
+                                first * blocksize)
+        command = f"dd if={shlex.quote(fname)} bs={blocksize} " \
+                  f"skip={first} count={count} status=none"
+        result = subprocess.run([ "ssh", host, command ],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                preexec_fn=self.throttle.child_setup(),
+                                timeout=600)
+        if result.returncode != 0:
+            raise OSError(result.stderr.decode().strip())
+        return result.stdout
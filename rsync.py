@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
 import logging, os, subprocess, re, sys
+import governor
 
+# context: whose "io priority" / "rsync nice" the child runs at
+# line_callback: called with each line of output as it comes; if it
+#   returns True, the line was its business and is only logged at debug
 def rsync(source, dest, options = [], **kwargs):
     logger = logging.getLogger("gc.rsync")
 
@@ -29,12 +33,20 @@ def rsync(source, dest, options = [], **kwargs):
         loghole = logger.info
     try:
         logger.debug(f"running: {command}")
-        process = Popen(command, stdout=PIPE, stderr=STDOUT)
+        throttle = governor.Governor.instance().for_context(
+                                                kwargs.get("context", 0))
+        process = Popen(command, stdout=PIPE, stderr=STDOUT,
+                        preexec_fn=throttle.child_setup())
+        line_callback = kwargs.get("line_callback")
         with process.stdout:
             for line in iter(process.stdout.readline, b''):
                 # b'\n'-separated lines
                 # logger.info("> %s", line.decode().strip())
-                loghole(f"> {line.decode().strip()}")
+                text = line.decode(errors="surrogateescape").rstrip("\n")
+                if line_callback is not None and line_callback(text):
+                    logger.debug(f"> {text}")
+                    continue
+                loghole(f"> {text.strip()}")
                 # print(f"> {line.decode().strip()}")
             exitcode = process.wait()
     except BaseException:
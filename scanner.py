@@ -1,69 +1,738 @@
 #!/usr/bin/env python3
 
-import os, logging
-import config, persistent_dict, file_state
+"""
+usage:
+    scn = scanner.Scanner(path, ignorals, ".gc/host.1.json", context)
+    scn.add_consumer(something_with_consume_and_finish)    # optional
+    scn.scan()              # walk everything; update & write the state
+    scn.scan(dirty)         # only { dir : deep }; see inotify.py
+    while not scn.scan(budget=600):     # at most 10m at a time
+        push, report status, ...
+    scanner.scan_budget(context)        # "scan budget", for the above
+
+Theory of Operation:
+    A scan is a pipeline of generators, each pulling from the last:
+
+      walk:     directories in sorted, depth-first order, as
+                  (path, dirstat, [ file DirEntry ])
+      stat:     (fqde, stat) for each file
+      classify: a ScanEvent for each file: NEW, CHANGED or UNCHANGED;
+                  then DELETED for state entries which weren't seen
+      sink:     batches of events, handed to each consumer in turn
+
+    The state file is just one consumer (StateWriter); others (e.g.
+    hashing, hasher.py) are plugged in with add_consumer().  A consumer
+    has
+        consume([ ScanEvent ]) and finish()
+    and may have checkpoint() (flush, see below) and abort() (the scan
+    blew up, e.g. SIGTERM)
+    Nothing runs ahead of the sink but the parallel walker's bounded
+    lookahead, so a slow consumer slows the walk rather than piling up
+    events.
+
+    A full scan visits directories in a fixed order (walk_key), so
+    once it reaches a directory everything before it is done: entries
+    there which weren't seen are DELETED right away, and every
+    "checkpoint" seconds the consumers flush and the directory is
+    saved as the cursor in .gc/*.scan.cache.  A scan which was killed,
+    or ran out of budget, resumes from the cursor next time.
+
+    Unchanged files keep their checksum_time, so that says when the
+    file was last hashed, not when it was last seen.  When a scan is
+    complete, the time it started goes in the state's metadata
+    (last_scan()): the state is current as of then.
+
+    With "tiered scan: True", a full scan leaves out most of the
+    subtrees which haven't changed in a while, taking a rotating
+    slice of them each time; see churn.py.  Like the ones behind a
+    cursor, the entries of skipped subtrees are kept as they were.
+
+    Anything which can't be listed or stat'd (permissions, I/O errors,
+    a flaky mount) is "unknown" for this scan: its entries are kept,
+    not DELETED.  And a full scan holds its DELETED events back till
+    the end: if more than "delete threshold" % of the entries (and at
+    least MASS_DELETE of them) vanished at once, only those which the
+    previous scan also found missing go through; the rest wait for
+    the next scan to confirm them.
+
+    FQDE = fully qualified directory entry: a full path for
+    the file (relative to the source/replica base dir)
+"""
+
+import os, time, logging, collections
+import config, persistent_dict, file_state, workers, dircache, ignore_rules
+import governor, churn, hasher, tree_digest
+from utils import str_to_duration
+
+
+NEW = "new"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+DELETED = "deleted"
+
+# fewer deletions than this are never held back
+MASS_DELETE = 100
+
+# in the state's metadata: when the last complete scan started
+LAST_SCAN = "last scan"
+
+# state: the new state dict (None if DELETED)
+# old: the previous state dict (None if NEW)
+# stat: the file's stat result (None if DELETED)
+ScanEvent = collections.namedtuple("ScanEvent", "kind fqde state old stat")
+
+
+class StateWriter:
+    def __init__(self, states):
+        self.logger = logging.getLogger("gc.scanner")
+        self.states = states
+
+
+    def consume(self, events):
+        updates = []
+        for event in events:
+            if event.kind == DELETED:
+                self.logger.debug(f"removed: {event.fqde}")
+                self.states.delete(event.fqde)
+            else:
+                updates.append((event.fqde, event.state))
+        self.states.update(updates)
+
+
+    def checkpoint(self):
+        self.states.write()
+
+
+    def finish(self):
+        self.states.clear_dirtybits()
+        self.states.write()
+
+
+
+# lists directories; a Scanner's walk (or several Scanners', for
+# shared_scan.py: rules then only needs an ignoring(name, dir))
+class Walker:
+    def __init__(self, path, rules, dircache = None, throttle = None):
+        self.logger = logging.getLogger("gc.scanner")
+        self.path = path
+        self.rules = rules
+        self.dircache = dircache
+        if throttle is None:
+            throttle = governor.Governor.instance().for_context(0)
+        self.throttle = throttle
+        self.unknown = set()        # unreadable dirs (& files)
+        self.listed = None          # called with each dir walked deep
+
+
+    # paths are relative to the top (".") for keys & bookkeeping; the
+    # filesystem only ever sees them joined onto self.path, so nothing
+    # depends on the (process-wide) cwd and Scanners can run in threads
+    def fspath(self, path):
+        if path == ".":
+            return self.path
+        return f"{self.path}/{path}"
+
+
+    # lists one directory: returns its files as [ DirEntry ], its
+    # subdirectories as [ (path, stat) ], each sorted by name, and the
+    # listing for the DirCache:
+    #   None: nothing to update (cache hit, or no cache)
+    #   False: forget this directory (it couldn't be listed)
+    #   [ os.DirEntry ]: a fresh listing to remember
+    #
+    # os.scandir hands back the entry type (d_type) for free and
+    # caches the lstat() in the DirEntry, so each file costs exactly
+    # one stat syscall (which prestat does here, in a worker thread,
+    # rather than later in stat()).  If the directory's mtime hasn't
+    # changed, the DirCache saves us the listing (and sort) as well.
+    def listdir(self, path, dirstat, prestat = False):
+        self.logger.debug(f"scanning path {path}")
+        files = []
+        subdirs = []
+        listing = None
+        direntries = None
+        if self.dircache is not None:
+            direntries = self.dircache.lookup(path, dirstat)
+        if direntries is None:
+            try:
+                with os.scandir(self.fspath(path)) as direntries:
+                    direntries = sorted(direntries, key=lambda de: de.name)
+            except OSError as err:
+                self.unreadable(path, err)
+                return files, subdirs, False
+            listing = direntries
+        # ~ one stat per entry, here or in stat()
+        self.throttle.stat(len(direntries), dirstat.st_dev)
+        for dirent in direntries:
+            if self.rules.ignoring(dirent.name, path):
+                continue
+            try:
+                if dirent.is_dir():
+                    subdirs.append((subdir_for(path, dirent.name),
+                                    dirent.stat()))
+                else:
+                    if prestat:
+                        dirent.stat(follow_symlinks=False)
+                    files.append(dirent)
+            except FileNotFoundError:
+                # vanished mid-scan; the next listing will miss it
+                continue
+            except OSError as err:
+                self.unreadable(subdir_for(path, dirent.name), err)
+        return files, subdirs, listing
+
+
+    # path (a dir, or a file: as from subdir_for) couldn't be read; we
+    # don't know what's there, so whatever we knew stays.  (This can
+    # run in the walker's worker threads: set.add is atomic.)
+    def unreadable(self, path, err):
+        self.logger.warn(f"cannot read {self.fspath(path)}: {err}")
+        self.unknown.add(path)
+
+
+    def remember(self, path, dirstat, listing):
+        if self.dircache is None:
+            return
+        if listing is False:
+            self.dircache.forget(path)
+        elif listing is not None:
+            self.dircache.store(path, dirstat, listing)
+
+
+    # roots: [ (path, deep) ]; only deep roots are walked recursively.
+    # With nworkers > 1, the next few directories are listed & stat'd
+    # ahead of time by a pool of nworkers threads per device (st_dev),
+    # so stat latency on several datasets / spindles overlaps; the
+    # output is in the same order either way.
+    #
+    # resume: a cursor; directories before it (in walk_key order) were
+    # done by an earlier, interrupted scan and are skipped -- but for
+    # its ancestors, which are listed (to get there) without their files
+    #
+    # skip: subtrees to leave out altogether
+    def walk(self, roots, nworkers = 1, resume = None, skip = ()):
+        pools = {}
+        lookahead = 4 * nworkers
+        resume_key = walk_key(resume) if resume is not None else None
+        def submit(item):
+            path, dirstat, job = item
+            if dirstat.st_dev not in pools:
+                self.logger.debug(f"new scan pool for device {dirstat.st_dev}")
+                pools[dirstat.st_dev] = workers.WorkerPool(nworkers,
+                                                f"scan-{dirstat.st_dev}")
+            item[2] = pools[dirstat.st_dev].submit(self.listdir, path,
+                                                   dirstat, True)
+
+        try:
+            for root, deep in roots:
+                try:
+                    pending = [ [ root, os.stat(self.fspath(root)), None ] ]
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                except OSError as err:
+                    self.unreadable(root, err)
+                    continue
+                while len(pending) > 0:
+                    if nworkers > 1:
+                        for item in pending[-lookahead:]:
+                            if item[2] is None:
+                                submit(item)
+                    path, dirstat, job = pending.pop()
+                    if job is None:
+                        files, subdirs, listing = self.listdir(path, dirstat)
+                    else:
+                        files, subdirs, listing = job.result()
+                    self.remember(path, dirstat, listing)
+                    if deep and self.listed is not None:
+                        self.listed(path)
+                    if resume_key is not None and walk_key(path) < resume_key:
+                        files = []
+                    yield path, dirstat, files
+                    if deep:
+                        pending += [ [ subdir, substat, None ] \
+                                for subdir, substat in reversed(subdirs) \
+                                if not finished(subdir, resume_key, skip) ]
+        finally:
+            for pool in pools.values():
+                pool.shutdown(cancelling=True)
+
+
 
 class Scanner:
-    def __init__(self, path, ignorals, state_filename):
+    def __init__(self, path, ignorals, state_filename, context = 0):
         self.logger = logging.getLogger("gc.scanner")
         self.config = config.Config.instance()
         self.path = path
-        self.ignorals = ignorals
+        self.context = context
+        self.state_filename = state_filename
+        self.rules = ignore_rules.IgnoreRules(ignorals)
         self.states = persistent_dict.PersistentDict(state_filename, \
-                                self.config.getOption("LAZY_WRITE", 5))
+                                self.config.getOption("LAZY_WRITE", 5),
+                                decode=file_state.decode)
+        if self.option("dir cache", "True") == "True":
+            self.dircache = dircache.DirCache(
+                                cache_filename(state_filename, "dirs"),
+                                self.config.getOption("LAZY_WRITE", 5),
+                                root=path)
+        else:
+            self.dircache = None
+        self.progress = persistent_dict.PersistentDict(
+                                cache_filename(state_filename, "scan"))
+        self.resume_at = None       # the directory being classified
+        self.unknown = set()        # unreadable dirs (& files) this scan
+        self.deleting = {}          # fqde -> held DELETED event
+        self.next_checkpoint = None
+        self.started = None         # see prepare()
+        self.throttle = governor.Governor.instance().for_context(context)
+        self.consumers = [ StateWriter(self.states) ]
+        if self.option("tiered scan", "False") == "True":
+            self.churn = churn.Churn(cache_filename(state_filename, "churn"),
+                                     self.config.getOption("LAZY_WRITE", 5))
+            self.consumers.append(self.churn)
+        else:
+            self.churn = None
+        if self.option("checksums", "False") == "True":
+            self.consumers.append(hasher.Hasher(self))
+        if self.option("tree digests", "False") == "True":
+            self.consumers.append(tree_digest.TreeDigests(self.states,
+                                    self.option("tree digest by", "mtime")))
+        self.walker = Walker(path, self.rules, self.dircache, self.throttle)
+        if self.churn is not None:
+            self.walker.listed = self.churn.scanned
 
 
-    def ignoring(self, ignorals, dirent):
-        for suffix in ignorals:
-            # we only ignore suffixes "magically"
-            if dirent.endswith(suffix):
-                return True
-        return False
+    # per-context option, falling back to global
+    def option(self, key, default = None):
+        return self.config.getConfig(self.context, key, default)[0]
+
+
+    def add_consumer(self, consumer):
+        self.consumers.append(consumer)
+
+
+    # is a full scan part-way done?  (the next scan() carries on)
+    def resuming(self):
+        return self.progress.data.get("cursor") is not None
+
+
+    # start the next full scan from the top, whatever the cursor says
+    def restart(self):
+        self.save_cursor(None)
+
+
+    # the held deletions go with the cursor: they're for the entries
+    # behind it
+    def save_cursor(self, cursor):
+        self.progress.data["cursor"] = cursor
+        if cursor is None:
+            self.deleting = {}
+        self.progress.data["deleting"] = list(self.deleting.keys())
+        self.progress.write()
+
+
+    def walk(self, roots, nworkers = 1, resume = None, skip = ()):
+        return self.walker.walk(roots, nworkers, resume, skip)
+
+
+    # a shared walk's listings (see shared_scan.py), as our own walk()
+    # would have had them: without what we ignore or skip
+    def narrow(self, listings, resume = None, skip = ()):
+        resume_key = walk_key(resume) if resume is not None else None
+        dropped = set()
+        for path, dirstat, files in listings:
+            if path != ".":
+                parent = churn.parent(path)
+                name = path.rsplit("/", 1)[-1]
+                if parent in dropped or self.rules.ignoring(name, parent) \
+                        or finished(path, resume_key, skip):
+                    dropped.add(path)
+                    continue
+            if self.churn is not None:
+                self.churn.scanned(path)
+            if resume_key is not None and walk_key(path) < resume_key:
+                files = []
+            else:
+                files = [ dirent for dirent in files \
+                            if not self.rules.ignoring(dirent.name, path) ]
+            yield path, dirstat, files
 
 
-    def removeDeleteds(self):
+    def unreadable(self, path, err):
+        self.logger.warn(f"cannot read {self.path}/{path}: {err}")
+        self.unknown.add(path)
+
+
+    # was fqde, or a directory it's in, unreadable this scan?
+    def unknown_p(self, fqde):
+        if len(self.unknown) == 0:
+            return False
+        if "." in self.unknown:
+            return True
+        dir, name = fqde.rsplit("/", 1)
+        return subdir_for(dir, name) in self.unknown \
+            or churn.under(dir, self.unknown)
+
+
+    def stat(self, listings):
+        for path, dirstat, files in listings:
+            for dirent in files:
+                try:
+                    filestat = dirent.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                except OSError as err:
+                    self.unreadable(subdir_for(path, dirent.name), err)
+                    continue
+                yield fqde_for(path, dirent.name), filestat
+
+
+    # dirty: as for scan(); limits which unseen entries are DELETED
+    def classify(self, stats, dirty = None):
+        if dirty is None:
+            index = {}      # dir -> [ fqde ], for unseen()
+            for fqde in self.states.data:
+                index.setdefault(dirname(fqde), []).append(fqde)
+            dirs = collections.deque(sorted(index.keys(), key=walk_key))
+        current = None
+        for fqde, filestat in stats:
+            dir = dirname(fqde)
+            if dir != current:
+                current = self.resume_at = dir
+                if dirty is None:
+                    yield from self.unseen(index, dirs, walk_key(dir))
+            old = self.states.data.get(fqde)
+            self.states.touch(fqde)
+            state = file_state.from_stat(fqde, filestat)
+            if old is None:
+                yield ScanEvent(NEW, fqde, state, None, filestat)
+            elif file_state.maybechanged(state, old):
+                yield ScanEvent(CHANGED, fqde, state, old, filestat)
+            else:
+                # as it was: checksum, checksum_time, blocks, ...
+                yield ScanEvent(UNCHANGED, fqde, old, old, filestat)
+        if dirty is None:
+            yield from self.unseen(index, dirs)
+            return
         for fqde in self.states.clean_keys():
-            self.logger.debug(f"removed: {fqde}")
-            self.states.delete(fqde)
-        self.states.write()
+            if in_scope(fqde, dirty) and not self.unknown_p(fqde):
+                yield ScanEvent(DELETED, fqde, None,
+                                self.states.data[fqde], None)
+
+
+    # DELETED for the entries of indexed dirs before upto (a walk_key;
+    # None: all of them) which weren't seen: the walk is past them
+    def unseen(self, index, dirs, upto = None):
+        while len(dirs) > 0 and (upto is None or walk_key(dirs[0]) < upto):
+            for fqde in index.pop(dirs.popleft()):
+                if fqde in self.states.data \
+                        and fqde not in self.states.dirtybits \
+                        and not self.unknown_p(fqde):
+                    yield ScanEvent(DELETED, fqde, None,
+                                    self.states.data[fqde], None)
 
 
-    # recursively scan a directory; populate self.states
-    # FQDE = fully qualified directory entry: a full path for
-    # the file (relative to the source/replica base dir)
-    def scandir(self, path, ignorals):
-        if path.startswith("./"):
-            path = path[2:]
-        # ignore .gc directory entirely
-        if path == ".gc":
-            # print("skipping .gc")
+    # full scans: holds the DELETED events back till the end, then
+    # lets through those which confirm() says can go
+    def guard(self, events):
+        for event in events:
+            if event.kind == DELETED:
+                self.deleting[event.fqde] = event
+            else:
+                yield event
+        yield from self.confirm()
+
+
+    def confirm(self):
+        deleting = self.deleting
+        self.deleting = {}
+        entries = self.progress.data.get("entries", 0)
+        threshold = float(self.option("delete threshold", 25)) / 100
+        if len(deleting) < MASS_DELETE or len(deleting) <= threshold * entries:
+            self.progress.data["unconfirmed"] = []
+            yield from deleting.values()
             return
-        self.logger.debug(f"scanning path {path}, ignoring {ignorals}")
-        try:
-            direntries = os.listdir(path)
-        except (FileNotFoundError, PermissionError):
+        unconfirmed = set(self.progress.data.get("unconfirmed", []))
+        held = [ fqde for fqde in deleting if fqde not in unconfirmed ]
+        if len(held) > 0:
+            self.logger.warn(f"{len(deleting)} of {entries} entries " \
+                             f"vanished from {self.path}; keeping " \
+                             f"{len(held)} until the next scan confirms")
+        self.progress.data["unconfirmed"] = held
+        for fqde, event in deleting.items():
+            if fqde in unconfirmed:
+                yield event
+
+
+    # returns False if it stopped at deadline (a time.time()) rather
+    # than running out of events
+    def sink(self, events, batchsize = 1000, deadline = None):
+        batch = []
+        complete = True
+        for event in events:
+            batch.append(event)
+            if len(batch) >= batchsize:
+                for consumer in self.consumers:
+                    consumer.consume(batch)
+                batch = []
+                if deadline is not None and time.time() >= deadline:
+                    complete = False
+                    break
+                self.checkpoint()
+        if complete:
+            self.stamp()
+        for consumer in self.consumers:
+            consumer.consume(batch)
+            consumer.finish()
+        return complete
+
+
+    # the scan is done: the state is current as of when it started
+    def stamp(self):
+        if self.started is not None:
+            set_last_scan(self.states, self.started)
+
+
+    # flush the consumers, then note where we are; they're in this
+    # order so the state on disk is never behind the cursor
+    def checkpoint(self):
+        if self.next_checkpoint is None or time.time() < self.next_checkpoint:
             return
-        for dirent in sorted(direntries):
-            if self.ignoring(ignorals, dirent):
-                continue
-            fqde = f"{path}/{dirent}"
-            # self.logger.debug(f"scanning {fqde}")
-            if os.path.isdir(fqde):
-                self.scandir(fqde, ignorals)
-            else:
-                state = file_state.FileState(fqde, False)
-                self.states.set(fqde, state.to_dict())
+        for consumer in self.consumers:
+            if hasattr(consumer, "checkpoint"):
+                consumer.checkpoint()
+        self.save_cursor(self.resume_at)
+        self.next_checkpoint = time.time() + \
+                    str_to_duration(self.option("checkpoint", "1m"))
 
 
-    def scan(self):
+    # carrying on from cursor: entries (& cached listings) before it
+    # were seen by the last, interrupted, scan; it may have been
+    # holding some of them for deletion
+    def resume(self, cursor):
+        resume_key = walk_key(cursor)
+        self.deleting = { fqde : ScanEvent(DELETED, fqde, None,
+                                           self.states.data[fqde], None) \
+                            for fqde in self.progress.data.get("deleting", []) \
+                            if fqde in self.states.data }
+        for fqde in self.states.data:
+            if walk_key(dirname(fqde)) < resume_key:
+                self.states.touch(fqde)
+        self.keep(lambda path: walk_key(path) < resume_key)
+
+
+    # tiered scans: which cold subtrees to leave out this time
+    def plan(self, resume):
+        last_scan = self.progress.data.get("last scan", 0)
+        if resume is None:
+            self.progress.data["last scan"] = time.time()
+        skip = self.churn.plan(
+                    str_to_duration(self.option("cold after", "7d")),
+                    str_to_duration(self.option("max scan interval", "7d")),
+                    last_scan)
+        if len(skip) > 0:
+            self.logger.info(f"  Skipping {len(skip)} cold subtrees")
+            for fqde in self.states.data:
+                if churn.under(dirname(fqde), skip):
+                    self.states.touch(fqde)
+            self.keep(lambda path: churn.under(path, skip))
+        return skip
+
+
+    # keeps the bookkeeping for directories (paths) which pass test,
+    # though this scan won't see them
+    def keep(self, test):
+        if self.dircache is not None:
+            self.dircache.keep(test)
+        if self.churn is not None:
+            self.churn.keep(test)
+
+
+    # dirty: { dir : deep } from an inotify.Journal; only rescan
+    # those directories (and, if deep, everything under them).
+    # None => scan everything, or carry on with an interrupted scan.
+    #
+    # budget: seconds; a full scan stops (at the next batch) when it's
+    # used up.  Returns False if it stopped early.
+    def scan(self, dirty = None, budget = None):
         if not os.path.exists(self.path):
             self.logger.warn(f"cannot scan: {self.path} does not exist")
             return True
+        roots, resume, skip = self.prepare(dirty)
+        self.unknown = self.walker.unknown = set()
+        nworkers = int(self.option("scan workers", 1))
+        with self.throttle.priority():
+            listings = self.walk(roots, nworkers, resume, skip)
+            complete = self.run(listings, dirty, budget)
+        if self.dircache is not None:
+            if dirty is None and complete:
+                self.dircache.prune()
+            self.dircache.write()
+        return complete
+
+
+    # sets up a scan: returns the roots to walk, the cursor to resume
+    # from and the subtrees to skip
+    def prepare(self, dirty = None):
+        resume = None
+        skip = set()
+        # whatever touched the state since (e.g. late checksums) doesn't
+        # count as seen by this scan; the metadata isn't a file, and is
+        # never unseen
+        self.states.clear_dirtybits()
+        self.states.touch(self.states.metadata_key)
+        # when the state will be current as of, if the scan completes:
+        # a resumed scan's first part's start; a dirty scan doesn't
+        # count while a full scan is part-way done
+        self.started = time.time()
+        if dirty is None:
+            resume = self.progress.data.get("cursor")
+            if resume is None:
+                self.logger.info(f"  Scanning {self.path}")
+                self.progress.data["entries"] = len(self.states.data)
+                self.progress.data["started"] = self.started
+                self.deleting = {}
+            else:
+                self.logger.info(f"  Resuming scan of {self.path} at {resume}")
+                self.started = self.progress.data.get("started")
+                self.resume(resume)
+            roots = [ (".", True) ]
         else:
-            self.logger.info(f"  Scanning {self.path}")
-        cwd = os.getcwd()
-        os.chdir(self.path)
-        changed = self.scandir(".", self.ignorals)
-        os.chdir(cwd)
-        self.removeDeleteds()
-        self.states.write()
+            if self.resuming():
+                self.started = None
+            self.logger.info(f"  Scanning {len(dirty)} changed " \
+                             f"directories in {self.path}")
+            roots = [ (path, dirty[path]) for path in sorted(dirty.keys()) \
+                        if not under_deep(path, dirty) ]
+        if self.churn is not None:
+            self.churn.begin()
+            if dirty is None:
+                skip = self.plan(resume)
+        return roots, resume, skip
+
+
+    # runs listings (from walk(), or narrow()) through the rest of the
+    # pipeline; returns False if it ran out of budget
+    def run(self, listings, dirty = None, budget = None):
+        batchsize = int(self.option("scan batch", 1000))
+        deadline = None
+        if dirty is None:
+            self.next_checkpoint = time.time() + \
+                        str_to_duration(self.option("checkpoint", "1m"))
+            if budget is not None:
+                deadline = time.time() + budget
+        events = self.classify(self.stat(listings), dirty)
+        if dirty is None:
+            events = self.guard(events)
+        try:
+            complete = self.sink(events, batchsize, deadline)
+        except BaseException:
+            for consumer in self.consumers:
+                if hasattr(consumer, "abort"):
+                    consumer.abort()
+            raise
+        finally:
+            self.next_checkpoint = None
+            events.close()
+            listings.close()
+        if len(self.unknown) > 0:
+            self.logger.warn(f"  {len(self.unknown)} unreadable paths in " \
+                             f"{self.path}; kept what we knew of them")
+        self.progress.data["unknown"] = sorted(self.unknown)
+        if dirty is None:
+            if complete:
+                self.save_cursor(None)
+            else:
+                self.logger.info(f"  Paused scan of {self.path} at " \
+                                 f"{self.resume_at}")
+                self.save_cursor(self.resume_at)
+        if self.churn is not None and dirty is None and complete:
+            self.churn.prune()
+            self.churn.finish()
+        return complete
+
+
+
+# "scan budget: 10m": a context scans in slices of that long, with
+# status (or a push) in between; None (the default): all at once
+def scan_budget(context):
+    budget = config.Config.instance().getConfig(context, "scan budget",
+                                                "0")[0]
+    return str_to_duration(budget) or None
+
+
+# host.context.json -> host.context.{kind}.cache: local scanner
+# bookkeeping kept next to the state, but not sync'd with it
+def cache_filename(state_filename, kind):
+    if state_filename.endswith(".json"):
+        state_filename = state_filename[:-len(".json")]
+    return f"{state_filename}.{kind}.cache"
+
+
+# (".", "file") -> "./file"; ("a/b", "file") -> "a/b/file"
+def fqde_for(path, name):
+    return f"{path}/{name}"
+
+
+# (".", "dir") -> "dir"; ("a/b", "dir") -> "a/b/dir"
+def subdir_for(path, name):
+    if path == ".":
+        return name
+    return f"{path}/{name}"
+
+
+# "./file" -> "."; "a/b/file" -> "a/b"
+def dirname(fqde):
+    return fqde.rsplit("/", 1)[0]
+
+
+# sorts directories in the order walk() visits them: "." -> (),
+# "a/b" -> ("a", "b"), so "a/b" < "a-z" (as a string, it isn't)
+def walk_key(path):
+    if path == ".":
+        return ()
+    return tuple(path.split("/"))
+
+
+# was path done before the scan got to resume_key (but for the
+# cursor's ancestors), or is it in skip?
+def finished(path, resume_key, skip = ()):
+    if path in skip:
+        return True
+    if resume_key is None:
+        return False
+    key = walk_key(path)
+    return key < resume_key and key != resume_key[:len(key)]
+
+
+# when states' last complete scan started; None if it doesn't say
+def last_scan(states):
+    metadata = states.data.get(states.metadata_key)
+    if not isinstance(metadata, dict):
+        return None
+    return metadata.get(LAST_SCAN)
+
+
+def set_last_scan(states, when):
+    metadata = states.data.get(states.metadata_key)
+    if not isinstance(metadata, dict):
+        metadata = {}
+    metadata[LAST_SCAN] = when
+    states.data[states.metadata_key] = metadata
+    states.touch(states.metadata_key)
+    states.dirty = True
+
+
+# is fqde directly in a dirty directory, or anywhere under a deep one?
+def in_scope(fqde, dirty):
+    parent = dirname(fqde)
+    return parent in dirty or under_deep(parent, dirty)
+
+
+# is dir (strictly) under a deep dirty directory?  Looks up its
+# ancestors, so it's O(depth), however many directories are dirty
+def under_deep(dir, dirty):
+    while dir != ".":
+        dir = churn.parent(dir)
+        if dirty.get(dir, False):
+            return True
+    return False
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+    python3 scanner_bench.py [ nfiles [ files-per-dir ] ]
+
+Builds a synthetic tree of empty files in a temp dir, then walks it
+with the old listdir + isdir + FileState() walker and with
+scanner.Scanner: each stage of its pipeline on its own (walk, +stat,
++classify, +sink), in parallel, and an unchanged rescan served from
+the dir cache; reports entries/sec for each.
+"""
+
+import os, sys, time, tempfile, shutil
+import file_state, scanner
+
+
+def build_tree(root, nfiles, per_dir):
+    ndirs = 0
+    for i in range(nfiles):
+        if i % per_dir == 0:
+            dir = f"{root}/d{ndirs // 10:04d}/d{ndirs:05d}"
+            os.makedirs(dir)
+            ndirs += 1
+        with open(f"{dir}/f{i:07d}", "w"):
+            pass
+    # age the directories, or the dir cache won't trust them yet
+    old = time.time() - 3600
+    for dir, subdirs, files in os.walk(root):
+        os.utime(dir, (old, old))
+
+
+# the pre-os.scandir walker, kept here for comparison
+def legacy_scandir(path, states):
+    if path.startswith("./"):
+        path = path[2:]
+    try:
+        direntries = os.listdir(path)
+    except (FileNotFoundError, PermissionError):
+        return
+    for dirent in sorted(direntries):
+        fqde = f"{path}/{dirent}"
+        if os.path.isdir(fqde):
+            legacy_scandir(fqde, states)
+        else:
+            state = file_state.FileState(fqde, False)
+            states[fqde] = state.to_dict()
+
+
+def time_legacy(root):
+    states = {}
+    cwd = os.getcwd()
+    os.chdir(root)
+    start = time.time()
+    legacy_scandir(".", states)
+    elapsed = time.time() - start
+    os.chdir(cwd)
+    return len(states), elapsed
+
+
+# runs the scanner pipeline as far as stage; returns (entries, secs)
+def time_scanner(root, statefile, nworkers = 1, stage = "sink"):
+    scn = scanner.Scanner(root, [], statefile)
+    scn.states.lazy_timer = 3600  # measure the walk, not the JSON dump
+    start = time.time()
+    output = scn.walk([ (".", True) ], nworkers)
+    if stage == "walk":
+        n = sum([ len(files) for path, dirstat, files in output ])
+    else:
+        output = scn.stat(output)
+        if stage != "stat":
+            output = scn.classify(output)
+        if stage == "sink":
+            scn.sink(output)
+            n = len(scn.states.data)
+        else:
+            n = sum([ 1 for item in output ])
+    elapsed = time.time() - start
+    return n, elapsed
+
+
+# a "nothing changed" rescan, with the dir cache warmed up
+def time_rescan(root, statefile):
+    scanner.Scanner(root, [], statefile).scan()
+    return time_scanner(root, statefile)
+
+
+if __name__ == "__main__":
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    per_dir = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    tmpdir = tempfile.mkdtemp(prefix="gc-bench-")
+    try:
+        print(f"building {nfiles} files, {per_dir}/dir in {tmpdir}")
+        build_tree(f"{tmpdir}/tree", nfiles, per_dir)
+        tree = f"{tmpdir}/tree"
+        statefile = f"{tmpdir}/state.json"
+        for name, timer in (
+                ("listdir", lambda: time_legacy(tree)),
+                ("walk", lambda: time_scanner(tree, statefile, 1, "walk")),
+                ("+stat", lambda: time_scanner(tree, statefile, 1, "stat")),
+                ("+classify", lambda: time_scanner(tree, statefile, 1, 
+                                                   "classify")),
+                ("+sink", lambda: time_scanner(tree, statefile)),
+                ("4 workers", lambda: time_scanner(tree, statefile, 4)),
+                ("rescan", lambda: time_rescan(tree, statefile))):
+            n, elapsed = timer()
+            print(f"{name:>9}: {n} entries in {elapsed:.2f}s, " \
+                  f"{n/elapsed:,.0f} entries/sec")
+    finally:
+        shutil.rmtree(tmpdir)
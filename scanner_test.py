@@ -0,0 +1,287 @@
+#!/usr/local/bin/python3.6
+
+import unittest, scanner, persistent_dict, config, os, tempfile, shutil, time
+import threading, statusfier, churn
+from unittest import mock
+
+# the fqdes in states, without the metadata
+def files(states):
+    return sorted([ fqde for fqde, state in states.items() ])
+
+class TestScannerMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for dir in ("a", "a/b", "c", ".gc"):
+            os.makedirs(f"{tempdir}/tree/{dir}")
+        for file in ("top", "a/one", "a/b/two", "c/three", "c/.DS_Store",
+                     ".gc/state.json"):
+            with open(f"{tempdir}/tree/{file}", "w") as f:
+                f.write(file)
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def scan(self, ignorals = [".DS_Store"], context = 0, dirty = None):
+        scn = scanner.Scanner(f"{tempdir}/tree", ignorals,
+                              f"{tempdir}/state.json", context)
+        scn.scan(dirty)
+        return persistent_dict.PersistentDict(f"{tempdir}/state.json")
+
+    def test_scan(self):
+        states = self.scan()
+        self.assertEqual(files(states),
+                         ["./top", "a/b/two", "a/one", "c/three"])
+        self.assertEqual(states.get("a/one")["size"], len("a/one"))
+        self.assertEqual(states.get("a/one")["checksum"], "deferred")
+
+    def test_removed(self):
+        self.scan()
+        os.remove(f"{tempdir}/tree/a/b/two")
+        states = self.scan()
+        self.assertFalse(states.contains_p("a/b/two"))
+        self.assertTrue(states.contains_p("a/one"))
+
+    def test_parallel(self):
+        serial = self.scan()
+        os.remove(f"{tempdir}/state.json")
+        config.Config.instance().setConfig(99, "scan workers", "4")
+        parallel = self.scan(context = 99)
+        self.assertEqual(list(parallel.data.keys()), 
+                         list(serial.data.keys()))
+
+    def test_dircache(self):
+        old = time.time() - 3600
+        for dir in ("", "/a", "/a/b", "/c"):
+            os.utime(f"{tempdir}/tree{dir}", (old, old))
+        self.scan()
+        cache = persistent_dict.PersistentDict(f"{tempdir}/state.dirs.cache")
+        self.assertTrue(cache.contains_p("a/b"))
+        os.rename(f"{tempdir}/tree/a/one", f"{tempdir}/tree/a/uno")
+        with open(f"{tempdir}/tree/a/b/two", "a") as f:
+            f.write("more")
+        states = self.scan()
+        self.assertTrue(states.contains_p("a/uno"))
+        self.assertFalse(states.contains_p("a/one"))
+        self.assertEqual(states.get("a/b/two")["size"], len("a/b/two") + 4)
+
+    def test_dirty(self):
+        self.scan()
+        with open(f"{tempdir}/tree/a/new", "w") as f:
+            f.write("new")
+        with open(f"{tempdir}/tree/a/b/two", "a") as f:
+            f.write("not rescanned")
+        os.remove(f"{tempdir}/tree/c/three")
+        os.makedirs(f"{tempdir}/tree/d/e")
+        with open(f"{tempdir}/tree/d/e/four", "w") as f:
+            f.write("four")
+        states = self.scan(dirty = {"a": False, "c": False, "d": True})
+        self.assertEqual(files(states),
+                         ["./top", "a/b/two", "a/new", "a/one", "d/e/four"])
+        self.assertEqual(states.get("a/b/two")["size"], len("a/b/two"))
+
+    def test_concurrent(self):
+        shutil.copytree(f"{tempdir}/tree", f"{tempdir}/tree2")
+        os.remove(f"{tempdir}/tree2/a/one")
+        scanners = [ scanner.Scanner(f"{tempdir}/{tree}", [".DS_Store"],
+                                     f"{tempdir}/{tree}.json") \
+                        for tree in ("tree", "tree2") ]
+        threads = [ threading.Thread(target=scn.scan) for scn in scanners ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(files(scanners[0].states),
+                         ["./top", "a/b/two", "a/one", "c/three"])
+        self.assertEqual(files(scanners[1].states),
+                         ["./top", "a/b/two", "c/three"])
+
+    def test_budget(self):
+        for dir in ("d", "e", "f"):
+            os.makedirs(f"{tempdir}/tree/{dir}")
+            for i in range(3):
+                with open(f"{tempdir}/tree/{dir}/{i}", "w") as f:
+                    f.write(dir)
+        config.Config.instance().setConfig(98, "scan batch", "2")
+        scn = scanner.Scanner(f"{tempdir}/tree", [".DS_Store"],
+                              f"{tempdir}/state.json", 98)
+        started = time.time()
+        self.assertFalse(scn.scan(budget = 0))
+        self.assertTrue(scn.resuming())
+        self.assertNotIn("f/0", scn.states.data)
+        self.assertIsNone(scanner.last_scan(scn.states))
+        # behind the cursor: not noticed till next time round;
+        # ahead of it: gone
+        os.remove(f"{tempdir}/tree/./top")
+        os.remove(f"{tempdir}/tree/f/2")
+        scn = scanner.Scanner(f"{tempdir}/tree", [".DS_Store"],
+                              f"{tempdir}/state.json", 98)
+        self.assertTrue(scn.scan())
+        self.assertFalse(scn.resuming())
+        # current as of when the first part started
+        self.assertLess(scanner.last_scan(scn.states) - started, 0.1)
+        self.assertIn("./top", scn.states.data)
+        self.assertIn("f/1", scn.states.data)
+        self.assertNotIn("f/2", scn.states.data)
+        states = self.scan(context = 98)
+        self.assertNotIn("./top", states.data)
+        self.assertEqual(len(states.items()), 11)
+
+    def test_tiered(self):
+        config.Config.instance().setConfig(97, "tiered scan", "True")
+        self.scan(context = 97)
+        churn = persistent_dict.PersistentDict(f"{tempdir}/state.churn.cache")
+        self.assertEqual(sorted(churn.data.keys()), [".", "a", "a/b", "c"])
+        # a & c are cold (a/b is, but it's in a); c is overdue
+        for dir, entry in churn.data.items():
+            if dir != ".":
+                entry["changed"] = 0
+        churn.data["c"]["scanned"] = 0
+        churn.write()
+        with open(f"{tempdir}/tree/a/one", "a") as f:
+            f.write("not rescanned")
+        os.remove(f"{tempdir}/tree/c/three")
+        states = self.scan(context = 97)
+        self.assertEqual(files(states),
+                         ["./top", "a/b/two", "a/one"])
+        self.assertEqual(states.get("a/one")["size"], len("a/one"))
+        churn.read()
+        self.assertIn("a/b", churn.data)
+        self.assertGreater(churn.data["c"]["changed"], 0)
+        self.assertEqual(churn.data["c"]["changes"], 1)
+
+    def test_cold_tree(self):
+        old = time.time() - 400 * 86400
+        cold = churn.Churn(f"{tempdir}/cold.churn.cache")
+        for dir in (".", "A", "A/x", "B", "C", "D"):
+            cold.dirs.data[dir] = { "changed" : old, "changes" : 1,
+                                    "scanned" : time.time() - 86400 }
+        # nothing's changed in years: the top-level dirs are cold
+        self.assertEqual(cold.cold(7 * 86400), [ "A", "B", "C", "D" ])
+        # a day since the last scan, a week to go round: a slice of them
+        skip = cold.plan(7 * 86400, 7 * 86400, time.time() - 86400)
+        self.assertEqual(len(skip), 3)
+        self.assertTrue(skip < set([ "A", "B", "C", "D" ]))
+
+    def test_unreadable(self):
+        self.scan()
+        os.remove(f"{tempdir}/tree/a/one")
+        os.remove(f"{tempdir}/tree/c/three")
+        scandir = os.scandir
+        def flaky(path):
+            if path.endswith("/a"):
+                raise PermissionError(13, "Permission denied", path)
+            return scandir(path)
+        with mock.patch("os.scandir", flaky):
+            states = self.scan()
+        # a (and a/b under it) unknown: kept; c was read: gone
+        self.assertEqual(files(states),
+                         ["./top", "a/b/two", "a/one"])
+        states = self.scan()
+        self.assertEqual(files(states), ["./top", "a/b/two"])
+
+    def test_mass_delete(self):
+        os.makedirs(f"{tempdir}/tree/m")
+        for i in range(scanner.MASS_DELETE):
+            with open(f"{tempdir}/tree/m/{i}", "w") as f:
+                f.write("m")
+        self.scan()
+        shutil.rmtree(f"{tempdir}/tree/m")
+        os.remove(f"{tempdir}/tree/a/one")
+        states = self.scan()
+        self.assertEqual(len(states.items()), scanner.MASS_DELETE + 4)
+        # confirmed
+        os.remove(f"{tempdir}/tree/c/three")
+        states = self.scan()
+        self.assertEqual(files(states),
+                         ["./top", "a/b/two", "c/three"])
+        states = self.scan()
+        self.assertEqual(files(states), ["./top", "a/b/two"])
+
+    def test_walk_key(self):
+        dirs = ["a-z", "a/b", ".", "a", "a/b/c", "b"]
+        self.assertEqual(sorted(dirs, key=scanner.walk_key),
+                         [".", "a", "a/b", "a/b/c", "a-z", "b"])
+
+    def test_consumers(self):
+        config.Config.instance().setConfig(98, "scan batch", "2")
+        config.Config.instance().setConfig(98, "checkpoint", "0")
+        test = self
+        class Recorder:
+            def __init__(self, scn, stats):
+                self.scn, self.stats, self.calls = scn, stats, []
+            def consume(self, events):
+                # the StateWriter, ahead of us, has them; and the walk
+                # hasn't run ahead of the batch
+                for event in events:
+                    test.assertEqual(self.scn.states.contains_p(event.fqde),
+                                     event.kind != scanner.DELETED)
+                self.calls.append(([ (event.kind, event.fqde) \
+                                        for event in events ],
+                                   len(self.stats)))
+            def checkpoint(self):
+                self.calls.append("checkpoint")
+            def finish(self):
+                self.calls.append("finish")
+        def scan():
+            scn = scanner.Scanner(f"{tempdir}/tree", [".DS_Store"],
+                                  f"{tempdir}/state.json", 98)
+            stats = []
+            stat = scn.stat
+            def counting(listings):
+                for fqde, filestat in stat(listings):
+                    stats.append(fqde)
+                    yield fqde, filestat
+            scn.stat = counting
+            recorder = Recorder(scn, stats)
+            scn.add_consumer(recorder)
+            self.assertIs(scn.consumers[-1], recorder)
+            self.assertIsInstance(scn.consumers[0], scanner.StateWriter)
+            scn.scan()
+            return recorder.calls
+        self.assertEqual(scan(), [
+                ([ (scanner.NEW, "./top"), (scanner.NEW, "a/one") ], 2),
+                "checkpoint",
+                ([ (scanner.NEW, "a/b/two"), (scanner.NEW, "c/three") ], 4),
+                "checkpoint",
+                ([], 4), "finish" ])
+        with open(f"{tempdir}/tree/a/one", "a") as f:
+            f.write("more")
+        os.remove(f"{tempdir}/tree/c/three")
+        self.assertEqual(scan(), [
+                ([ (scanner.UNCHANGED, "./top"),
+                   (scanner.CHANGED, "a/one") ], 2),
+                "checkpoint",
+                ([ (scanner.UNCHANGED, "a/b/two"),
+                   (scanner.DELETED, "c/three") ], 3),
+                "checkpoint",
+                ([], 3), "finish" ])
+
+    def test_last_scan(self):
+        before = time.time()
+        states = self.scan()
+        first = scanner.last_scan(states)
+        self.assertGreaterEqual(first, before)
+        checksum_time = states.get("a/one")["checksum_time"]
+        time.sleep(0.01)
+        states = self.scan(dirty = {"a": False})
+        # unchanged files keep their checksum_time; the scan is newer
+        self.assertEqual(states.get("a/one")["checksum_time"], checksum_time)
+        self.assertGreater(scanner.last_scan(states), first)
+        self.assertIn("Current",
+                      statusfier.Statusfier().state_latency(states))
+
+    def test_in_scope(self):
+        dirty = { "a": False, "c": True, "c/d": False }
+        for fqde in ("a/one", "c/three", "c/d/e/four", "c/d/five"):
+            self.assertTrue(scanner.in_scope(fqde, dirty))
+        for fqde in ("./top", "a/b/two", "cc/six"):
+            self.assertFalse(scanner.in_scope(fqde, dirty))
+        self.assertTrue(scanner.in_scope("a/b/two", { ".": True }))
+        self.assertFalse(scanner.under_deep(".", { ".": True }))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestScannerMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,183 @@
+#! python3.x
+
+"""
+usage:
+    scrub = scrubber.Scrubber(context, path, ".gc/host.1.json")
+    scrub.scrub()               # one cycle's worth; True: nothing left due
+    scrubber.scrub(context, path, ".gc/host.1.json")    # if "scrub: True"
+
+Theory of Operation:
+    Bitrot doesn't change the size or the mtime, so no scan will ever
+    notice it: the only way to find it is to read the file again and
+    hash it.  With "scrub: True", after each cycle's scans the scrubber
+    does that to the files verified longest ago -- by checksum_time, or
+    when the scrubber last read them, whichever is later -- oldest
+    first, until "scrub budget" (time per cycle) runs out.  Reads go no
+    faster than "scrub rate" bytes/sec, on top of the context's read
+    limits (see governor.py), so a 20TB source gets through in weeks,
+    in the background, rather than never.  Either one 0: no limit.
+
+    When each file was last verified is kept in .gc/*.scrub.cache, as
+    it goes, so the next cycle (or the next daemon) carries on where
+    this one left off; files verified within "scrub every" aren't due.
+
+    Each file is hashed the way its checksum says (algorithm; sampled
+    fingerprints sample the same blocks again).  If it looks changed,
+    before or after, it's the scanner's business, not bitrot; it's
+    skipped.  A digest that doesn't match goes in the report,
+    .gc/*.bitrot.cache:
+
+        fqde -> { "expected", "found", "size", "mtime", "when", "repair" }
+
+    and a warning.  "repair" is the command to mend it, for files with
+    block digests (see repair.py).  Once a file verifies again, it's
+    taken off the report.
+"""
+
+import os, time, logging
+import config, persistent_dict, scanner, governor, digests, file_state
+import checksum_cache
+from utils import str_to_bytes, str_to_duration
+
+
+class Scrubber:
+    def __init__(self, context, path, states_filename, cancelled = None):
+        self.logger = logging.getLogger("gc.scrubber")
+        self.config = config.Config.instance()
+        self.context = context
+        self.path = path
+        self.states_filename = states_filename
+        self.cancelled = cancelled
+        self.rate = str_to_bytes(self.option("scrub rate", "10m"))
+        self.budget = str_to_duration(self.option("scrub budget", "1h"))
+        self.every = str_to_duration(self.option("scrub every", "30d"))
+        self.blocksize = int(self.option("BLOCKSIZE", 2**20))
+        self.nblocks = int(self.option("NBLOCKS", 0))
+        self.throttle = governor.Governor.instance().for_context(context)
+        self.pace = governor.TokenBucket(self.rate)
+        self.verified = persistent_dict.PersistentDict(
+                scanner.cache_filename(states_filename, "scrub"), 60)
+        self.report = persistent_dict.PersistentDict(
+                scanner.cache_filename(states_filename, "bitrot"))
+
+
+    def option(self, key, default = None):
+        return self.config.getConfig(self.context, key, default)[0]
+
+
+    # sum_file()'s throttle: "scrub rate", then the context's limits
+    def read(self, nbytes, st_dev = None):
+        self.pace.take(nbytes)
+        self.throttle.read(nbytes, st_dev)
+
+
+    # [ fqde ] with a checksum to check, least recently verified first
+    def due(self, states):
+        horizon = time.time() - self.every
+        due = []
+        for fqde, state in states.items():
+            if not checksum_cache.known(state.get("checksum")):
+                continue
+            when = max(state.get("checksum_time") or 0,
+                       self.verified.data.get(fqde, 0))
+            if when <= horizon:
+                due.append((when, fqde))
+        return [ fqde for when, fqde in sorted(due) ]
+
+
+    def scrub(self):
+        states = persistent_dict.PersistentDict(self.states_filename,
+                                                decode=file_state.decode)
+        self.forget(states)
+        due = self.due(states)
+        deadline = time.time() + self.budget if self.budget > 0 else None
+        files = nbytes = bad = 0
+        for fqde in due:
+            if (deadline is not None and time.time() >= deadline) or \
+                    (self.cancelled is not None and self.cancelled.is_set()):
+                break
+            verdict = self.verify(fqde, states.data[fqde])
+            files += 1
+            if verdict is not None:
+                nbytes += states.data[fqde]["size"]
+            if verdict is False:
+                bad += 1
+        self.verified.write()
+        if self.report.dirty:
+            self.report.write()
+        self.logger.info(f"scrubbed {files} files ({nbytes:,} bytes) " \
+                         f"of {len(due)} due; {bad} bad")
+        return files == len(due)
+
+
+    # True: the digest matches; False: bitrot; None: couldn't tell
+    def verify(self, fqde, state):
+        fname = f"{self.path}/{fqde}"
+        checksum = state["checksum"]
+        algorithm = digests.algorithm_of(checksum)
+        nblocks = 0
+        if digests.sampled(checksum):
+            if not file_state.sampling(state["size"], self.blocksize,
+                                       self.nblocks):
+                return None     # NBLOCKS has changed since
+            algorithm = algorithm[len(digests.SAMPLED):]
+            nblocks = self.nblocks
+        if not digests.available(algorithm) or self.changed(fname, state):
+            return None
+        found = file_state.sum_file(fname, algorithm, self.blocksize,
+                                    nblocks, self, self.cancelled)
+        if found is None or self.changed(fname, state):
+            return None
+        self.verified.set(fqde, time.time())
+        if found == checksum:
+            if fqde in self.report.data:
+                self.logger.info(f"{fqde} is good again")
+                self.report.delete(fqde)
+                self.report.dirty = True
+            return True
+        self.bitrot(fqde, state, found)
+        return False
+
+
+    # it's been written (or removed) since it was hashed: not bitrot
+    def changed(self, fname, state):
+        try:
+            filestat = os.stat(fname)
+        except FileNotFoundError:
+            return True
+        return filestat.st_size != state["size"] \
+                or filestat.st_mtime_ns != state["mtime_ns"]
+
+
+    def bitrot(self, fqde, state, found):
+        entry = { "expected" : state["checksum"],
+                  "found" : found,
+                  "size" : state["size"],
+                  "mtime" : state["mtime"],
+                  "when" : time.time() }
+        if "blocks" in state:
+            entry["repair"] = f"gc.py --repair {self.path}/{fqde}"
+        self.report.data[fqde] = entry
+        self.report.dirty = True
+        self.logger.warn(f"BITROT: {fqde} doesn't match its checksum")
+        if "repair" in entry:
+            self.logger.warn(f"  to mend it: {entry['repair']}")
+
+
+    # drop the files which are gone from the state
+    def forget(self, states):
+        for cache in (self.verified, self.report):
+            gone = [ fqde for fqde in cache.data if fqde not in states.data ]
+            for fqde in gone:
+                del cache.data[fqde]
+            if len(gone) > 0:
+                cache.dirty = True
+
+
+
+# a source's or replica's scrub, after its cycle, if "scrub: True"
+def scrub(context, path, states_filename):
+    cfg = config.Config.instance()
+    if cfg.getConfig(context, "scrub", "False")[0] != "True":
+        return True
+    return Scrubber(context, path, states_filename).scrub()
@@ -0,0 +1,220 @@
+#! python3.x
+
+"""
+usage:
+    seeder = seed.Seeder(context, replica, hostname)
+    seeder.seed(source_states)          # -> (files, bytes) seeded
+
+Theory of Operation:
+    Contexts overlap: Movies and Movies/mobile, the TMLite and
+    Documents bundles.  A replica on a host which already has the same
+    files in another context's folder -- a replica, or a source --
+    shouldn't have to pull them over the network again.  So before the
+    rsync pull, for each file the source state lists which isn't here
+    yet:
+
+      1. look for its (size, checksum) among the other local folders'
+         states.  A folder's own checksum is used if it has one; else,
+         for a replica, its source's -- if the size and mtime say the
+         copy is current
+      2. clone it from there, into a temporary name: a reflink
+         (FICLONE) where the filesystem can, else copy_file_range, else
+         a plain copy -- or a hard link, with "seed by: link" (see
+         below)
+      3. hash the copy: if it isn't what the source state says, it's
+         dropped (the other copy may be stale, or rotten).  Otherwise
+         it's renamed into place with the source's mtime, so rsync's
+         quick check passes it over and only sends the rest
+
+    Only files of at least "seed from replicas" bytes (default 0: off)
+    with full checksums (not sampled fingerprints) are seeded; files
+    already here are rsync's business.  The source state is the one
+    from the last pull (GhettoClusterReplica fetches it first).
+
+    A hard link is one file in two folders: whatever changes it in
+    place changes it in both.  So links are only made to other
+    replicas, and only if neither context's "rsync options" has
+    inplace; sources (which get edited in place: sparsebundle bands,
+    databases) and inplace replicas are copied from instead.
+"""
+
+import os, shutil, logging
+import config, persistent_dict, digests, file_state, checksum_cache, governor
+from statusfier import state_filename
+from utils import str_to_bytes
+
+FICLONE = 0x40049409    # _IOW(0x94, 9, int), linux/fs.h
+TMP_SUFFIX = ".gc-seed"
+
+
+class Seeder:
+    def __init__(self, context, replica, hostname = None):
+        self.logger = logging.getLogger("gc.seed")
+        self.config = config.Config.instance()
+        self.context = context
+        self.replica = replica
+        self.path = config.path_for(replica)
+        self.hostname = hostname if hostname is not None \
+                                 else config.host_for(replica)
+        self.min_size = str_to_bytes(self.config.getConfig(context,
+                                        "seed from replicas", "0")[0])
+        self.by = self.config.getConfig(context, "seed by", "copy")[0]
+        self.throttle = governor.Governor.instance().for_context(context)
+
+
+    # [ (fqde, state) ] in source_states, not here yet, worth seeding
+    def wanted(self, source_states):
+        wanted = []
+        for fqde, state in source_states.items():
+            checksum = state.get("checksum")
+            if state["size"] < max(self.min_size, 1) \
+                    or not checksum_cache.known(checksum) \
+                    or digests.sampled(checksum):
+                continue
+            if not os.path.lexists(f"{self.path}/{fqde}"):
+                wanted.append((fqde, state))
+        return wanted
+
+
+    # [ (path, source, states filename, context) ]: the other folders
+    # on this host; source is None for a source folder
+    def neighbours(self):
+        folders = []
+        sources = self.config.get_sources_for_host(self.hostname)
+        for context, source in sources.items():
+            folders.append((config.path_for(source), None,
+                            state_filename(context, source, source), context))
+        replicas = self.config.get_replicas_for_host(self.hostname)
+        for context, replica in replicas.items():
+            if context == self.context:
+                continue
+            source = self.config.get_source_for_context(context)
+            folders.append((config.path_for(replica),
+                            state_filename(context, replica, source),
+                            state_filename(context, replica, replica),
+                            context))
+        return [ folder for folder in folders \
+                    if os.path.realpath(folder[0]) != \
+                        os.path.realpath(self.path) ]
+
+
+    # may a replica file share an inode with one of context's?
+    def linkable(self, context, source_filename):
+        return source_filename is not None \
+                and not self.inplace(self.context) \
+                and not self.inplace(context)
+
+
+    def inplace(self, context):
+        return "inplace" in self.config.getConfig(context, "rsync options")
+
+
+    # { (size, checksum) : (fname, linkable) } for the neighbours' files
+    # of sizes
+    def index(self, sizes):
+        found = {}
+        for path, source_filename, states_filename, context \
+                in self.neighbours():
+            if not os.path.exists(states_filename):
+                continue
+            linkable = self.linkable(context, source_filename)
+            states = persistent_dict.PersistentDict(states_filename,
+                                                    decode=file_state.decode)
+            theirs = {}
+            if source_filename is not None \
+                    and os.path.exists(source_filename):
+                theirs = persistent_dict.PersistentDict(source_filename,
+                                            decode=file_state.decode).data
+            for fqde, state in states.items():
+                if state["size"] not in sizes:
+                    continue
+                checksum = state.get("checksum")
+                if not checksum_cache.known(checksum) and fqde in theirs:
+                    other = theirs[fqde]
+                    if other["size"] == state["size"] \
+                            and int(other["mtime"]) == int(state["mtime"]):
+                        checksum = other.get("checksum")
+                if checksum_cache.known(checksum):
+                    found.setdefault((state["size"], checksum),
+                                     (f"{path}/{fqde}", linkable))
+        return found
+
+
+    def seed(self, source_states):
+        wanted = self.wanted(source_states)
+        if len(wanted) == 0:
+            return (0, 0)
+        index = self.index(set([ state["size"] for fqde, state in wanted ]))
+        files = nbytes = 0
+        for fqde, state in wanted:
+            match, linkable = index.get((state["size"], state["checksum"]),
+                                        (None, False))
+            if match is not None \
+                    and self.seed_one(fqde, state, match,
+                                      self.by == "link" and linkable):
+                files += 1
+                nbytes += state["size"]
+        if files > 0:
+            self.logger.info(f"  seeded {files} files, " \
+                             f"{nbytes/2**30:.2f}GB from local copies")
+        return (files, nbytes)
+
+
+    # link: hard-link match, rather than copy it
+    def seed_one(self, fqde, state, match, link = False):
+        dest = f"{self.path}/{fqde}"
+        tmpfile = f"{dest}{TMP_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if link:
+                os.link(match, tmpfile)
+            else:
+                clone(match, tmpfile)
+            checksum = file_state.sum_file(tmpfile,
+                            digests.algorithm_of(state["checksum"]),
+                            throttle=self.throttle)
+            if checksum != state["checksum"]:
+                self.logger.info(f"  {match} isn't what {fqde} should be")
+                os.unlink(tmpfile)
+                return False
+            if not link:
+                os.utime(tmpfile, ns=(state["mtime_ns"], state["mtime_ns"]))
+            os.rename(tmpfile, dest)
+        except OSError as err:
+            self.logger.warn(f"cannot seed {fqde} from {match}: {err}")
+            if os.path.lexists(tmpfile):
+                os.unlink(tmpfile)
+            return False
+        return True
+
+
+
+# a copy of src at dst: reflink if the filesystem can, else
+# copy_file_range (in the kernel), else read & write
+def clone(src, dst):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            import fcntl
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                           size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                if copied == size:
+                    return "copy_file_range"
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 2**20)
+        return "copy"
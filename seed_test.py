@@ -0,0 +1,93 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil
+from unittest import mock
+import scanner, seed, config, persistent_dict, file_state
+
+class TestSeedMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for folder in ("source/mobile", "other", "replica"):
+            os.makedirs(f"{tempdir}/{folder}")
+        for i in range(4):
+            with open(f"{tempdir}/source/mobile/{i}.mkv", "w") as f:
+                f.write(f"movie {i}" * 100)
+            shutil.copy(f"{tempdir}/source/mobile/{i}.mkv",
+                        f"{tempdir}/other/{i}.mkv")
+        with open(f"{tempdir}/other/2.mkv", "w") as f:
+            f.write(f"stale 2" * 100)     # same size, different content
+        config.Config.instance().setConfig(93, "checksums", "True")
+        config.Config.instance().setConfig(93, "seed from replicas", "1")
+        for folder in ("source", "other"):
+            scanner.Scanner(f"{tempdir}/{folder}", [],
+                            f"{tempdir}/{folder}.json", 93).scan()
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+        config.Config.instance().setConfig(93, "seed by", "copy")
+        config.Config.instance().config[93].pop("rsync options", None)
+
+    # other: a source folder; or, with source_filename, a replica
+    def seeder(self, source_filename = None):
+        seeder = seed.Seeder(93, f"localhost:{tempdir}/replica", "localhost")
+        seeder.neighbours = lambda: [ (f"{tempdir}/other", source_filename,
+                                       f"{tempdir}/other.json", 94) ]
+        return seeder
+
+    def test_seed(self):
+        source = persistent_dict.PersistentDict(f"{tempdir}/source.json",
+                                                decode=file_state.decode)
+        # 3 has rotted over there since it was hashed
+        with open(f"{tempdir}/other/3.mkv", "rb+") as f:
+            f.write(b"X")
+        files, nbytes = self.seeder().seed(source)
+        # 2 is stale over there
+        self.assertEqual(files, 2)
+        for i in (0, 1):
+            with open(f"{tempdir}/replica/mobile/{i}.mkv") as f:
+                self.assertEqual(f.read(), f"movie {i}" * 100)
+            self.assertEqual(os.stat(f"{tempdir}/replica/mobile/{i}.mkv")
+                                .st_mtime,
+                             source.get(f"mobile/{i}.mkv")["mtime"])
+        for i in (2, 3):
+            self.assertFalse(os.path.exists(
+                                f"{tempdir}/replica/mobile/{i}.mkv"))
+        self.assertEqual([ name for name in os.listdir(
+                                f"{tempdir}/replica/mobile") \
+                            if name.endswith(seed.TMP_SUFFIX) ], [])
+        # already here: nothing to do
+        self.assertEqual(self.seeder().seed(source), (0, 0))
+
+    def test_link(self):
+        config.Config.instance().setConfig(93, "seed by", "link")
+        source = persistent_dict.PersistentDict(f"{tempdir}/source.json",
+                                                decode=file_state.decode)
+        linked = lambda: os.path.samefile(f"{tempdir}/other/0.mkv",
+                                          f"{tempdir}/replica/mobile/0.mkv")
+        # never to a source: it may be edited in place.  (2 is stale)
+        self.assertEqual(self.seeder().seed(source)[0], 3)
+        self.assertFalse(linked())
+        shutil.rmtree(f"{tempdir}/replica/mobile")
+        # nor with rsync --inplace
+        config.Config.instance().setConfig(93, "rsync options", "inplace")
+        self.assertEqual(self.seeder(f"{tempdir}/none.json").seed(source)[0],
+                         3)
+        self.assertFalse(linked())
+        shutil.rmtree(f"{tempdir}/replica/mobile")
+        config.Config.instance().config[93].pop("rsync options")
+        self.assertEqual(self.seeder(f"{tempdir}/none.json").seed(source)[0],
+                         3)
+        self.assertTrue(linked())
+
+    def test_clone(self):
+        src = f"{tempdir}/other/0.mkv"
+        self.assertIn(seed.clone(src, f"{tempdir}/copy"),
+                      ("reflink", "copy_file_range", "copy"))
+        with open(src) as a, open(f"{tempdir}/copy") as b:
+            self.assertEqual(a.read(), b.read())
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSeedMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,280 @@
+#! python3.x
+
+"""
+usage:
+    for scanners in shared_scan.group(scanners, lambda scn: scn.path):
+        complete = shared_scan.SharedScan(scanners).scan()  # [ bool ]
+
+Theory of Operation:
+    Several contexts may have the same source directory -- or one
+    inside another's (Movies, Movies/mobile) -- each with its own
+    ignore rules and state file.  Rather than walk the disk once for
+    each, group() puts them together and SharedScan walks the
+    outermost directory once, for all of them:
+
+      walk:     one Walker over the outermost path; it goes wherever
+                  at least one of the Scanners wants to (UnionRules)
+      fan out:  each directory is re-rooted for each Scanner it's in
+                  and handed over through a (bounded) Channel
+      per Scanner, in its own thread:
+                narrow() -- drop what it ignores or skips -- then its
+                  own stat / classify / sink, to its own state file
+
+    Each file is stat'd once: the DirEntry caches it for the rest.  The
+    walk runs no further ahead than the slowest Scanner's Channel.
+
+    Only full scans are shared; inotify (dirty) scans are per context.
+"""
+
+import os, threading, collections, logging
+import scanner, churn
+
+
+# "Movies/mobile/x", "Movies/mobile" -> "x"; None if it's not in there
+def reroot(path, prefix):
+    if prefix == ".":
+        return path
+    if path == prefix:
+        return "."
+    if path.startswith(f"{prefix}/"):
+        return path[len(prefix)+1:]
+    return None
+
+
+# is path on the way to prefix?  ("Movies" is, for "Movies/mobile")
+def leads_to(path, prefix):
+    return prefix != "." and (path == "." or prefix.startswith(f"{path}/"))
+
+
+# [ item ] -> [ [ item ] ]: those whose key(item) paths are the same,
+# or one inside another, go together; outermost first
+def group(items, key):
+    groups = []
+    for item in sorted(items, key=lambda item: len(os.path.realpath(key(item)))):
+        path = os.path.realpath(key(item))
+        for members in groups:
+            root = os.path.realpath(key(members[0]))
+            if path == root or path.startswith(root.rstrip("/") + "/"):
+                members.append(item)
+                break
+        else:
+            groups.append([ item ])
+    return groups
+
+
+
+# a bounded hand-off from the walk to one Scanner's thread; either
+# end may close() it
+class Channel:
+    def __init__(self, size = 64):
+        self.items = collections.deque()
+        self.size = size
+        self.closed = False
+        self.cv = threading.Condition()
+
+
+    # returns False if the reader has gone
+    def put(self, item):
+        with self.cv:
+            while len(self.items) >= self.size and not self.closed:
+                self.cv.wait()
+            if self.closed:
+                return False
+            self.items.append(item)
+            self.cv.notify_all()
+            return True
+
+
+    def close(self):
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+
+
+    def __iter__(self):
+        while True:
+            with self.cv:
+                while len(self.items) == 0 and not self.closed:
+                    self.cv.wait()
+                if len(self.items) == 0:
+                    return
+                item = self.items.popleft()
+                self.cv.notify_all()
+            yield item
+
+
+
+# one Scanner's part in a shared scan
+class View:
+    def __init__(self, scn, prefix, resume, skip):
+        self.scanner = scn
+        self.prefix = prefix
+        self.resume_key = scanner.walk_key(resume) \
+                                if resume is not None else None
+        self.resume = resume
+        self.skip = skip
+        self.channel = Channel()
+
+
+    # path (relative to the top of the shared walk): does this Scanner
+    # want it walked (a directory) or listed (a file)?
+    def wants(self, path):
+        inner = reroot(path, self.prefix)
+        if inner is None:
+            return leads_to(path, self.prefix)
+        if inner == ".":
+            return True
+        parent = churn.parent(inner)
+        name = inner.rsplit("/", 1)[-1]
+        return not self.scanner.rules.ignoring(name, parent) \
+                and not scanner.finished(inner, self.resume_key, self.skip)
+
+
+
+# the walk ignores what none of the views want
+class UnionRules:
+    def __init__(self, views):
+        self.views = views
+
+
+    def ignoring(self, name, dir = "."):
+        path = scanner.subdir_for(dir, name)
+        for view in self.views:
+            if view.wants(path):
+                return False
+        return True
+
+
+
+# the shared walk's unreadable paths, as one view sees them
+class Rerooted:
+    def __init__(self, paths, prefix):
+        self.paths = paths
+        self.prefix = prefix
+        # the view's top and everything on the way to it
+        self.above = [ prefix ]
+        while self.above[-1] != ".":
+            self.above.append(churn.parent(self.above[-1]))
+
+
+    def outer(self, path):
+        if self.prefix == ".":
+            return path
+        if path == ".":
+            return self.prefix
+        return f"{self.prefix}/{path}"
+
+
+    # the view's top, or something on the way to it, is unreadable;
+    # O(depth), however many paths there are (the walk adds to them)
+    def covered(self):
+        for path in self.above:
+            if path in self.paths:
+                return True
+        return False
+
+
+    def add(self, path):
+        self.paths.add(self.outer(path))
+
+
+    def __contains__(self, path):
+        return self.outer(path) in self.paths or self.covered()
+
+
+    def __iter__(self):
+        for path in list(self.paths):
+            inner = reroot(path, self.prefix)
+            if inner is not None:
+                yield inner
+
+
+    def __len__(self):
+        return len(list(iter(self))) + (1 if self.covered() else 0)
+
+
+
+class SharedScan:
+    # scanners: outermost first, as from group()
+    def __init__(self, scanners):
+        self.logger = logging.getLogger("gc.shared_scan")
+        self.scanners = scanners
+        top = os.path.realpath(scanners[0].path)
+        self.prefixes = [ os.path.relpath(os.path.realpath(scn.path), top) \
+                            for scn in scanners ]
+
+
+    # a full scan for each Scanner; budgets: [ seconds or None ], one
+    # each.  Returns [ complete ], as Scanner.scan() would.
+    def scan(self, budgets = None):
+        primary = self.scanners[0]
+        if budgets is None:
+            budgets = [ None ] * len(self.scanners)
+        if not os.path.exists(primary.path):
+            self.logger.warn(f"cannot scan: {primary.path} does not exist")
+            return [ True ] * len(self.scanners)
+        self.logger.info(f"  Walking {primary.path} once for " \
+                         f"{len(self.scanners)} contexts")
+        views = []
+        for scn, prefix in zip(self.scanners, self.prefixes):
+            roots, resume, skip = scn.prepare()
+            views.append(View(scn, prefix, resume, skip))
+        walker = scanner.Walker(primary.path, UnionRules(views),
+                                primary.dircache, primary.throttle)
+        for view in views:
+            view.scanner.unknown = Rerooted(walker.unknown, view.prefix)
+
+        results = [ None ] * len(views)
+        errors = [ None ] * len(views)
+        def run(i, view):
+            try:
+                listings = view.scanner.narrow(iter(view.channel),
+                                               view.resume, view.skip)
+                results[i] = view.scanner.run(listings, None, budgets[i])
+            except BaseException as err:
+                errors[i] = err
+            finally:
+                view.channel.close()
+
+        walked = False
+        nworkers = int(primary.option("scan workers", 1))
+        with primary.throttle.priority():
+            threads = [ threading.Thread(target=run, args=(i, view),
+                                daemon=True,
+                                name=f"view-{view.scanner.context}") \
+                            for i, view in enumerate(views) ]
+            for thread in threads:
+                thread.start()
+            listings = walker.walk([ (".", True) ], nworkers)
+            try:
+                walked = self.fan_out(listings, views)
+            finally:
+                listings.close()
+                for view in views:
+                    view.channel.close()
+                for thread in threads:
+                    thread.join()
+        for err in errors:
+            if err is not None:
+                raise err
+        if primary.dircache is not None:
+            if walked and all(results):
+                primary.dircache.prune()
+            primary.dircache.write()
+        return results
+
+
+    # returns False if every view stopped (out of budget) before the
+    # walk was done
+    def fan_out(self, listings, views):
+        for path, dirstat, files in listings:
+            live = False
+            for view in views:
+                inner = reroot(path, view.prefix)
+                if inner is None:
+                    live = live or not view.channel.closed
+                elif view.channel.put((inner, dirstat, files)):
+                    live = True
+            if not live:
+                return False
+        return True
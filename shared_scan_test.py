@@ -0,0 +1,86 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil
+from unittest import mock
+import scanner, shared_scan, persistent_dict
+
+class TestSharedScanMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for dir in ("a", "a/b", "a/.gc", "c", ".gc"):
+            os.makedirs(f"{tempdir}/tree/{dir}")
+        for file in ("top", "a/one", "a/b/two", "a/b/two.tmp", "c/three",
+                     "c/.DS_Store"):
+            with open(f"{tempdir}/tree/{file}", "w") as f:
+                f.write(file)
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    # (path, ignorals, state file)
+    VIEWS = [ ("tree", [".DS_Store"], "all"),
+              ("tree", ["/c", ".tmp"], "noc"),
+              ("tree/a", [], "a") ]
+
+    def scanners(self, suffix):
+        return [ scanner.Scanner(f"{tempdir}/{path}", ignorals,
+                                 f"{tempdir}/{name}.{suffix}.json") \
+                    for path, ignorals, name in self.VIEWS ]
+
+    def test_group(self):
+        paths = ["/x/Movies/mobile", "/x/Movies", "/x/Music", "/x/Movies"]
+        self.assertEqual(sorted(shared_scan.group(paths, lambda path: path)),
+                         [["/x/Movies", "/x/Movies", "/x/Movies/mobile"],
+                          ["/x/Music"]])
+
+    def test_shared(self):
+        for scn in self.scanners("alone"):
+            scn.scan()
+        scandir = os.scandir
+        listed = []
+        def counting(path):
+            listed.append(path)
+            return scandir(path)
+        with mock.patch("os.scandir", counting):
+            complete = shared_scan.SharedScan(self.scanners("shared")).scan()
+        self.assertEqual(complete, [True, True, True])
+        self.assertEqual(len(listed), len(set(listed)))
+        for path, ignorals, name in self.VIEWS:
+            alone = persistent_dict.PersistentDict(
+                                        f"{tempdir}/{name}.alone.json")
+            shared = persistent_dict.PersistentDict(
+                                        f"{tempdir}/{name}.shared.json")
+            self.assertEqual(sorted(shared.data.keys()),
+                             sorted(alone.data.keys()))
+        shared = persistent_dict.PersistentDict(f"{tempdir}/a.shared.json")
+        self.assertEqual(sorted([ fqde for fqde, state in shared.items() ]),
+                         ["./one", "b/two", "b/two.tmp"])
+
+    def test_reroot(self):
+        self.assertEqual(shared_scan.reroot("a/b", "a"), "b")
+        self.assertEqual(shared_scan.reroot("a", "a"), ".")
+        self.assertIsNone(shared_scan.reroot("ab", "a"))
+        self.assertEqual(shared_scan.reroot("ab", "."), "ab")
+        self.assertTrue(shared_scan.leads_to(".", "a/b"))
+        self.assertTrue(shared_scan.leads_to("a", "a/b"))
+        self.assertFalse(shared_scan.leads_to("a/b", "a/b"))
+
+    def test_rerooted(self):
+        paths = set([ "c/d", "a/bc" ])
+        unknown = shared_scan.Rerooted(paths, "a/b")
+        self.assertFalse(unknown.covered())
+        self.assertNotIn("x", unknown)
+        paths.add("a/b/x")
+        self.assertIn("x", unknown)
+        self.assertEqual(list(unknown), [ "x" ])
+        paths.add("a")
+        self.assertTrue(unknown.covered())
+        self.assertIn("y", unknown)
+        self.assertTrue(shared_scan.Rerooted(set([ "." ]), "a").covered())
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSharedScanMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3.7
 
 import logging, os, os.path, time
-import persistent_dict, config
+import persistent_dict, config, tree_digest, scanner, checksum_cache, digests
+import file_state
 from utils import str_to_duration, duration_to_str
 
+# (entries, bytes); hard links to the same file count its bytes once
 def sizeof(states):
     nfiles = nbytes = 0
+    inodes = set()
     for fqde, state in states.items():
         # if fqde.startswith(".gc/"):
         #    continue
         nfiles += 1
+        if "inode" in state:
+            if state["inode"] in inodes:
+                continue
+            inodes.add(state["inode"])
         nbytes += state["size"]
     return (nfiles, nbytes)
 
@@ -34,8 +41,17 @@ class Statusfier:
         return checksum_time
 
 
+    # when the state was last brought up to date: its last complete
+    # scan, or (states from before they said) its newest checksum
+    def last_update(self, states):
+        last_scan = scanner.last_scan(states)
+        if last_scan is not None:
+            return last_scan
+        return self.newest_checksum(states)
+
+
     def state_latency(self, states):
-        latency = time.time() - self.newest_checksum(states)
+        latency = time.time() - self.last_update(states)
         if latency < str_to_duration(self.config.getOption("cycle", "24h")):
             msg = "Current"
         else:
@@ -54,20 +70,42 @@ class Statusfier:
 
 
 
-    # returns newest checksum_time in source - newest checksum_time in replica
+    # returns the source's last update - the replica's
     def replica_latency(self, source_states, replica_states):
-        return self.newest_checksum(source_states) - \
-                self.newest_checksum(replica_states)
+        return self.last_update(source_states) - \
+                self.last_update(replica_states)
+
+
+    # [ dir ] which differ between the two states' trees ([]: none;
+    # the roots match), or None if they can't say
+    def differing(self, source_states, replica_states):
+        source_tree = tree_digest.tree_of(source_states)
+        replica_tree = tree_digest.tree_of(replica_states)
+        if source_tree is None or replica_tree is None \
+                or source_tree.get(tree_digest.TREE_BY) \
+                    != replica_tree.get(tree_digest.TREE_BY):
+            return None
+        if tree_digest.identical(source_tree, replica_tree):
+            return []
+        return tree_digest.differing(source_tree, replica_tree)
 
 
     def replica_is_current(self, latency):
         return latency < str_to_duration(self.config.getOption("cycle", "24h"))
 
 
-    def replica_overage(self, source_states, replica_states):
+    # with tree digests on both sides, only the directories where they
+    # differ need looking at; dirs: differing(), if it's been worked out
+    def replica_overage(self, source_states, replica_states, dirs = None):
         n = 0
         msg = "\tIn replica, but not in source:\n"
+        if dirs is None:
+            dirs = self.differing(source_states, replica_states)
+        if dirs is not None:
+            dirs = set(dirs)
         for name, state in replica_states.items():
+            if dirs is not None and scanner.dirname(name) not in dirs:
+                continue
             if not source_states.contains_p(name):
                 msg += f"\t  {name}: {state['size']}\n"
                 n += 1
@@ -96,19 +134,80 @@ class Statusfier:
             return msg
         latency = self.replica_latency(source_states, replica_states)
         msg += "\n\t" + self.state_latency(replica_states)
+        dirs = self.differing(source_states, replica_states)
+        if dirs is not None:
+            if len(dirs) == 0:
+                msg += "\n\tIdentical to source"
+            else:
+                msg += f"\n\t{len(dirs)} directories differ from " \
+                        f"source: {', '.join(dirs[:5])}" \
+                        + (" ..." if len(dirs) > 5 else "")
+        # trees by checksum: where they agree, so do the checksums.  By
+        # mtime, they can't say whether the content came through intact
+        if dirs is not None \
+                and tree_digest.tree_of(source_states)[tree_digest.TREE_BY] \
+                    == "checksum":
+            verified, mismatched, rehash = self.verify(source_states,
+                                                replica_states, dirs)
+        else:
+            verified, mismatched, rehash = self.verify(source_states,
+                                                       replica_states)
+        if verified + len(mismatched) + rehash > 0:
+            msg += f"\n\t{verified} files verified against the source"
+            if rehash > 0:
+                msg += f"; {rehash} in another hash algorithm"
+        if len(mismatched) > 0:
+            msg += f"\n\t{len(mismatched)} files DON'T MATCH the source: " \
+                    f"{', '.join(mismatched[:5])}" \
+                    + (" ..." if len(mismatched) > 5 else "")
         if replica_files > target_files:
-            msg += "\n" + self.replica_overage(source_states, replica_states)
+            msg += "\n" + self.replica_overage(source_states, replica_states,
+                                                dirs)
         return msg
 
 
+    # end to end: the replica's checksums (see transfer_hasher.py) of
+    # files whose size and mtime match the source's, against the
+    # source's.  (verified, [ mismatched fqde ], how many can't be
+    # compared: different algorithms, so one side has to hash again).
+    # dirs: only look in those (None: everywhere)
+    def verify(self, source_states, replica_states, dirs = None):
+        verified = rehash = 0
+        mismatched = []
+        if dirs is not None:
+            if len(dirs) == 0:
+                return verified, mismatched, rehash
+            dirs = set(dirs)
+        for fqde, state in replica_states.items():
+            if dirs is not None and scanner.dirname(fqde) not in dirs:
+                continue
+            checksum = state.get("checksum")
+            source = source_states.data.get(fqde)
+            if source is None or not checksum_cache.known(checksum) \
+                    or not checksum_cache.known(source.get("checksum")) \
+                    or source["size"] != state["size"] \
+                    or int(source["mtime"]) != int(state["mtime"]):
+                continue
+            same = digests.compare(source["checksum"], checksum)
+            if same is None:
+                rehash += 1
+            elif same:
+                verified += 1
+            else:
+                mismatched.append(fqde)
+        return verified, sorted(mismatched), rehash
+
+
 
     def get_status_for_source(self, context, source):
         source_file = state_filename(context, source, source)
-        source_states = persistent_dict.PersistentDict(source_file)
+        source_states = persistent_dict.PersistentDict(source_file,
+                                decode=file_state.decode)
         self.logger.info(self.inspect_source(context, source, source_states))
         for replica in self.config.get_replicas_for_context(context):
             replica_file = state_filename(context, source, replica)
-            replica_states = persistent_dict.PersistentDict(replica_file)
+            replica_states = persistent_dict.PersistentDict(replica_file,
+                                decode=file_state.decode)
             msg = self.inspect_replica(replica, source_states, replica_states)
             self.logger.info(f"  {msg}")
     
@@ -116,10 +215,12 @@ class Statusfier:
     def get_status_for_replica(self, context, replica, brief=False):
         source = self.config.get_source_for_context(context)
         source_file = state_filename(context, replica, source)
-        source_states = persistent_dict.PersistentDict(source_file)
+        source_states = persistent_dict.PersistentDict(source_file,
+                                decode=file_state.decode)
         replica_file = state_filename(context, replica, replica)
         self.logger.debug(f"replica file: {replica_file}")
-        replica_states = persistent_dict.PersistentDict(replica_file)
+        replica_states = persistent_dict.PersistentDict(replica_file,
+                                decode=file_state.decode)
         msg = self.inspect_replica(replica, source_states, 
                                     replica_states, brief)
         self.logger.info(msg)
@@ -0,0 +1,195 @@
+#! python3.x
+
+"""
+usage:
+    transfer = transfer_hasher.TransferHasher(path, states_filename, context)
+    scn.consumers.insert(0, transfer)       # before the StateWriter
+    rsync.rsync(source, path, args + [ transfer.out_format() ],
+                line_callback=transfer.line)
+    transfer.wait()
+
+Theory of Operation:
+    A replica's state says 'deferred' for every checksum, unless it
+    reads the whole disk again after the pull -- days, on a USB disk.
+    But rsync has just written each file, and says so: with
+    --out-format, it prints a line as each one is finished.  With
+    "transfer digests: True", each of those lines (">f..." items:
+    files received) hands the file to a pool of "hash workers", while
+    rsync gets on with the next one; the file is most likely still in
+    the page cache.
+
+    Digests are kept, by fqde with the size and mtime they were taken
+    at, in .gc/*.digests.cache (so a restart doesn't lose them).  The
+    replica's scans pick them up: as a consumer ahead of the
+    StateWriter, any entry whose size and mtime still match gets the
+    digest (and a fresh checksum_time), and it's dropped from the
+    cache.  From there it goes to the source with the replica's state,
+    where the status compares it with the source's (see
+    Statusfier.verify()): end-to-end, without another pass.
+
+    Digests are in the context's "hash algorithm", sampled for big
+    files per NBLOCKS, as the source's Hasher does, so they compare.
+"""
+
+import os, re, time, threading, logging
+import config, persistent_dict, scanner, file_state, digests, governor
+import workers
+
+PREFIX = "gc-received: "
+
+
+# rsync escapes unprintable bytes in names as \#ooo
+def unescape(name):
+    return re.sub(r"\\#([0-7]{3})", lambda m: chr(int(m.group(1), 8)), name)
+
+
+class TransferHasher:
+    def __init__(self, path, states_filename, context, nworkers = None):
+        self.logger = logging.getLogger("gc.transfer_hasher")
+        self.config = config.Config.instance()
+        self.context = context
+        self.path = path
+        if nworkers is None:
+            nworkers = int(self.option("hash workers", 1))
+        self.nworkers = nworkers
+        self.algorithm = digests.resolve(self.option("hash algorithm",
+                                                     digests.DEFAULT))
+        self.blocksize = int(self.option("BLOCKSIZE", 2**20))
+        self.nblocks = int(self.option("NBLOCKS", 0))
+        self.throttle = governor.Governor.instance().for_context(context)
+        self.digests = persistent_dict.PersistentDict(
+                scanner.cache_filename(states_filename, "digests"))
+        # the digests, jobs and pool: rsync's reader thread hashes,
+        # the scan thread consumes (or aborts)
+        self.lock = threading.Lock()
+        self.pool = None
+        self.jobs = []          # [ (fqde, Job) ]
+        self.hashed = self.adopted = 0
+
+
+    def option(self, key, default = None):
+        return self.config.getConfig(self.context, key, default)[0]
+
+
+    def out_format(self):
+        return f"--out-format={PREFIX}%i %n"
+
+
+    # rsync.rsync()'s line_callback: True if the line was ours
+    def line(self, text):
+        if not text.startswith(PREFIX):
+            return False
+        itemized, name = text[len(PREFIX):].split(" ", 1)
+        if itemized.startswith(">f"):
+            name = unescape(name)
+            self.submit(scanner.fqde_for(os.path.dirname(name) or ".",
+                                         os.path.basename(name)))
+        return True
+
+
+    # no more than a few jobs per worker in flight, as for the Hasher:
+    # rsync (and its output) waits for us, rather than queueing up
+    # every small file it sends
+    def submit(self, fqde):
+        while True:
+            with self.lock:
+                if len(self.jobs) < 4 * self.nworkers:
+                    if self.pool is None:
+                        self.pool = workers.WorkerPool(self.nworkers,
+                                                       "transfer-hash")
+                    self.jobs.append((fqde, self.pool.submit(self.hash,
+                                                             fqde)))
+                    break
+            self.collect(wait=True)
+        self.collect()
+
+
+    # [ checksum, size, mtime ], or None if it changed while we read it
+    def hash(self, fqde):
+        fname = f"{self.path}/{fqde}"
+        before = os.stat(fname)
+        checksum = file_state.sum_file(fname, self.algorithm, self.blocksize,
+                                       self.nblocks, self.throttle)
+        after = os.stat(fname)
+        if checksum is None or before.st_size != after.st_size \
+                or before.st_mtime_ns != after.st_mtime_ns:
+            return None
+        return [ checksum, after.st_size, after.st_mtime ]
+
+
+    # commits whatever has finished; if wait, at least the oldest job
+    def collect(self, wait = False):
+        if wait:
+            with self.lock:
+                oldest = self.jobs[0][1] if len(self.jobs) > 0 else None
+            if oldest is not None:
+                oldest.finished.wait()
+        with self.lock:
+            finished = [ (fqde, job) for fqde, job in self.jobs \
+                            if job.done() ]
+            self.jobs = [ (fqde, job) for fqde, job in self.jobs \
+                            if not job.done() ]
+            for fqde, job in finished:
+                try:
+                    entry = job.result()
+                except OSError as err:
+                    self.logger.info(f"cannot hash {fqde}: {err}")
+                    continue
+                if entry is not None:
+                    self.digests.data[fqde] = entry
+                    self.digests.dirty = True
+                    self.hashed += 1
+
+
+    # the pull is over: the rest of the digests, and on disk
+    def wait(self):
+        while len(self.jobs) > 0:
+            self.collect(wait=True)
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown()
+        with self.lock:
+            if self.digests.dirty:
+                self.digests.write()
+        if self.hashed > 0:
+            self.logger.info(f"  hashed {self.hashed} files as they came in")
+            self.hashed = 0
+
+
+    # as a Scanner consumer
+    def consume(self, events):
+        with self.lock:
+            for event in events:
+                if event.kind == scanner.DELETED or event.stat is None:
+                    continue
+                entry = self.digests.data.get(event.fqde)
+                if entry is None:
+                    continue
+                checksum, size, mtime = entry
+                if size == event.state["size"] \
+                        and mtime == event.state["mtime"]:
+                    if event.state.get("checksum") != checksum:
+                        event.state["checksum"] = checksum
+                        event.state["checksum_time"] = time.time()
+                    self.adopted += 1
+                del self.digests.data[event.fqde]
+                self.digests.dirty = True
+
+
+    def finish(self):
+        with self.lock:
+            if self.digests.dirty:
+                self.digests.write()
+        if self.adopted > 0:
+            self.logger.info(f"  {self.adopted} transfer digests")
+            self.adopted = 0
+
+
+    # from the scan thread, while rsync's reader may be submitting
+    def abort(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+            self.jobs = []
+        if pool is not None:
+            pool.shutdown(cancelling=True)
@@ -0,0 +1,131 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil, hashlib, threading
+import scanner, transfer_hasher, config, persistent_dict, statusfier
+
+class TestTransferHasherMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for copy in ("source", "replica"):
+            os.makedirs(f"{tempdir}/{copy}/a b")
+            for i in range(5):
+                with open(f"{tempdir}/{copy}/a b/{i}", "w") as f:
+                    f.write(f"file {i}" * i)
+                os.utime(f"{tempdir}/{copy}/a b/{i}", (1000000, 1000000))
+        with open(f"{tempdir}/replica/a b/3", "w") as f:
+            f.write(f"fIle 3" * 3)          # garbled in transit
+        os.utime(f"{tempdir}/replica/a b/3", (1000000, 1000000))
+        config.Config.instance().setConfig(92, "checksums", "False")
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def transfer(self):
+        return transfer_hasher.TransferHasher(f"{tempdir}/replica",
+                                              f"{tempdir}/replica.json", 92)
+
+    def test_transfer(self):
+        transfer = self.transfer()
+        # what rsync --out-format says as the files come in
+        self.assertFalse(transfer.line("sent 1,234 bytes"))
+        self.assertTrue(transfer.line(f"{transfer_hasher.PREFIX}cd+++++++++ "
+                                      f"a b/"))
+        for i in range(5):
+            self.assertTrue(transfer.line(f"{transfer_hasher.PREFIX}"
+                                          f">f+++++++++ a\\#040b/{i}"))
+        transfer.wait()
+        self.assertEqual(len(transfer.digests.data), 5)
+        scn = scanner.Scanner(f"{tempdir}/replica", [],
+                              f"{tempdir}/replica.json", 92)
+        scn.consumers.insert(0, transfer)
+        scn.scan()
+        replica = persistent_dict.PersistentDict(f"{tempdir}/replica.json")
+        self.assertEqual(replica.get("a b/2")["checksum"],
+                         hashlib.sha256(b"file 2file 2").hexdigest())
+        # adopted into the state, so they're dropped from the cache
+        self.assertEqual(len(self.transfer().digests.data), 0)
+
+        # the source confirms them
+        config.Config.instance().setConfig(92, "checksums", "True")
+        scanner.Scanner(f"{tempdir}/source", [], f"{tempdir}/source.json",
+                        92).scan()
+        source = persistent_dict.PersistentDict(f"{tempdir}/source.json")
+        verified, mismatched, rehash = \
+                statusfier.Statusfier().verify(source, replica)
+        self.assertEqual((verified, mismatched, rehash), (4, [ "a b/3" ], 0))
+
+    def test_changed(self):
+        transfer = self.transfer()
+        transfer.line(f"{transfer_hasher.PREFIX}>f+++++++++ a b/4")
+        transfer.wait()
+        with open(f"{tempdir}/replica/a b/4", "a") as f:
+            f.write("more")
+        scn = scanner.Scanner(f"{tempdir}/replica", [],
+                              f"{tempdir}/replica.json", 92)
+        scn.consumers.insert(0, transfer)
+        scn.scan()
+        replica = persistent_dict.PersistentDict(f"{tempdir}/replica.json")
+        self.assertEqual(replica.get("a b/4")["checksum"], "deferred")
+
+    def test_bounded(self):
+        transfer = transfer_hasher.TransferHasher(f"{tempdir}/replica",
+                                    f"{tempdir}/replica.json", 92, 1)
+        go = threading.Event()
+        hash = transfer.hash
+        def held(fqde):
+            go.wait()
+            return hash(fqde)
+        transfer.hash = held
+        def received():
+            for i in range(10):
+                transfer.line(f"{transfer_hasher.PREFIX}>f+++++++++ "
+                              f"a b/{i % 5}")
+        rsync = threading.Thread(target=received)
+        rsync.start()
+        rsync.join(0.2)
+        # rsync waits for the hashing, at 4 jobs a worker
+        self.assertTrue(rsync.is_alive())
+        self.assertEqual(len(transfer.jobs), 4)
+        go.set()
+        rsync.join()
+        transfer.wait()
+        self.assertEqual(len(transfer.jobs), 0)
+        self.assertEqual(len(transfer.digests.data), 5)
+
+    def test_abort(self):
+        transfer = transfer_hasher.TransferHasher(f"{tempdir}/replica",
+                                    f"{tempdir}/replica.json", 92, 1)
+        go = threading.Event()
+        hash = transfer.hash
+        def held(fqde):
+            go.wait()
+            return hash(fqde)
+        transfer.hash = held
+        errors = []
+        def received():
+            try:
+                for i in range(10):
+                    transfer.line(f"{transfer_hasher.PREFIX}>f+++++++++ "
+                                  f"a b/{i % 5}")
+                transfer.wait()
+            except Exception as err:
+                errors.append(err)
+        rsync = threading.Thread(target=received)
+        rsync.start()
+        rsync.join(0.2)
+        # the scan blows up while rsync is still going
+        aborting = threading.Thread(target=transfer.abort)
+        aborting.start()
+        go.set()
+        aborting.join()
+        rsync.join()
+        self.assertEqual(errors, [])
+        self.assertEqual((transfer.jobs, transfer.pool), ([], None))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+                                    TestTransferHasherMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,187 @@
+#! python3.x
+
+"""
+usage:
+    plan = transfer_plan.plan(source_states, replica_states, path, removing)
+    transfer_plan.apply(plan, path)     # then rsync, for what's left
+
+Theory of Operation:
+    Reorganise Movies/ into subfolders and rsync sees a lot of
+    deletes and as many brand-new files: terabytes, again, over wifi.
+    But the replica already has them, under the old names -- and both
+    states say so.  Before the pull:
+
+      vanished: in the replica's state, but not the source's
+      arriving: in the source's state, but not here
+
+    An arriving file is the same content as a vanished one of the same
+    size and mtime (to the second, as rsync keeps it) only if their
+    checksums say so (digests.compare).  Nothing less will do: rsync's
+    quick check would pass over a wrong guess, and the replica would
+    keep the wrong content.  Empty files aren't worth it.
+
+    Only a pull which deletes (--delete) gets rid of vanished files,
+    so only then (removing) is the first arriving path for a vanished
+    file a rename; otherwise, and for any more, it's a local copy
+    (seed.clone) of it.
+
+    Whole directories: if every file the replica has under a directory
+    is renamed to the same place under another one, which doesn't
+    exist yet -- and the source has nothing left under the old one --
+    it's one rename of the directory instead.  Outermost first.
+
+    Off by default; "transfer plan: True" turns it on.
+
+    Everything is done locally, on the replica, then rsync runs as
+    usual: it finds the files where they belong (and fixes up anything
+    else about them), and only sends what's really new.
+"""
+
+import os, logging
+import digests, checksum_cache, seed
+
+
+class Plan:
+    def __init__(self):
+        self.dirs = []          # [ (old dir, new dir) ]
+        self.renames = []       # [ (old, new) ]
+        self.copies = []        # [ (from, new) ]: from is already done
+
+
+    def __len__(self):
+        return len(self.dirs) + len(self.renames) + len(self.copies)
+
+
+
+# "./file" -> "file"; "a/b/file" -> "a/b/file"
+def relative(fqde):
+    return fqde[2:] if fqde.startswith("./") else fqde
+
+
+# removing: the pull will delete what's vanished, so it can be moved
+def plan(source_states, replica_states, path, removing = False):
+    vanished = {}       # relative -> state
+    for fqde, state in replica_states.items():
+        if fqde not in source_states.data and state["size"] > 0:
+            vanished[relative(fqde)] = state
+    arriving = {}
+    for fqde, state in source_states.items():
+        if fqde not in replica_states.data and state["size"] > 0 \
+                and not os.path.lexists(f"{path}/{relative(fqde)}"):
+            arriving[relative(fqde)] = state
+    candidates = {}     # (size, mtime) -> [ relative ]
+    for rel, state in vanished.items():
+        candidates.setdefault(identity(state), []).append(rel)
+    result = Plan()
+    moved_to = {}       # old -> new
+    for new in sorted(arriving):
+        state = arriving[new]
+        old = match(new, state, candidates.get(identity(state), []),
+                    vanished, moved_to)
+        if old is None:
+            continue
+        if old in moved_to:
+            result.copies.append((moved_to[old], new))
+        elif not removing:
+            result.copies.append((old, new))
+        else:
+            moved_to[old] = new
+    result.dirs = whole_dirs(moved_to, vanished, source_states, path)
+    for old, new in sorted(moved_to.items()):
+        if not any([ under(old, dir) for dir, to in result.dirs ]):
+            result.renames.append((old, new))
+    return result
+
+
+def identity(state):
+    return (state["size"], int(state["mtime"]))
+
+
+# the vanished file which is arriving at new, or None
+def match(new, state, candidates, vanished, moved_to):
+    # not yet renamed first: they're free
+    candidates = sorted(candidates, key=lambda rel: rel in moved_to)
+    confirmed = [ rel for rel in candidates \
+                    if same(state, vanished[rel]) is True ]
+    if len(confirmed) == 0:
+        return None
+    named = [ rel for rel in confirmed \
+                if os.path.basename(rel) == os.path.basename(new) ]
+    return (named + confirmed)[0]
+
+
+# True / False by checksum; None if they can't say
+def same(state, other):
+    checksum, theirs = state.get("checksum"), other.get("checksum")
+    if not checksum_cache.known(checksum) \
+            or not checksum_cache.known(theirs):
+        return None
+    return digests.compare(checksum, theirs)
+
+
+def under(rel, dir):
+    return rel.startswith(f"{dir}/")
+
+
+# [ (old dir, new dir) ] which move as a whole, outermost first
+def whole_dirs(moved_to, vanished, source_states, path):
+    pairs = set()
+    for old, new in moved_to.items():
+        o, n = old.split("/"), new.split("/")
+        j = 1
+        # the parts they have in common at the end, but the name
+        while j < min(len(o), len(n)) and o[-j] == n[-j]:
+            pairs.add(("/".join(o[:-j]), "/".join(n[:-j])))
+            j += 1
+    source_dirs = set()
+    for fqde, state in source_states.items():
+        dir = os.path.dirname(relative(fqde))
+        while dir != "" and dir not in source_dirs:
+            source_dirs.add(dir)
+            dir = os.path.dirname(dir)
+    moves = []
+    for old, new in sorted(pairs, key=lambda pair: pair[0].count("/")):
+        if any([ old == dir or under(old, dir) for dir, to in moves ]) \
+                or old in source_dirs or under(new, old) or under(old, new) \
+                or os.path.lexists(f"{path}/{new}"):
+            continue
+        inside = [ rel for rel in vanished if under(rel, old) ]
+        if len(inside) > 0 and all([ \
+                    moved_to.get(rel) == new + rel[len(old):] \
+                        for rel in inside ]):
+            moves.append((old, new))
+    return moves
+
+
+# carries out plan in path; (dirs, renames, copies) done
+def apply(plan, path):
+    logger = logging.getLogger("gc.transfer_plan")
+    done = [ 0, 0, 0 ]
+    for n, moves in enumerate([ plan.dirs, plan.renames ]):
+        for old, new in moves:
+            if not os.path.lexists(f"{path}/{old}") \
+                    or os.path.lexists(f"{path}/{new}"):
+                continue
+            try:
+                os.makedirs(os.path.dirname(f"{path}/{new}"), exist_ok=True)
+                os.rename(f"{path}/{old}", f"{path}/{new}")
+                done[n] += 1
+            except OSError as err:
+                logger.warn(f"cannot move {old} to {new}: {err}")
+    for src, new in plan.copies:
+        tmpfile = f"{path}/{new}{seed.TMP_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(f"{path}/{new}"), exist_ok=True)
+            seed.clone(f"{path}/{src}", tmpfile)
+            srcstat = os.stat(f"{path}/{src}")
+            os.utime(tmpfile, ns=(srcstat.st_atime_ns, srcstat.st_mtime_ns))
+            os.rename(tmpfile, f"{path}/{new}")
+            done[2] += 1
+        except OSError as err:
+            logger.warn(f"cannot copy {src} to {new}: {err}")
+            if os.path.lexists(tmpfile):
+                os.unlink(tmpfile)
+    if sum(done) > 0:
+        logger.info(f"  moved {done[0]} directories and {done[1]} files, " \
+                    f"copied {done[2]} files, before the pull")
+    return tuple(done)
@@ -0,0 +1,94 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil
+import scanner, transfer_plan, config, persistent_dict
+
+class TestTransferPlanMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        config.Config.instance().setConfig(91, "checksums", "False")
+
+    def tearDown(self):
+        shutil.rmtree(tempdir)
+
+    def tree(self, copy, files):
+        for name, content in files.items():
+            fname = f"{tempdir}/{copy}/{name}"
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, "w") as f:
+                f.write(content)
+            os.utime(fname, (1000000, 1000000))
+        scanner.Scanner(f"{tempdir}/{copy}", [], f"{tempdir}/{copy}.json",
+                        91).scan()
+        return persistent_dict.PersistentDict(f"{tempdir}/{copy}.json")
+
+    def test_plan(self):
+        config.Config.instance().setConfig(91, "checksums", "True")
+        replica = self.tree("replica", {
+                    "old/a.mkv" : "a" * 10, "old/b.mkv" : "b" * 20,
+                    "old/deep/c.mkv" : "c" * 30, "misc/d.mkv" : "d" * 40,
+                    "misc/e.mkv" : "e" * 50, "keep/f.mkv" : "f" * 60 })
+        source = self.tree("source", {
+                    "new/a.mkv" : "a" * 10, "new/b.mkv" : "b" * 20,
+                    "new/deep/c.mkv" : "c" * 30, "archive/d.mkv" : "d" * 40,
+                    "sorted/d.mkv" : "d" * 40, "misc/e.mkv" : "e" * 50,
+                    "keep/f.mkv" : "f" * 60, "keep/g.mkv" : "f" * 61 })
+        plan = transfer_plan.plan(source, replica, f"{tempdir}/replica",
+                                  True)
+        self.assertEqual(plan.dirs, [ ("old", "new") ])
+        self.assertEqual(plan.renames, [ ("misc/d.mkv", "archive/d.mkv") ])
+        self.assertEqual(plan.copies, [ ("archive/d.mkv", "sorted/d.mkv") ])
+        self.assertEqual(transfer_plan.apply(plan, f"{tempdir}/replica"),
+                         (1, 1, 1))
+        for name in ("new/a.mkv", "new/deep/c.mkv", "archive/d.mkv",
+                     "sorted/d.mkv", "misc/e.mkv"):
+            self.assertTrue(os.path.exists(f"{tempdir}/replica/{name}"))
+        for name in ("old", "misc/d.mkv", "keep/g.mkv"):
+            self.assertFalse(os.path.exists(f"{tempdir}/replica/{name}"))
+        self.assertEqual(os.stat(f"{tempdir}/replica/sorted/d.mkv").st_mtime,
+                         1000000)
+        # done: nothing more to do
+        replica = self.tree("replica", {})
+        self.assertEqual(len(transfer_plan.plan(source, replica,
+                                                f"{tempdir}/replica", True)),
+                         0)
+
+    def test_keeping(self):
+        config.Config.instance().setConfig(91, "checksums", "True")
+        replica = self.tree("replica", { "old/a.mkv" : "a" * 10 })
+        source = self.tree("source", { "new/a.mkv" : "a" * 10 })
+        # the pull won't delete: nor do we
+        plan = transfer_plan.plan(source, replica, f"{tempdir}/replica")
+        self.assertEqual((plan.dirs, plan.renames), ([], []))
+        self.assertEqual(plan.copies, [ ("old/a.mkv", "new/a.mkv") ])
+        self.assertEqual(transfer_plan.apply(plan, f"{tempdir}/replica"),
+                         (0, 0, 1))
+        for name in ("old/a.mkv", "new/a.mkv"):
+            self.assertTrue(os.path.exists(f"{tempdir}/replica/{name}"))
+
+    def test_unconfirmed(self):
+        # same name, size and mtime isn't enough without checksums
+        replica = self.tree("replica", { "old/a.mkv" : "a" * 10 })
+        source = self.tree("source", { "new/a.mkv" : "b" * 10 })
+        self.assertEqual(len(transfer_plan.plan(source, replica,
+                                                f"{tempdir}/replica", True)),
+                         0)
+
+    def test_checksums(self):
+        config.Config.instance().setConfig(91, "checksums", "True")
+        replica = self.tree("replica", {
+                    "x/one.mkv" : "1" * 10, "x/two.mkv" : "2" * 10 })
+        source = self.tree("source", {
+                    "y/uno.mkv" : "1" * 10, "y/two.mkv" : "3" * 10 })
+        plan = transfer_plan.plan(source, replica, f"{tempdir}/replica",
+                                  True)
+        # renamed, as the checksums say; the same name isn't enough
+        self.assertEqual(plan.renames, [ ("x/one.mkv", "y/uno.mkv") ])
+        self.assertEqual(plan.dirs, [])
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(
+                                    TestTransferPlanMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
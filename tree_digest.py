@@ -0,0 +1,150 @@
+#! python3.x
+
+"""
+usage:
+    scn.add_consumer(tree_digest.TreeDigests(scn.states))  # "tree digests"
+    tree = tree_digest.tree_of(states)          # None if there isn't one
+    tree_digest.identical(tree, other)          # O(1)
+    tree_digest.differing(tree, other)          # [ dir ]
+
+Theory of Operation:
+    Every directory in a state gets two digests, kept in the state's
+    metadata (so they travel with it to the other hosts):
+
+        files: its own files' (name, size, mtime) -- or checksum, with
+               "tree digest by: checksum"
+        tree:  files, plus each subdirectory's (name, tree)
+
+    like a Merkle tree over the directory tree.  Equal roots mean the
+    two states describe the same files: a replica can be declared
+    identical to its source without going through 2M entries.  If not,
+    differing() goes down only where the trees differ, and names the
+    directories whose own files do (or which only one side has).
+
+    mtimes are compared in whole seconds, as rsync does; both sides
+    have to digest "by" the same thing for the digests to agree.
+"""
+
+import hashlib, logging
+import scanner
+
+TREE = "tree"
+TREE_BY = "tree by"
+
+
+def token(fqde, state, by):
+    name = fqde.rsplit("/", 1)[-1]
+    if by == "checksum":
+        detail = state.get("checksum", "deferred")
+    else:
+        detail = int(state["mtime"])
+    return f"{name}\0{state['size']}\0{detail}"
+
+
+def digest(parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8", "surrogateescape"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+# { dir : [ tree, files ] } for states' items
+def compute(items, by = "mtime"):
+    tokens = {}         # dir -> [ token ]
+    for fqde, state in items:
+        tokens.setdefault(scanner.dirname(fqde), []).append(
+                                                    token(fqde, state, by))
+    subdirs = {}        # dir -> [ subdir ]
+    dirs = set([ "." ])
+    for dir in list(tokens.keys()):
+        while dir not in dirs:
+            dirs.add(dir)
+            subdirs.setdefault(parent(dir), []).append(dir)
+            dir = parent(dir)
+    tree = {}
+    # deepest first, so the subdirectories are done
+    for dir in sorted(dirs, key=lambda dir: -len(scanner.walk_key(dir))):
+        files = digest(sorted(tokens.get(dir, [])))
+        children = sorted([ f"{subdir.rsplit('/', 1)[-1]}\0{tree[subdir][0]}" \
+                                for subdir in subdirs.get(dir, []) ])
+        tree[dir] = [ digest([ files ] + children), files ]
+    return tree
+
+
+def tree_of(states):
+    metadata = states.data.get(states.metadata_key)
+    if not isinstance(metadata, dict) or TREE not in metadata:
+        return None
+    return metadata
+
+
+def identical(tree, other):
+    return tree is not None and other is not None \
+            and tree.get(TREE_BY) == other.get(TREE_BY) \
+            and tree[TREE]["."][0] == other[TREE]["."][0]
+
+
+# [ dir ] whose own files differ between the two, or which only one of
+# them has (and everything under it); only goes down where the trees
+# differ
+def differing(tree, other):
+    mine, theirs = tree[TREE], other[TREE]
+    subdirs = {}
+    for dirs in (mine, theirs):
+        for dir in dirs:
+            if dir != ".":
+                subdirs.setdefault(parent(dir), set()).add(dir)
+    found = []
+    pending = [ "." ]
+    while len(pending) > 0:
+        dir = pending.pop()
+        a, b = mine.get(dir), theirs.get(dir)
+        if a is None or b is None:
+            found.append(dir)
+            pending += subdirs.get(dir, [])
+        elif a[0] != b[0]:
+            if a[1] != b[1]:
+                found.append(dir)
+            pending += subdirs.get(dir, [])
+    return sorted(found, key=scanner.walk_key)
+
+
+def parent(dir):
+    return dir.rsplit("/", 1)[0] if "/" in dir else "."
+
+
+
+# a Scanner consumer: brings the state's tree digests up to date at
+# the end of each scan, if anything changed
+class TreeDigests:
+    def __init__(self, states, by = "mtime"):
+        self.logger = logging.getLogger("gc.tree_digest")
+        self.states = states
+        self.by = by
+        self.changed = False
+
+
+    def consume(self, events):
+        if not self.changed:
+            for event in events:
+                if event.kind != scanner.UNCHANGED:
+                    self.changed = True
+                    break
+
+
+    def finish(self):
+        metadata = tree_of(self.states)
+        # checksums may have come in since (the Hasher)
+        if not self.changed and self.by != "checksum" \
+                and metadata is not None and metadata.get(TREE_BY) == self.by:
+            return
+        metadata = self.states.data.get(self.states.metadata_key)
+        if not isinstance(metadata, dict):
+            metadata = {}
+        metadata[TREE] = compute(self.states.items(), self.by)
+        metadata[TREE_BY] = self.by
+        self.states.data[self.states.metadata_key] = metadata
+        self.states.touch(self.states.metadata_key)
+        self.states.write()
+        self.changed = False
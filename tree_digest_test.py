@@ -0,0 +1,91 @@
+#!/usr/local/bin/python3.6
+
+import unittest, os, tempfile, shutil
+from unittest import mock
+import scanner, tree_digest, persistent_dict, statusfier, config
+
+class TestTreeDigestMethods(unittest.TestCase):
+
+    def setUp(self):
+        global tempdir
+        tempdir = tempfile.mkdtemp()
+        for copy in ("source", "replica"):
+            for dir in ("a/b", "a/c", "d"):
+                os.makedirs(f"{tempdir}/{copy}/{dir}")
+                for i in range(3):
+                    fname = f"{tempdir}/{copy}/{dir}/{i}"
+                    with open(fname, "w") as f:
+                        f.write(f"{dir} {i}")
+                    os.utime(fname, (1000000, 1000000))
+            with open(f"{tempdir}/{copy}/top", "w") as f:
+                f.write("top")
+            os.utime(f"{tempdir}/{copy}/top", (1000000, 1000000))
+
+        config.Config.instance().setOption("tree digests", "True")
+
+    def tearDown(self):
+        config.Config.instance().setOption("tree digests", "False")
+        shutil.rmtree(tempdir)
+
+    def scan(self, copy):
+        statefile = f"{tempdir}/{copy}.json"
+        scanner.Scanner(f"{tempdir}/{copy}", [], statefile).scan()
+        return persistent_dict.PersistentDict(statefile)
+
+    def test_identical(self):
+        source, replica = self.scan("source"), self.scan("replica")
+        self.assertTrue(tree_digest.identical(tree_digest.tree_of(source),
+                                              tree_digest.tree_of(replica)))
+        self.assertEqual(statusfier.Statusfier().differing(source, replica),
+                         [])
+        # the metadata isn't a file: it survives the next scan
+        source = self.scan("source")
+        self.assertIsNotNone(tree_digest.tree_of(source))
+        self.assertNotIn("__metadata__", dict(source.items()))
+
+    def test_differing(self):
+        with open(f"{tempdir}/replica/a/c/1", "a") as f:
+            f.write("more")
+        os.makedirs(f"{tempdir}/replica/d/e/f")
+        with open(f"{tempdir}/replica/d/e/f/extra", "w") as f:
+            f.write("extra")
+        source, replica = self.scan("source"), self.scan("replica")
+        source_tree = tree_digest.tree_of(source)
+        replica_tree = tree_digest.tree_of(replica)
+        self.assertFalse(tree_digest.identical(source_tree, replica_tree))
+        self.assertEqual(tree_digest.differing(source_tree, replica_tree),
+                         [ "a/c", "d/e", "d/e/f" ])
+        overage = statusfier.Statusfier().replica_overage(source, replica)
+        self.assertIn("d/e/f/extra", overage)
+
+    def test_inspect(self):
+        cfg = config.Config.instance()
+        cfg.setOption("checksums", "True")
+        cfg.setOption("tree digest by", "checksum")
+        try:
+            source, replica = self.scan("source"), self.scan("replica")
+        finally:
+            cfg.setOption("checksums", "False")
+            cfg.setOption("tree digest by", "mtime")
+        status = statusfier.Statusfier()
+        with mock.patch.object(status, "differing",
+                               wraps=status.differing) as differing, \
+                mock.patch.object(status, "verify",
+                                  wraps=status.verify) as verify:
+            msg = status.inspect_replica("replica", source, replica)
+        self.assertIn("Identical to source", msg)
+        self.assertEqual(differing.call_count, 1)
+        # the checksums agree, by the roots: nothing to go through
+        self.assertEqual(verify.call_args[0][2], [])
+        self.assertNotIn("verified", msg)
+        # by mtime, they can't say: it goes through the lot
+        source, replica = self.scan("source"), self.scan("replica")
+        with mock.patch.object(status, "verify",
+                               wraps=status.verify) as verify:
+            status.inspect_replica("replica", source, replica)
+        self.assertEqual(len(verify.call_args[0]), 2)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTreeDigestMethods)
+    unittest.TextTestRunner(verbosity=2).run(suite)
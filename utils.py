@@ -53,6 +53,18 @@ def str_to_duration(string):
     return total
 
 
+# "10m" -> 10485760; "500k" -> 512000; "1g", "2t"; plain numbers are bytes
+def str_to_bytes(string):
+    string = str(string).strip().lower().rstrip("b")
+    scale = 1
+    for suffix, power in (("k", 10), ("m", 20), ("g", 30), ("t", 40)):
+        if string.endswith(suffix):
+            scale = 2**power
+            string = string[:-1]
+            break
+    return int(float(string) * scale)
+
+
 import unittest
 class TestMyMethods(unittest.TestCase):
     def setUp(self):
@@ -76,6 +88,12 @@ class TestMyMethods(unittest.TestCase):
         self.assertEqual(duration_to_str(3600 + 60), "1h60s")
         self.assertEqual(duration_to_str(3600 + 60 + 1), "1h1m1s")
 
+    def test_str_to_bytes(self):
+        self.assertEqual(str_to_bytes("512"), 512)
+        self.assertEqual(str_to_bytes("10m"), 10*2**20)
+        self.assertEqual(str_to_bytes("1.5k"), 1536)
+        self.assertEqual(str_to_bytes("2GB"), 2*2**30)
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestMyMethods)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,102 @@
+#! python3.x
+
+"""
+usage:
+    import workers
+    pool = workers.WorkerPool(4)
+    job = pool.submit(os.stat, "somefile")
+    ...
+    job.result()    # waits; re-raises whatever the call raised
+    pool.shutdown()
+
+A minimal thread pool.  concurrent.futures and multiprocessing both
+import the stdlib queue module, which our queue.py shadows when we
+run from this directory -- so we roll our own with threading.
+"""
+
+import threading, collections, logging
+
+
+class Job:
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.value = None
+        self.error = None
+        self.cancelled = False
+        self.finished = threading.Event()
+
+
+    def run(self):
+        if not self.cancelled:
+            try:
+                self.value = self.fn(*self.args, **self.kwargs)
+            except BaseException as err:
+                self.error = err
+        self.finished.set()
+
+
+    # a Job which hasn't started yet will never run
+    def cancel(self):
+        self.cancelled = True
+
+
+    def done(self):
+        return self.finished.is_set()
+
+
+    def result(self):
+        self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+
+class WorkerPool:
+    def __init__(self, nworkers, name = "worker"):
+        self.logger = logging.getLogger("gc.WorkerPool")
+        self.jobs = collections.deque()
+        self.lock = threading.Condition()
+        self.running = True
+        self.threads = []
+        for i in range(nworkers):
+            thread = threading.Thread(target=self.work,
+                                      name=f"{name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+
+    def work(self):
+        while True:
+            with self.lock:
+                while self.running and len(self.jobs) == 0:
+                    self.lock.wait()
+                if len(self.jobs) == 0:
+                    return
+                job = self.jobs.popleft()
+            job.run()
+
+
+    def submit(self, fn, *args, **kwargs):
+        job = Job(fn, args, kwargs)
+        with self.lock:
+            if not self.running:
+                raise RuntimeError("submit() after shutdown()")
+            self.jobs.append(job)
+            self.lock.notify()
+        return job
+
+
+    # finishes (or, if cancelling, drops) whatever is queued, then
+    # waits for the workers to exit
+    def shutdown(self, cancelling = False):
+        with self.lock:
+            self.running = False
+            if cancelling:
+                for job in self.jobs:
+                    job.cancel()
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()